@@ -35,7 +35,7 @@ local_tz = pendulum.timezone(config.DWH_TIMEZONE)
 logger = LoggingHelper.get_configured_logger(__name__)
 redis = RedisHelper(logger=logger, redis_host=config.REDIS_HOST, redis_port=config.REDIS_PORT)
 gcs = GCSHelper(logger=logger, bucket_name=config.BUCKET_NAME)
-bq = BQHelper(logger=logger)
+bq = BQHelper(logger=logger, redis=redis)
 mongodb = MongoDBHeler(logger=logger)
 
 amis = AmisWebHelper(logger=logger, redis=redis, mongodb=mongodb)
@@ -27,7 +27,7 @@ local_tz = pendulum.timezone(config.DWH_TIMEZONE)
 logger = LoggingHelper.get_configured_logger(DAHAHI_NAMESPACE)
 redis = RedisHelper(logger=logger, redis_host=config.REDIS_HOST, redis_port=config.REDIS_PORT)
 dahahi = DahahiHelper(logger=logger)
-bq = BQHelper(logger=logger)
+bq = BQHelper(logger=logger, redis=redis)
 
 mapping_etl = {
     EMPLOYEES: DahahiEmployeesETL,
@@ -45,7 +45,7 @@ local_tz = pendulum.timezone(config.DWH_TIMEZONE)
 logger = LoggingHelper.get_configured_logger(__name__)
 redis = RedisHelper(logger=logger, redis_host=config.REDIS_HOST, redis_port=config.REDIS_PORT)
 gcs = GCSHelper(logger=logger, bucket_name=config.BUCKET_NAME)
-bq = BQHelper(logger=logger)
+bq = BQHelper(logger=logger, redis=redis)
 mongodb = MongoDBHeler(logger=logger)
 
 eshop = EshopHelper(logger=logger, redis=redis)
@@ -91,6 +91,9 @@ def contruct_params():
                 "load": True
             }              
         })
+    # Transform pages on the fly and load them from a local Parquet spill instead of the MongoDB staging collection
+    for table in [INVOICES, INVENTORY_ITEMS]:
+        params[table]["spill"] = False
     return params
 
 def call_python_etl(namespace, table_name, task_name, vars, **kwargs):
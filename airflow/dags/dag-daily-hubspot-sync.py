@@ -35,7 +35,7 @@ local_tz = pendulum.timezone(config.DWH_TIMEZONE)
 logger = LoggingHelper.get_configured_logger(HUBSPOT_NAMESPACE)
 redis = RedisHelper(logger=logger, redis_host=config.REDIS_HOST, redis_port=config.REDIS_PORT)
 hub_spot = HubspotHelper(logger=logger, redis=redis)
-bq = BQHelper(logger=logger)
+bq = BQHelper(logger=logger, redis=redis)
 
 mapping_etl = {
     CONTACTS: HubspotContactsETL,
@@ -107,7 +107,7 @@ def refresh_hubspot_token(**kwargs):
     if ttl <= 0:
         raise ValueError(f"HubSpot access token already expired or TTL too small: expiresAt={token_info['expiresAt']}")
 
-    redis.put_cached_value_for_key(config.HUBSPOT_ACCESS_TOKEN_REDIS, access_token, expire_time=ttl)
+    hub_spot.token.put(access_token, ttl)
     logger.info(f"Cached HubSpot access token in Redis with TTL {ttl}s")
 
 default_args = {
@@ -36,8 +36,8 @@ USERS = 'users'
 local_tz = pendulum.timezone(config.DWH_TIMEZONE)
 
 logger = LoggingHelper.get_configured_logger(__name__)
-bq = BQHelper(logger=logger)
 redis = RedisHelper(logger=logger, redis_host=config.REDIS_HOST, redis_port=config.REDIS_PORT)
+bq = BQHelper(logger=logger, redis=redis)
 
 pancake = PancakeHelper(logger=logger)
 
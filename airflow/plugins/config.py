@@ -27,6 +27,17 @@ class AppConfig(object):
 
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = os.getenv("REDIS_PORT", 6379)
+    REDIS_BATCH_SIZE = 1000 # values per RPUSH/LRANGE/MGET round trip
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50)) # per worker process and endpoint
+    REDIS_POOL_TIMEOUT = 20 # seconds to wait for a free connection when the pool is exhausted
+    REDIS_SOCKET_TIMEOUT = 30
+    REDIS_HEALTH_CHECK_INTERVAL = 30
+    REDIS_LOCK_REDIS = "LOCK"
+    REDIS_LOCK_FENCE_REDIS = "LOCK_FENCE"
+    REDIS_LOCK_FENCE_TTL = 604800 # a fencing token counter is dropped after a week unused
+    REDIS_LOCK_TTL = 30 # seconds a lock outlives a holder which stopped renewing it
+    REDIS_LOCK_TIMEOUT = 60 # seconds to wait for the holder of a lock
+    REDIS_LOCK_POLL_INTERVAL = 0.2
 
     PROJECT_ID = os.getenv("PROJECT_ID", "unknown")
     DATASET_ID = os.getenv("DATASET_ID", "unknown")
@@ -39,6 +50,13 @@ class AppConfig(object):
     PREFIX_JSON_FILE = "json"
 
     HTTP_CODE_RETRY = [500, 502, 503, 504]
+    HTTP_POOL_MAXSIZE = 10 # keep-alive connections kept per host and session
+    HTTP_MAX_PER_HOST = 10 # requests in flight per host for the whole worker process
+    HTTP_TOTAL_RETRY = 5
+    HTTP_BACKOFF_FACTOR = 0.5
+    HTTP_BACKOFF_JITTER = 0.5 # up to this share of the backoff is added at random
+    ASYNC_HTTP_MAX_CONNECTIONS = 20 # per async client
+    ASYNC_HTTP_CONCURRENCY = 5 # pages or items in flight per async generator
 
     # MISA Eshop
     ESHOP_DOMAIN = os.getenv("ESHOP_DOMAIN", "unknown")
@@ -47,14 +65,14 @@ class AppConfig(object):
     ESHOP_URL = os.getenv("ESHOP_URL", "unknown")
     ESHOP_ACCESS_TOKEN_REDIS = "ESHOP_ACCESS_TOKEN_REDIS"
     ESHOP_ACCESS_TOKEN_TTL = 43200 # 12 hours, Misa Eshop expire 24h
-    ESHOP_COMPANY_CODE_REDIS = "ESHOP_COMPANY_CODE_REDIS"
-    ESHOP_ENVIRONMENT_REDIS = "ESHOP_ENVIRONMENT_REDIS"
     ESHOP_PAGE_LIMIT = 100
     ESHOP_REQUEST_TIMEOUT = 30
     ESHOP_TOTAL_RETRY = 5
     ESHOP_BACKOFF_FACTOR = 0.1
-    ESHOP_INVOICE_LATEST_PAGE_REDIS = "ESHOP_INVOICE_LATEST_PAGE_REDIS"
-    ESHOP_INVENTORY_LATEST_PAGE_REDIS = "ESHOP_INVENTORY_LATEST_PAGE_REDIS"
+    ESHOP_POOL_MAXSIZE = 20 # keep >= ESHOP_DETAIL_MAX_WORKERS so workers don't wait for a connection
+    ESHOP_DETAIL_MAX_WORKERS = 10
+    ESHOP_DETAIL_BATCH_SIZE = 100
+    ESHOP_SPILL_FLUSH_PAGES = 50 # pages buffered on disk before loading them to the staging table
 
     # MISA Amis
     AMIS_URL = os.getenv("AMIS_URL", "unknown")
@@ -66,11 +84,14 @@ class AppConfig(object):
     AMIS_PAGE_LIMIT = 100
     AMIS_REQUEST_TIMEOUT = 30
     # MISA Amis Web
-    AMIS_WEB_URL = "https://actapp.misa.vn"
+    AMIS_WEB_URL = os.getenv("AMIS_WEB_URL", "https://actapp.misa.vn")
     AMIS_WEB_REQUEST_TIMEOUT = 30
-    AMIS_WEB_ACCESS_TOKEN_REDIS = "AMIS_ACCESS_TOKEN_REDIS"
+    AMIS_WEB_ACCESS_TOKEN_REDIS = "AMIS_WEB_ACCESS_TOKEN_REDIS"
     AMIS_WEB_COLLECTION = "amis_config"
     AMIS_WEB_PAGE_LIMIT = 20
+    AMIS_WEB_MAX_WORKERS = 5
+    AMIS_WEB_MAX_RETRY = 3
+    AMIS_WEB_RETRY_DELAY = 2 # seconds, multiplied by the attempt number
 
     HUBSPOT_APP_TOKEN = os.getenv("HUBSPOT_APP_TOKEN", "unknown")
     # HubSpot CLI (personal access key) auth: the CLI exchanges this long-lived key
@@ -86,6 +107,13 @@ class AppConfig(object):
     HUBSPOT_ACCOUNT_ID = 1774127
     HUBSPOT_API_TIMEOUT = 300
     HUBSPOT_MAX_PAGES = 100
+    HUBSPOT_SEARCH_RESULT_CAP = 10000 # a search stops paging after 10k results
+    HUBSPOT_SEARCH_MAX_WORKERS = 3 # search endpoints are limited to 5 requests/second per account
+    HUBSPOT_ASSOCIATION_BATCH_SIZE = 1000 # max inputs of a v4 associations batch read
+    HUBSPOT_ASSOCIATION_MAX_WORKERS = 3
+    HUBSPOT_WATERMARK_OVERLAP = 3600000 # ms re-read before the watermark, the search index lags behind updates
+    PREFIX_JSON_NAME = "data"
+    PREFIX_ASSOCIATION_NAME = "association"
 
     DAHAHI_BASE_URL = os.getenv("DAHAHI_BASE_URL", "https://sapp.dahahi.vn")
     DAHAHI_APP_KEY = os.getenv("DAHAHI_APP_KEY", "unknown")
@@ -96,6 +124,9 @@ class AppConfig(object):
 
     DWH_TIMEZONE = 'Asia/Ho_Chi_Minh'
     DWH_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    BQ_SCHEMA_CACHE_REDIS = "BQ_SCHEMA"
+    BQ_SCHEMA_CACHE_TTL = 3600 # seconds
+    BQ_STORAGE_WRITE_BATCH_ROWS = 10000 # rows per AppendRows request, a request must stay under 10MB
 
     NEW_DATA = "has_new_data"
 
@@ -106,10 +137,37 @@ class AppConfig(object):
     MONGODB_CONN = f"mongodb://{MONGODB_USER}:{MONGODB_PASSWORD}@{MONGODB_HOST}:{MONGODB_PORT}/"
     MONGODB_STAGING = "staging"
     MONGODB_CACHING = "caching"
+    MONGODB_BULK_BATCH_SIZE = 1000
+    MONGODB_FIND_BATCH_SIZE = 10000
+    MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 10)) # per worker process
+    MONGODB_MIN_POOL_SIZE = 0
+    MONGODB_MAX_IDLE_TIME_MS = 60000
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = 30000
+
+    SPILL_DIR = os.getenv("SPILL_DIR", "/tmp/spill")
+    SPILL_CHUNK_ROWS = 50000
+
+    WATERMARK_REDIS = "WATERMARK"
+    WATERMARK_PENDING_REDIS = "WATERMARK_PENDING"
+    WATERMARK_PENDING_TTL = 86400 # staged marks not committed by a load within a day are dropped
+
+    TOKEN_REFRESH_MARGIN = 300 # seconds before expiry at which a worker logs in again
+
+    CHECKPOINT_REDIS = "CHECKPOINT"
+    CHECKPOINT_TTL = 86400 # longer than all retries of a task instance
+    FINGERPRINT_FIELD = "_fingerprint"
 
     DISCORD_WEBHOOK = os.getenv("DISCORD_WEBHOOK", "unknown")
 
+    PANCAKE_BASE_URL = os.getenv("PANCAKE_BASE_URL", "https://pages.fm/api/public_api")
     PANCAKE_TIMEOUT = 30
+    PANCAKE_REQUESTS_PER_SECOND = 5 # max rate per page_id shared by all workers, lowered adaptively on 429/5xx
+    PANCAKE_MIN_REQUESTS_PER_SECOND = 0.5
+    PANCAKE_MAX_RETRY = 5
+    PANCAKE_MESSAGES_MAX_WORKERS = 5
+    PANCAKE_WATERMARK_OVERLAP = 3600 # seconds re-read before the watermark of a page
+    PANCAKE_CONVERSATIONS_FLUSH_PAGES = 10 # pages loaded to staging and checkpointed together
+    PANCAKE_MESSAGES_CHECKPOINT_SIZE = 100 # conversations loaded to staging and checkpointed together
 
     TTC_OUT_FACEBOOK_ID = env.ttc_out_facebook_sheet_id
     TTC_SURVEY_ID = env.ttc_survey_sheet_id
@@ -4,9 +4,11 @@ import hmac
 import hashlib
 from requests.exceptions import HTTPError, RequestException
 from urllib import request, parse
+from helper.http_helper import get_session
 from config import config
 from logging import Logger
 from helper.redis_helper import RedisHelper, RedisError
+from helper.token_helper import get_token_manager
 import helper.time_helper as TimeHelper
 import copy
 
@@ -22,12 +24,11 @@ DICTIONARY = {
 
 class AmisHelper:
 
-    session = None
-
     def __init__(self, logger: Logger, redis: RedisHelper):
         self.logger = logger
         self.redis = redis
         self.session = self.request_session()
+        self.token = get_token_manager(logger, redis, config.AMIS_ACCESS_TOKEN_REDIS, fetch=self._get_access_token)
     
     @property
     def headers(self):
@@ -40,37 +41,21 @@ class AmisHelper:
 
     @property
     def access_token(self):
-        try:
-            _cached_token = self.redis.get_cached_value_for_key(config.AMIS_ACCESS_TOKEN_REDIS)
-            if _cached_token:
-                self.logger.debug(f"Get access token from Redis cache: {_cached_token}")
-                return _cached_token
-            else:
-                _access_token = self._get_access_token()
-                self.logger.debug(f"Get access token from Amis: {_access_token}")
-                return _access_token
-            
-        except RedisError as re:
-            raise re
-        except HTTPError as he:
-            raise he
-        except Exception as e:
-            raise e
+        return self.token.get()
 
     def request_session(self):
         """
-        Create a session with retry handling
+        Return the session shared by every AmisHelper, with pooled keep-alive connections and retry handling
 
-        :param session (_type_, optional): user session.
         :returns session: request session
         """
-        if self.session is None:
-            session = requests.Session()
-        return session
+        return get_session("amis")
 
     def _get_access_token(self):
         """
         API Doc: https://actdocs.misa.vn/g2/graph/ACTOpenAPIHelp/index.html#2-1
+
+        :returns: (access token, ttl in seconds)
         """
         url = f"{config.AMIS_URL}/api/oauth/actopen/connect"
         headers = {
@@ -83,7 +68,7 @@ class AmisHelper:
         }
 
         try:
-            response = requests.post(url=url, headers=headers, json=payload, timeout=config.AMIS_REQUEST_TIMEOUT)
+            response = self.session.post(url=url, headers=headers, json=payload, timeout=config.AMIS_REQUEST_TIMEOUT)
             response_json = response.json()
 
             if response.status_code == 200 and response_json.get("Success"):
@@ -91,10 +76,8 @@ class AmisHelper:
                 data = json.loads(data_raw)
 
                 access_token = data.get("access_token")
-                
-                self.redis.put_cached_value_for_key(config.AMIS_ACCESS_TOKEN_REDIS, access_token, config.AMIS_ACCESS_TOKEN_TTL)
 
-                return access_token
+                return access_token, config.AMIS_ACCESS_TOKEN_TTL
 
             else:
                 message = f"Error when getting access token from Amis API, status_code: {response.status_code}, error: {response.text}"
@@ -4,9 +4,11 @@ import hmac
 import hashlib
 from requests.exceptions import HTTPError, RequestException
 from urllib import request, parse
+from helper.http_helper import get_session
 from config import config
 from logging import Logger
 from helper.redis_helper import RedisHelper, RedisError
+from helper.token_helper import get_token_manager
 import helper.time_helper as TimeHelper
 from helper.mongodb_helper import MongoDBHeler
 import copy
@@ -18,19 +20,19 @@ import envs.amis_web_config as awc
 
 class AmisWebHelper:
 
-    session = None
-
     def __init__(self, logger: Logger, redis: RedisHelper, mongodb: MongoDBHeler):
         self.logger = logger
         self.redis = redis
         self.mongodb = mongodb
         self.session = self.request_session()
+        # the login context is kept with the token, instead of being read from MongoDB on every request
+        self.token = get_token_manager(logger, redis, config.AMIS_WEB_ACCESS_TOKEN_REDIS, fetch=self._get_access_token)
 
     @property
     def headers(self):
-        _access_token = self.access_token
-        _data = self.mongodb.find(config.MONGODB_CACHING, config.AMIS_WEB_COLLECTION, {"_id": "login"}, {"_id": 0})
-        _context = _data[0].get("Context")
+        _login = self.token.get()
+        _access_token = _login.get("Token")
+        _context = copy.deepcopy(_login.get("Context"))
         _context["Language"] = "vi"
         context = json.dumps(_context).replace(" ", "")
 
@@ -58,42 +60,26 @@ class AmisWebHelper:
 
     @property
     def access_token(self):
-        try:
-            _cached_token = self.redis.get_cached_value_for_key(config.AMIS_WEB_ACCESS_TOKEN_REDIS)
-            if _cached_token:
-                self.logger.debug(f"Get access token from Redis cache: ***")
-                return _cached_token
-            else:
-                _access_token = self._get_access_token()
-                self.logger.debug(f"Get access token from Amis: {_access_token}")
-                return _access_token
-            
-        except RedisError as re:
-            raise re
-        except HTTPError as he:
-            raise he
-        except Exception as e:
-            raise e
+        return self.token.get().get("Token")
 
     def request_session(self):
         """
-        Create a session with retry handling
+        Return the session shared by every AmisWebHelper, with pooled keep-alive connections and retry handling
 
-        :param session (_type_, optional): user session.
         :returns session: request session
         """
-        if self.session is None:
-            session = requests.Session()
-        return session
+        return get_session("amis_web")
 
     def _get_access_token(self):
         """
         Get access token from Amis Web.
+
+        :returns: (Token and Context of the login, ttl in seconds)
         """
         url = f"{config.AMIS_WEB_URL}/g2/api/auth/v1/account/login/misa_id"
 
         try:
-            response = requests.post(url=url, headers=awc.headers, data=awc.payload, timeout=config.AMIS_WEB_REQUEST_TIMEOUT)
+            response = self.session.post(url=url, headers=awc.headers, data=awc.payload, timeout=config.AMIS_WEB_REQUEST_TIMEOUT)
             response_json = response.json()
 
             if response.status_code == 200:
@@ -105,7 +91,6 @@ class AmisWebHelper:
                     raise Exception(message)
 
                 access_token = data.get("AccessToken")
-                self.redis.put_cached_value_for_key(config.AMIS_WEB_ACCESS_TOKEN_REDIS, access_token.get("Token"), int(access_token.get("TokenExpired")))
 
                 del data["AccessToken"]
                 self.mongodb.update_one(database=config.MONGODB_CACHING, collection=config.AMIS_WEB_COLLECTION, 
@@ -114,7 +99,11 @@ class AmisWebHelper:
                                         upsert=True
                                         )
 
-                return access_token.get("Token")
+                login = {
+                    "Token": access_token.get("Token"),
+                    "Context": data.get("Context")
+                }
+                return login, int(access_token.get("TokenExpired"))
 
             else:
                 message = f"Error when getting access token from Amis Web API, status_code: {response.status_code}, error: {response.text}"
@@ -0,0 +1,132 @@
+"""
+This module helps to run many HTTP requests at once from a synchronous Airflow task, on one shared event loop
+"""
+import os
+import asyncio
+import random
+import threading
+import httpx
+from config import config
+
+_lock = threading.Lock()
+_pid = None
+_loop = None
+_clients = {}
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the event loop of the process, running forever in a daemon thread
+    """
+    global _pid, _loop
+    with _lock:
+        if _loop is None or _pid != os.getpid():
+            # A forked worker gets its own loop and clients, the parent's thread does not exist there
+            _loop = asyncio.new_event_loop()
+            _clients.clear()
+            _pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="async-http-loop", daemon=True).start()
+        return _loop
+
+
+def run(coroutine):
+    """
+    Run a coroutine on the shared loop and wait for its result
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop()).result()
+
+
+def iterate(async_generator):
+    """
+    Consume an async generator from synchronous code, one item at a time
+    """
+    loop = get_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(async_generator.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(async_generator.aclose(), loop).result()
+
+
+def get_async_client(name: str, max_connections: int = config.ASYNC_HTTP_MAX_CONNECTIONS) -> httpx.AsyncClient:
+    """
+    Return the AsyncClient shared by every async helper named name, keeping up to max_connections alive
+    """
+    get_loop()
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                headers={"Accept-Encoding": "gzip, deflate"},
+                # connection errors are retried by the transport, statuses by request()
+                transport=httpx.AsyncHTTPTransport(retries=config.HTTP_TOTAL_RETRY),
+            )
+            _clients[name] = client
+        return client
+
+
+async def request(client: httpx.AsyncClient, method: str, url: str, status_forcelist=config.HTTP_CODE_RETRY + [429], max_retry: int = config.HTTP_TOTAL_RETRY, **kwargs) -> httpx.Response:
+    """
+    Send a request, retrying status_forcelist responses with jittered backoff or after Retry-After seconds when given
+
+    :return: last response received, the caller handles its status code
+    """
+    if kwargs.get("params"):
+        # requests drops None params, httpx would send them empty
+        kwargs["params"] = {key: value for key, value in kwargs["params"].items() if value is not None}
+
+    for attempt in range(max_retry + 1):
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in status_forcelist or attempt == max_retry:
+            return response
+
+        try:
+            delay = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            delay = config.HTTP_BACKOFF_FACTOR * (2 ** attempt)
+            delay += random.uniform(0, delay * config.HTTP_BACKOFF_JITTER)
+        await asyncio.sleep(delay)
+
+
+async def map_concurrently(fetch, items, concurrency: int = config.ASYNC_HTTP_CONCURRENCY):
+    """
+    Await fetch(item) for every item with at most concurrency in flight
+
+    :return: async generator of (item, result) in completion order
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_item(item):
+        async with semaphore:
+            return item, await fetch(item)
+
+    tasks = [asyncio.ensure_future(fetch_item(item)) for item in items]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def iter_numbered_pages(fetch_page, page_size: int, start_page: int = 1, concurrency: int = config.ASYNC_HTTP_CONCURRENCY):
+    """
+    Fetch numbered pages concurrency at a time until a page is short or empty
+
+    :param fetch_page: coroutine function taking a page number and returning its records
+    :return: async generator of (page, records) in page order
+    """
+    page = start_page
+    while True:
+        pages = list(range(page, page + concurrency))
+        results = await asyncio.gather(*(fetch_page(number) for number in pages))
+        for number, records in zip(pages, results):
+            if records:
+                yield number, records
+            if not records or len(records) < page_size:
+                return
+        page += concurrency
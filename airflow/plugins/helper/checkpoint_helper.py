@@ -0,0 +1,66 @@
+"""
+This module helps a paginated extract task to resume where its previous attempt stopped
+"""
+import json
+from logging import Logger
+from airflow.utils.context import Context
+from helper.redis_helper import RedisHelper
+from helper.exceptions import RedisError
+from config import config
+
+
+class CheckpointStore:
+    """
+    Cursor of one task instance (page number, last_conversation_id, offset...) stored as JSON in Redis
+    under CHECKPOINT:<dag_id>:<task_id>:<run_id>[:<scope>].
+
+    Save the cursor only once the data before it is durably stored. Every retry of the same run
+    shares the key, so it resumes from the last checkpoint, while another run starts from scratch.
+    Clear it when the task is done, the TTL removes what a task that never succeeded left behind.
+
+    Use it as a context manager: the attempt holds the RedisLock of the key, so a zombie attempt and
+    its retry never page at once, and a save from an attempt whose lock was taken over is refused.
+    """
+
+    def __init__(self, logger: Logger, redis: RedisHelper, context: Context, scope: str = None, ttl: int = config.CHECKPOINT_TTL):
+        self.logger = logger
+        self.redis = redis
+        self.ttl = ttl
+
+        ti = context['ti']
+        self.key = f"{RedisHelper.make_cache_key(config.CHECKPOINT_REDIS, ti.dag_id, ti.task_id)}:{ti.run_id}"
+        if scope:
+            self.key = f"{self.key}:{scope}"
+        self.lock = self.redis.lock(self.key)
+
+    def __enter__(self):
+        if not self.lock.acquire():
+            raise RedisError(f"Acquire lock failed: another attempt still holds checkpoint {self.key}")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.lock.release()
+
+    def load(self) -> dict:
+        """
+        Return the saved cursor, an empty dict when the task starts from scratch
+        """
+        value = self.redis.get_cached_value_for_key(self.key)
+        if not value:
+            return {}
+
+        cursor = json.loads(value)
+        self.logger.debug(f"Resume from checkpoint {self.key}: {cursor}")
+        return cursor
+
+    def save(self, **cursor):
+        """
+        Replace the saved cursor
+        """
+        if self.lock.fence is None:
+            self.redis.put_cached_value_for_key(self.key, json.dumps(cursor), self.ttl)
+        elif not self.lock.put_fenced(self.key, json.dumps(cursor), self.ttl):
+            raise RedisError(f"Save checkpoint failed: {self.key} was taken over by another attempt")
+
+    def clear(self):
+        self.redis.remove_cached_value_for_key(self.key)
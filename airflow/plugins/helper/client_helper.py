@@ -0,0 +1,168 @@
+"""
+This module keeps one pooled Redis and MongoDB client per endpoint for the whole worker process
+"""
+import os
+import threading
+from redis import Redis, BlockingConnectionPool
+from pymongo import MongoClient, monitoring
+from config import config
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_redis_pools = {}
+_mongo_clients = {}
+_mongo_listeners = {}
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """
+    Count the connections of one MongoClient, pymongo does not expose its pool size otherwise
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+
+    def _add(self, attribute, value):
+        with self.lock:
+            setattr(self, attribute, getattr(self, attribute) + value)
+
+    def connection_created(self, event):
+        self._add("created", 1)
+
+    def connection_closed(self, event):
+        self._add("closed", 1)
+
+    def connection_checked_out(self, event):
+        self._add("checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+def _reset_after_fork():
+    """
+    A forked worker must not reuse the sockets of its parent, drop the inherited clients
+    """
+    global _pid
+    if _pid != os.getpid():
+        _redis_pools.clear()
+        _mongo_clients.clear()
+        _mongo_listeners.clear()
+        _pid = os.getpid()
+
+
+def get_redis_client(host, port, db=0, health_check_interval: int = config.REDIS_HEALTH_CHECK_INTERVAL) -> Redis:
+    """
+    Return a Redis client on the shared pool of host:port/db, connections are opened on first use
+
+    :param health_check_interval: seconds a connection may stay idle before it is checked with a PING
+    """
+    key = (host, int(port), int(db))
+    with _lock:
+        _reset_after_fork()
+        pool = _redis_pools.get(key)
+        if pool is None:
+            pool = BlockingConnectionPool(
+                host=host,
+                port=int(port),
+                db=int(db),
+                decode_responses=True,
+                max_connections=config.REDIS_MAX_CONNECTIONS,
+                timeout=config.REDIS_POOL_TIMEOUT,
+                health_check_interval=health_check_interval,
+                socket_connect_timeout=config.REDIS_SOCKET_TIMEOUT,
+                socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+            )
+            _redis_pools[key] = pool
+    return Redis(connection_pool=pool)
+
+
+def get_mongo_client(conn_string: str = config.MONGODB_CONN) -> MongoClient:
+    """
+    Return the shared MongoClient of conn_string, it connects lazily on the first operation
+    """
+    with _lock:
+        _reset_after_fork()
+        client = _mongo_clients.get(conn_string)
+        if client is None:
+            listener = MongoPoolListener()
+            client = MongoClient(
+                conn_string,
+                maxPoolSize=config.MONGODB_MAX_POOL_SIZE,
+                minPoolSize=config.MONGODB_MIN_POOL_SIZE,
+                maxIdleTimeMS=config.MONGODB_MAX_IDLE_TIME_MS,
+                serverSelectionTimeoutMS=config.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                connect=False,
+                event_listeners=[listener],
+            )
+            _mongo_clients[conn_string] = client
+            _mongo_listeners[conn_string] = listener
+    return client
+
+
+def check_health() -> dict:
+    """
+    PING every endpoint
+
+    :return: dict of endpoint to True if it answered
+    """
+    health = {}
+    for (host, port, db), pool in list(_redis_pools.items()):
+        try:
+            health[f"redis://{host}:{port}/{db}"] = Redis(connection_pool=pool).ping()
+        except Exception:
+            health[f"redis://{host}:{port}/{db}"] = False
+
+    for index, client in enumerate(list(_mongo_clients.values())):
+        try:
+            health[f"mongodb#{index}"] = client.admin.command("ping").get("ok") == 1
+        except Exception:
+            health[f"mongodb#{index}"] = False
+    return health
+
+
+def pool_stats() -> dict:
+    """
+    Connections opened and in use per endpoint, to size REDIS_MAX_CONNECTIONS and MONGODB_MAX_POOL_SIZE
+    """
+    stats = {}
+    for (host, port, db), pool in list(_redis_pools.items()):
+        created = len(pool._connections)
+        idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+        stats[f"redis://{host}:{port}/{db}"] = {
+            "max": pool.max_connections,
+            "created": created,
+            "in_use": created - idle,
+        }
+
+    for index, (conn_string, client) in enumerate(list(_mongo_clients.items())):
+        listener = _mongo_listeners[conn_string]
+        stats[f"mongodb#{index}"] = {
+            "max": client.options.pool_options.max_pool_size,
+            "created": listener.created - listener.closed,
+            "in_use": listener.checked_out,
+        }
+    return stats
@@ -2,14 +2,13 @@ from typing import Dict, List, Optional, Type
 import requests
 import json
 from requests.exceptions import HTTPError, RequestException
-from urllib import request, parse
+from helper.http_helper import get_session
+from helper.async_http_helper import get_async_client, request, iter_numbered_pages
 from config import config
 from logging import Logger
 
 class DahahiHelper:
 
-    session = None
-
     def __init__(self, logger: Logger):
         self.logger = logger
 
@@ -17,14 +16,11 @@ class DahahiHelper:
 
     def request_session(self):
         """
-        Create a session with retry handling
+        Return the session shared by every DahahiHelper, with pooled keep-alive connections and retry handling
 
-        :param session (_type_, optional): user session.
         :returns session: request session
         """
-        if self.session is None:
-            session = requests.Session()
-        return session
+        return get_session("dahahi")
 
     @property
     def headers(self):
@@ -99,4 +95,66 @@ class DahahiHelper:
             error_msg = f"Request exception when getting employee record from Dahahi, error: {e}"
             raise Exception(error_msg)
         except Exception as e:
-            raise e
\ No newline at end of file
+            raise e
+
+class AsyncDahahiHelper:
+    """
+    asyncio variant of DahahiHelper on the shared event loop, pages are fetched concurrently
+    """
+
+    def __init__(self, logger: Logger):
+        self.logger = logger
+        self.helper = DahahiHelper(logger)
+        self.client = get_async_client("dahahi")
+
+    async def post(self, path: str, payload: dict, what: str):
+        url = f"{config.DAHAHI_BASE_URL}/{path}"
+
+        response = await request(self.client, "POST", url, headers=self.helper.headers, content=json.dumps(payload), timeout=config.DAHAHI_API_TIMEOUT)
+        response_json = response.json()
+
+        if response.status_code == 200:
+            return response_json.get("Data",[])
+
+        message = f"Error when getting {what} record from Dahahi, status_code: {response.status_code}, error: {response.text}"
+        self.logger.error(message)
+        raise HTTPError(message)
+
+    async def get_checkin_history(self, page_size=None, page_index=None, from_time_string=None, to_time_string=None):
+        payload = {
+            "pagesize": page_size if page_size else config.DAHAHI_PAGE_SIZE,
+            "pageIndex": page_index
+            }
+        if from_time_string:
+            payload.update({"FromTimeStr": from_time_string}) 
+        if to_time_string:
+            payload.update({"ToTimeStr": to_time_string}) 
+
+        return await self.post("api/facereg/checkinhis", payload, "checkin history")
+
+    async def iter_checkin_history(self, from_time_string=None, to_time_string=None, start_page=1, concurrency=config.ASYNC_HTTP_CONCURRENCY):
+        """
+        :return: async generator of (page_index, records) in page order, concurrency pages are fetched at once
+        """
+        async def fetch_page(page_index):
+            return await self.get_checkin_history(page_index=page_index, from_time_string=from_time_string, to_time_string=to_time_string)
+
+        async for page_index, records in iter_numbered_pages(fetch_page, page_size=config.DAHAHI_PAGE_SIZE, start_page=start_page, concurrency=concurrency):
+            yield page_index, records
+
+    async def get_employee_list(self, page_size=None, page_index=None):
+        payload = {
+            "pagesize": page_size if page_size else config.DAHAHI_PAGE_SIZE,
+            "pageIndex": page_index if page_index else 1
+            }
+        return await self.post("api/facereg/GetEmployeeList", payload, "employee")
+
+    async def iter_employee_list(self, start_page=1, concurrency=config.ASYNC_HTTP_CONCURRENCY):
+        """
+        :return: async generator of (page_index, employees) in page order, concurrency pages are fetched at once
+        """
+        async def fetch_page(page_index):
+            return await self.get_employee_list(page_index=page_index)
+
+        async for page_index, employees in iter_numbered_pages(fetch_page, page_size=config.DAHAHI_PAGE_SIZE, start_page=start_page, concurrency=concurrency):
+            yield page_index, employees
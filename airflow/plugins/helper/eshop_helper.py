@@ -1,40 +1,37 @@
+import asyncio
 import requests
 import json
 import hmac
 import hashlib
 from requests.exceptions import HTTPError, RequestException
-from requests.adapters import HTTPAdapter, Retry
+from helper.http_helper import get_session
+from helper.async_http_helper import get_async_client, request, map_concurrently, iter_numbered_pages
 from config import config
 from logging import Logger
 from helper.redis_helper import RedisHelper, RedisError
+from helper.token_helper import get_token_manager
 import helper.time_helper as TimeHelper
 
 class EshopHelper:
 
-    session = None
-
     def __init__(self, logger: Logger, redis: RedisHelper):
         self.logger = logger
         self.redis = redis
 
-        if self.session is None:
-            self.session = self.request_session()
-
-        self.retries = Retry(total=10,
-                backoff_factor=0.5,
-                status_forcelist=config.HTTP_CODE_RETRY)
-        
-        self.session.mount('https://', HTTPAdapter(max_retries=self.retries))
+        self.session = self.request_session()
+        # token, company code and environment are kept in memory until shortly before the token expires
+        self.token = get_token_manager(logger, redis, config.ESHOP_ACCESS_TOKEN_REDIS, fetch=self._get_access_token)
     
     @property
     def headers(self):
+        _login = self.token.get()
         _headers = {
             "Content-Type": "application/json",
-            "Authorization": "Bearer " + self.access_token
+            "Authorization": "Bearer " + _login.get("AccessToken"),
+            "CompanyCode": _login.get("CompanyCode")
         }
-        _headers.update({"CompanyCode": self.redis.get_cached_value_for_key(config.ESHOP_COMPANY_CODE_REDIS)})
 
-        self.environment = self.redis.get_cached_value_for_key(config.ESHOP_ENVIRONMENT_REDIS)
+        self.environment = _login.get("Environment")
         return _headers
 
     @property
@@ -61,37 +58,22 @@ class EshopHelper:
         
     @property
     def access_token(self):
-        try:
-            _cached_token = self.redis.get_cached_value_for_key(config.ESHOP_ACCESS_TOKEN_REDIS)
-            if _cached_token:
-                self.logger.debug(f"Get access token from Redis cache: ***")
-                return _cached_token
-            else:
-                _access_token = self._get_access_token()
-                self.logger.debug(f"Get access token from Eshop: {_access_token}")
-                return _access_token
-            
-        except RedisError as re:
-            raise re
-        except HTTPError as he:
-            raise he
-        except Exception as e:
-            raise e
+        return self.token.get().get("AccessToken")
 
     def request_session(self):
         """
-        Create a session with retry handling
+        Return the session shared by every EshopHelper, with pooled keep-alive connections and retry handling
+        (the pool is kept >= ESHOP_DETAIL_MAX_WORKERS so workers don't wait for a connection)
 
-        :param session (_type_, optional): user session.
         :returns session: request session
         """
-        if self.session is None:
-            session = requests.Session()
-        return session
+        return get_session("eshop", pool_maxsize=config.ESHOP_POOL_MAXSIZE, max_per_host=config.ESHOP_POOL_MAXSIZE, total_retry=10)
 
     def _get_access_token(self):
         """
         API Doc: https://openplatform.mshopkeeper.vn/api/index.html
+
+        :returns: (AccessToken, CompanyCode and Environment of the login, ttl in seconds)
         """
         url = f"{config.ESHOP_URL}/auth/api/account/login"
         headers = {
@@ -100,19 +82,18 @@ class EshopHelper:
         payload = self.get_login_param
 
         try:
-            response = requests.post(url=url, headers=headers, json=payload, timeout=config.ESHOP_REQUEST_TIMEOUT)
+            response = self.session.post(url=url, headers=headers, json=payload, timeout=config.ESHOP_REQUEST_TIMEOUT)
             response_json = response.json()
 
             if response.status_code == 200 and response_json.get("ErrorType", 0) == 0:
                 data = response_json.get("Data", {})
-                access_token = data.get("AccessToken")
-                company_code = data.get("CompanyCode")
-                environment = data.get("Environment")
-                self.redis.put_cached_value_for_key(config.ESHOP_ACCESS_TOKEN_REDIS, access_token, config.ESHOP_ACCESS_TOKEN_TTL)
-                self.redis.put_cached_value_for_key(config.ESHOP_COMPANY_CODE_REDIS, company_code)
-                self.redis.put_cached_value_for_key(config.ESHOP_ENVIRONMENT_REDIS, environment)
+                login = {
+                    "AccessToken": data.get("AccessToken"),
+                    "CompanyCode": data.get("CompanyCode"),
+                    "Environment": data.get("Environment")
+                }
 
-                return access_token
+                return login, config.ESHOP_ACCESS_TOKEN_TTL
 
             else:
                 message = f"Error when getting access token from Eshop API, status_code: {response.status_code}, error: {response.text}"
@@ -246,4 +227,87 @@ class EshopHelper:
             error_msg = f"Request exception when getting inventory items from Eshop API, status_code: {response.status_code}, error: {response.text}, error: {e}"
             raise Exception(error_msg)
         except Exception as e:
-            raise e
\ No newline at end of file
+            raise e
+
+class AsyncEshopHelper:
+    """
+    asyncio variant of EshopHelper on the shared event loop, pages and invoice details are fetched concurrently
+    """
+
+    def __init__(self, logger: Logger, redis: RedisHelper):
+        self.logger = logger
+        # the sync helper provides the token and company code
+        self.helper = EshopHelper(logger, redis)
+        self.client = get_async_client("eshop", max_connections=config.ESHOP_POOL_MAXSIZE)
+
+    async def post(self, path: str, payload: dict, what: str, default=None):
+        """
+        POST payload to the Eshop API and return its Data
+        """
+        # Headers may read Redis or log in again when the token is due, keep that off the event loop
+        headers = await asyncio.to_thread(lambda: self.helper.headers)
+        url = f"{config.ESHOP_URL}/{self.helper.environment}/{path}"
+
+        response = await request(self.client, "POST", url, headers=headers, content=json.dumps(payload), timeout=config.ESHOP_REQUEST_TIMEOUT)
+        response_json = response.json()
+
+        if response.status_code == 200 and response_json.get("ErrorType", 0) == 0:
+            return response_json.get("Data", default)
+
+        message = f"Error when getting {what} from Eshop, status_code: {response.status_code}, error: {response.text}"
+        self.logger.error(message)
+        raise HTTPError(message)
+
+    async def get_invoices(self, page: int=1, limit: int=config.ESHOP_PAGE_LIMIT, sort_field: str="InvoiceDate", sort_type: int=1, from_datetime: str=None, to_datetime: str=None, date_range_type: int=1):
+        payload = {
+            "Page": page,
+            "Limit": limit,
+            "SortField": sort_field,
+            "SortType": sort_type,
+            "FromDate": from_datetime,
+            "ToDate": to_datetime,
+            "DateRangeType": date_range_type
+        }
+        return await self.post("api/v1/invoices/pagingbycustomer", payload, "list invoices")
+
+    async def iter_invoices(self, from_datetime: str=None, to_datetime: str=None, start_page: int=1, concurrency: int=config.ASYNC_HTTP_CONCURRENCY):
+        """
+        :return: async generator of (page, invoices) in page order, concurrency pages are fetched at once
+        """
+        async def fetch_page(page):
+            return await self.get_invoices(page=page, from_datetime=from_datetime, to_datetime=to_datetime)
+
+        async for page, invoices in iter_numbered_pages(fetch_page, page_size=config.ESHOP_PAGE_LIMIT, start_page=start_page, concurrency=concurrency):
+            yield page, invoices
+
+    async def get_invoice_details(self, invoice_id: str):
+        return await self.post("api/v1/invoices/detailbyrefid", {"RefID": invoice_id}, "invoice detail", default={})
+
+    async def iter_invoice_details(self, invoice_ids, concurrency: int=config.ESHOP_DETAIL_MAX_WORKERS):
+        """
+        :return: async generator of (invoice_id, detail) in completion order
+        """
+        async for invoice_id, detail in map_concurrently(self.get_invoice_details, invoice_ids, concurrency=concurrency):
+            yield invoice_id, detail
+
+    async def get_inventory_items(self, page: int=1, limit: int=config.ESHOP_PAGE_LIMIT, last_sync_date: str=None):
+        payload = {
+            "Page": page,
+            "Limit": limit,
+            "SortField": "Code",
+            "SortType": "1",
+            "IncludeInventory": True,
+            "InventoryItemCategoryID": None,
+            "LastSyncDate": last_sync_date
+        }
+        return await self.post("api/v1/inventoryitems/pagingwithdetail", payload, "inventory items")
+
+    async def iter_inventory_items(self, last_sync_date: str=None, start_page: int=1, concurrency: int=config.ASYNC_HTTP_CONCURRENCY):
+        """
+        :return: async generator of (page, inventory_items) in page order, concurrency pages are fetched at once
+        """
+        async def fetch_page(page):
+            return await self.get_inventory_items(page=page, last_sync_date=last_sync_date)
+
+        async for page, inventory_items in iter_numbered_pages(fetch_page, page_size=config.ESHOP_PAGE_LIMIT, start_page=start_page, concurrency=concurrency):
+            yield page, inventory_items
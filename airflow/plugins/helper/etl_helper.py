@@ -1,4 +1,8 @@
 import hashlib
+import json
+import time
+import concurrent.futures
+from logging import Logger
 
 def encode_string_to_short_number(s: str, digits=16) -> str:
     h = hashlib.blake2b(s.encode(), digest_size=8)  # 8 bytes = 64-bit
@@ -10,3 +14,36 @@ def id128_hex(s: str) -> str:
         digest_size=16
     ).hexdigest()
 
+def record_fingerprint(record: dict, version_field: str = "edit_version") -> str:
+    """
+    Fingerprint of a record: its version followed by a hash of its whole content,
+    so a change is detected even when the source forgets to bump the version
+    """
+    content = json.dumps(record, sort_keys=True, default=str, ensure_ascii=False)
+    content_hash = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+    return f"{record.get(version_field)}:{content_hash}"
+
+def fetch_pages_concurrently(fetch_page, pages, logger: Logger, max_workers=5, max_retry=3, retry_delay=2):
+    """
+    Fetch a known range of pages on a bounded thread pool, retrying each failed page on its own
+
+    :param fetch_page: function taking a page number and returning its records
+    :param pages: page numbers to fetch
+    :param retry_delay: seconds to wait before a retry, multiplied by the attempt number
+    :return: generator of (page, records) in completion order
+    """
+    def fetch_page_with_retry(page):
+        for attempt in range(1, max_retry + 2):
+            try:
+                return page, fetch_page(page)
+            except Exception as e:
+                if attempt > max_retry:
+                    logger.error(f"Page {page} failed after {max_retry} retries, error: {e}")
+                    raise e
+                logger.debug(f"Page {page} failed, retry {attempt}/{max_retry}, error: {e}")
+                time.sleep(retry_delay * attempt)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_page_with_retry, page) for page in pages]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
@@ -2,8 +2,13 @@ import json
 import google.auth
 from google.cloud import bigquery
 from google.cloud import storage
+from google.cloud import bigquery_storage_v1
+from google.cloud.bigquery_storage_v1 import types, writer
+from google.api_core.exceptions import NotFound, BadRequest
 import pandas as pd
 import pandas_gbq
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import BytesIO
 from config import config
 from logging import Logger
@@ -40,6 +45,15 @@ class GCSHelper:
         except:
             self.logger.error(f"Error when uploading to gs://{self.bucket_name}/{file_name}")
 
+    def delete_blob(self, file_name):
+        """
+        Delete file_name from the bucket if it exists
+        """
+        blob = self.bucket.blob(file_name)
+        if blob.exists():
+            blob.delete()
+            self.logger.debug(f"Deleted gs://{self.bucket_name}/{file_name}")
+
     def download_json(self, blob):
         try:
             json_string = blob.download_as_text()
@@ -56,11 +70,43 @@ class GCSHelper:
 
 class BQHelper:
 
-    def __init__(self, logger: Logger, client=None, credentials_file=None):
+    # BigQuery column type -> Arrow type used by the load_arrow load method
+    ARROW_TYPES = {
+        "STRING": pa.string(),
+        "INTEGER": pa.int64(),
+        "INT64": pa.int64(),
+        "FLOAT": pa.float64(),
+        "FLOAT64": pa.float64(),
+        "BOOLEAN": pa.bool_(),
+        "BOOL": pa.bool_(),
+        "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+        "DATETIME": pa.timestamp("us"),
+        "DATE": pa.date32(),
+        "TIME": pa.time64("us"),
+        "NUMERIC": pa.decimal128(38, 9),
+        "BIGNUMERIC": pa.decimal256(76, 38),
+        "BYTES": pa.binary(),
+        "JSON": pa.string(),
+        "GEOGRAPHY": pa.string(),
+    }
+
+    WRITE_DISPOSITIONS = {
+        "append": bigquery.WriteDisposition.WRITE_APPEND,
+        "replace": bigquery.WriteDisposition.WRITE_TRUNCATE,
+        "fail": bigquery.WriteDisposition.WRITE_EMPTY,
+    }
+
+    # table_id -> [(column name, column type)], shared by every BQHelper of the process
+    schema_cache = {}
+
+    def __init__(self, logger: Logger, client=None, credentials_file=None, redis=None):
 
         self.client = client
         self.logger = logger
+        self.redis = redis
         self.project_id = config.PROJECT_ID
+        self.credentials = None
+        self.read_client = None
         if not self.client:
             # load_credentials_from_file supports both a SA key JSON and a
             # Workload Identity Federation (external_account) config file.
@@ -97,12 +143,66 @@ class BQHelper:
 
     def select(self, query):
         try:
-            data_frame = pandas_gbq.read_gbq(query,project_id=self.project_id,credentials=self.credentials,progress_bar_type=None)
+            data_frame = pandas_gbq.read_gbq(query,project_id=self.project_id,credentials=self.credentials,progress_bar_type=None,use_bqstorage_api=True)
         except Exception as e:
             self.logger.debug(e)
             return False
         return data_frame
     
+    def get_read_client(self):
+        if self.read_client is None:
+            self.read_client = bigquery_storage_v1.BigQueryReadClient(credentials=self.credentials)
+        return self.read_client
+
+    def read_table_batches(self, table_id, selected_fields: list = None, row_restriction: str = None):
+        """
+        Stream a table through the Storage Read API as Arrow record batches, only one batch is held in memory
+
+        :param table_id: project.dataset.table
+        :param selected_fields: columns to read, all columns when None
+        :param row_restriction: SQL filter applied server side, e.g. "inserted_at >= '2024-01-01'"
+        :return: generator of pyarrow.RecordBatch
+        """
+        project_id, dataset_id, table_name = table_id.split(".")
+        read_client = self.get_read_client()
+
+        read_options = types.ReadSession.TableReadOptions()
+        if selected_fields:
+            read_options.selected_fields = selected_fields
+        if row_restriction:
+            read_options.row_restriction = row_restriction
+
+        requested_session = types.ReadSession()
+        requested_session.table = f"projects/{project_id}/datasets/{dataset_id}/tables/{table_name}"
+        requested_session.data_format = types.DataFormat.ARROW
+        requested_session.read_options = read_options
+
+        try:
+            # A single stream keeps the batches in table order and the memory flat
+            session = read_client.create_read_session(parent=f"projects/{self.project_id}", read_session=requested_session, max_stream_count=1)
+            self.logger.debug(f"Read session {session.name} on {table_id}, {len(session.streams)} streams")
+
+            for stream in session.streams:
+                for page in read_client.read_rows(stream.name).rows(session).pages:
+                    yield page.to_arrow()
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+
+    def query_batches(self, query):
+        """
+        Run a query and stream its result as Arrow record batches through the Storage Read API
+
+        :return: generator of pyarrow.RecordBatch
+        """
+        try:
+            rows = self.client.query(query).result()
+            for record_batch in rows.to_arrow_iterable(bqstorage_client=self.get_read_client()):
+                yield record_batch
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+
     def bq_append(self, update_data, table_name, dataset_id, if_exists='append', load_method="load_csv", project_id=config.PROJECT_ID):
         if update_data is None or update_data.shape[0] == 0:
             return False, "Empty DataFrame"
@@ -111,6 +211,9 @@ class BQHelper:
         table_id = f'{project_id}.{dataset_id}.{table_name}'
 
         try:
+            if load_method == "load_arrow":
+                return self.load_arrow(dataframe=update_data, table_id=table_id, if_exists=if_exists)
+
             if load_method == "load_csv":
                 for c in update_data.columns:
                     type = str(update_data[c].dtypes)
@@ -125,6 +228,100 @@ class BQHelper:
             self.logger.error(e)
             raise e
 
+    def arrow_type(self, field) -> pa.DataType:
+        """
+        Return the Arrow type of a bigquery.SchemaField, RECORD as a struct of its fields and REPEATED as a list
+        """
+        if field.field_type in ("RECORD", "STRUCT"):
+            arrow_type = pa.struct([pa.field(sub_field.name, self.arrow_type(sub_field)) for sub_field in field.fields])
+        else:
+            arrow_type = self.ARROW_TYPES.get(field.field_type, pa.string())
+
+        if field.mode == "REPEATED":
+            return pa.list_(arrow_type)
+        return arrow_type
+
+    def arrow_schema(self, schema) -> pa.Schema:
+        """
+        Return the Arrow schema of a list of bigquery.SchemaField
+        """
+        return pa.schema([pa.field(field.name, self.arrow_type(field)) for field in schema])
+
+    def to_arrow_table(self, dataframe: pd.DataFrame, schema=None) -> pa.Table:
+        """
+        Convert a DataFrame to an Arrow table in one pass, columns found in the BigQuery schema are cast to its type.
+        A value the type can't hold (e.g. 12.7 in an INTEGER column) raises ArrowInvalid instead of being truncated.
+
+        :param schema: list of bigquery.SchemaField, the other columns keep their inferred Arrow type
+        """
+        fields = {field.name: field for field in schema or []}
+
+        arrays = []
+        for column in dataframe.columns:
+            field = fields.get(column)
+            if field is not None and (field.mode == "REPEATED" or field.field_type in ("RECORD", "STRUCT")):
+                # dicts and lists are converted straight to the table type, keys not in the RECORD are dropped
+                try:
+                    arrays.append(pa.array(dataframe[column], type=self.arrow_type(field), from_pandas=True))
+                    continue
+                except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError) as e:
+                    self.logger.warning(f"Column {column} does not match its {field.mode} {field.field_type} type, keep the inferred one: {e}")
+
+            array = pa.array(dataframe[column], from_pandas=True)
+            arrow_type = self.ARROW_TYPES.get(field.field_type) if field is not None and field.mode != "REPEATED" else None
+            if arrow_type is not None and not array.type.equals(arrow_type):
+                # only the ns -> us truncation of datetimes is accepted, any other loss raises ArrowInvalid
+                temporal = pa.types.is_timestamp(arrow_type) or pa.types.is_time(arrow_type)
+                array = array.cast(arrow_type, safe=not temporal)
+            arrays.append(array)
+
+        return pa.Table.from_arrays(arrays, names=[str(column) for column in dataframe.columns])
+
+    def load_arrow(self, dataframe: pd.DataFrame, table_id: str, if_exists='append'):
+        """
+        Load a DataFrame as a Parquet load job, no CSV serialization and no string round trip of datetimes
+        """
+        try:
+            schema = self.client.get_table(table_id).schema
+        except NotFound:
+            schema = None
+
+        arrow_table = self.to_arrow_table(dataframe=dataframe, schema=schema)
+
+        buffer = BytesIO()
+        # pandas datetimes are ns, BigQuery only reads MILLIS/MICROS Parquet timestamps reliably
+        pq.write_table(arrow_table, buffer, coerce_timestamps="us", allow_truncated_timestamps=True)
+        buffer.seek(0)
+
+        parquet_options = bigquery.ParquetOptions()
+        parquet_options.enable_list_inference = True
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=self.WRITE_DISPOSITIONS.get(if_exists, bigquery.WriteDisposition.WRITE_APPEND),
+        )
+        job_config.parquet_options = parquet_options
+
+        load_job = self.client.load_table_from_file(buffer, table_id, job_config=job_config)
+        load_job.result()
+        self.logger.debug(f"Loaded {load_job.output_rows} rows to {table_id}, job ID: {load_job.job_id}")
+        return load_job.output_rows
+
+    def bq_append_chunks(self, chunks, table_name, dataset_id, if_exists='append', load_method="load_csv", project_id=config.PROJECT_ID):
+        """
+        Load an iterable of DataFrame chunks one by one, only one chunk is kept in memory
+
+        :param if_exists: applied to the first chunk, the next chunks are appended
+        :return: total number of loaded rows
+        """
+        total_rows = 0
+        for chunk in chunks:
+            if chunk is None or chunk.empty:
+                continue
+            self.bq_append(update_data=chunk, table_name=table_name, dataset_id=dataset_id, if_exists=if_exists if total_rows == 0 else 'append', load_method=load_method, project_id=project_id)
+            total_rows += len(chunk)
+            self.logger.debug(f"Loaded {total_rows} rows to {dataset_id}.{table_name}")
+        return total_rows
 
     def upsert_bigquery(self, dataframe: pd.DataFrame, identifier_cols: list, table_name: str, dataset_id: str):
         staging_table = f'{config.PROJECT_ID}.{config.DATASET_STAGING_ID}.{table_name}'
@@ -157,28 +354,13 @@ class BQHelper:
             )
             return "Success"
 
-        # --- Prepare merge SQL ---
-        on_clause = " AND ".join([f"target.{col} = source.{col}" for col in identifier_cols])
-        update_clause = ", ".join([f"target.{col} = source.{col}" for col in dataframe.columns if col not in identifier_cols])
-        insert_columns = ", ".join(dataframe.columns)
-        insert_values = ", ".join([f"source.{col}" for col in dataframe.columns])
-
-        merge_sql = f"""
-        MERGE `{destination_table}` AS target
-        USING `{staging_table}` AS source
-        ON {on_clause}
-        WHEN MATCHED THEN
-        UPDATE SET {update_clause}
-        WHEN NOT MATCHED THEN
-        INSERT ({insert_columns})
-        VALUES ({insert_values})
-        """
-
-        print("Executing MERGE query:")
-        print(merge_sql)
-
-        self.execute(merge_sql)
-        # query_job.result()  # Wait for the job to finish
+        # --- MERGE the staged frame, its columns are known so no schema lookup ---
+        self.merge_table(
+            table_name=table_name,
+            dataset_id=dataset_id,
+            key_columns=identifier_cols,
+            columns=list(dataframe.columns),
+        )
 
         return "Success"
 
@@ -222,12 +404,324 @@ class BQHelper:
     #         print(e)
     #         return False, str(e)
 
+    def open_storage_writer(self, table_name, dataset_id, project_id=config.PROJECT_ID):
+        """
+        Storage Write API sink for table_name, see BQStorageWriter
+        """
+        return BQStorageWriter(logger=self.logger, bq=self, table_name=table_name, dataset_id=dataset_id, project_id=project_id)
+
     def get_columns(self, dataset_id, table_id):
-        # Get the table schema
-        table_ref = self.client.dataset(dataset_id).table(table_id)
-        table = self.client.get_table(table_ref)
+        # Column names from the cached table schema
+        return [name for name, _ in self.get_schema(f"{self.project_id}.{dataset_id}.{table_id}")]
+
+    def get_schema(self, table_id):
+        """
+        Column names and types of a table, cached in process and in Redis for BQ_SCHEMA_CACHE_TTL seconds
+
+        :return: list of (column name, column type)
+        """
+        schema = self.schema_cache.get(table_id)
+        if schema is not None:
+            return schema
+
+        cache_key = f"{config.BQ_SCHEMA_CACHE_REDIS}:{table_id}"
+        if self.redis:
+            cached_schema = self.redis.get_cached_value_for_key(cache_key)
+            if cached_schema:
+                schema = [tuple(column) for column in json.loads(cached_schema)]
+
+        if schema is None:
+            self.logger.debug(f"Get schema of {table_id} from BigQuery")
+            schema = [(field.name, field.field_type) for field in self.client.get_table(table_id).schema]
+            if self.redis:
+                self.redis.put_cached_value_for_key(cache_key, json.dumps(schema), config.BQ_SCHEMA_CACHE_TTL)
+
+        self.schema_cache[table_id] = schema
+        return schema
+
+    def invalidate_schema(self, table_id):
+        self.schema_cache.pop(table_id, None)
+        if self.redis:
+            self.redis.remove_cached_value_for_key(f"{config.BQ_SCHEMA_CACHE_REDIS}:{table_id}")
+
+    def build_merge_query(
+            self,
+            target_table_id,
+            source_table_id,
+            key_columns: list,
+            order_by: str = None,
+            source_filter: str = None,
+            partition_filter: str = None,
+            columns: list = None,
+            update_columns: list = None,
+            immutable_columns: list = None,
+            insert_values: dict = None,
+        ):
+        """
+        Build a MERGE upserting source_table_id into target_table_id on key_columns
+
+        :param order_by: keep one source row per key, the first one in this order, e.g. "ingested_at DESC"
+        :param source_filter: WHERE condition on the source rows
+        :param partition_filter: extra target-side ON condition, e.g. to prune target partitions
+        :param columns: source columns, read from the (cached) source schema when None
+        :param update_columns: columns updated when matched, every non-key column when None
+        :param immutable_columns: columns only set on insert, e.g. created_datetime
+        :param insert_values: SQL expressions inserted for extra columns, e.g. {"inserted_datetime": "CURRENT_DATETIME()"}
+        """
+        columns = columns or [name for name, _ in self.get_schema(source_table_id)]
+        update_columns = [col for col in (update_columns or columns) if col not in key_columns and col not in (immutable_columns or [])]
+        insert_values = insert_values or {}
+
+        on_clause = " AND ".join([f"target.{col} = source.{col}" for col in key_columns])
+        if partition_filter:
+            on_clause = f"{on_clause} AND {partition_filter}"
+
+        qualify_clause = f"QUALIFY ROW_NUMBER() OVER (PARTITION BY {', '.join(key_columns)} ORDER BY {order_by}) = 1" if order_by else ""
+        update_set_clause = ", ".join([f"target.{col} = source.{col}" for col in update_columns])
+        insert_columns = columns + [col for col in insert_values if col not in columns]
+        insert_values_clause = ", ".join([insert_values.get(col, f"source.{col}") for col in insert_columns])
+
+        return f"""
+        MERGE `{target_table_id}` AS target
+        USING (
+            SELECT *
+            FROM `{source_table_id}`
+            WHERE {source_filter or "1=1"}
+            {qualify_clause}
+        ) AS source
+        ON {on_clause}
+        WHEN MATCHED THEN
+            UPDATE SET {update_set_clause}
+        WHEN NOT MATCHED THEN
+            INSERT ({", ".join(insert_columns)})
+            VALUES ({insert_values_clause})
+        """
+
+    @staticmethod
+    def sql_literal(value, column_type):
+        """
+        Constant SQL literal of value for a column of column_type, so it can be used for partition pruning
+        """
+        if column_type in ("DATE", "DATETIME", "TIMESTAMP"):
+            if column_type == "DATETIME" and getattr(value, "tzinfo", None) is not None:
+                value = value.replace(tzinfo=None)
+            value = value.isoformat() if hasattr(value, "isoformat") else str(value)
+            return f"{column_type} '{value}'"
+        if column_type in ("INTEGER", "INT64", "FLOAT", "FLOAT64", "NUMERIC", "BIGNUMERIC"):
+            return str(value)
+        return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+    def build_partition_filter(self, target_table_id, source_table_id, partition_column):
+        """
+        Target-side ON condition restricting the MERGE to the [min, max] range of partition_column in the staged rows.
+
+        Rows whose partition_column moved outside of that range since they were loaded are not matched,
+        so only use it on columns that do not change, e.g. a creation date.
+
+        :return: condition, None when the source is empty or the column is unknown in the target
+        """
+        column_type = dict(self.get_schema(target_table_id)).get(partition_column)
+        if column_type is None:
+            self.logger.debug(f"{partition_column} is not a column of {target_table_id}, no partition filter")
+            return None
+
+        rows = list(self.execute(f"SELECT MIN({partition_column}) AS min_value, MAX({partition_column}) AS max_value FROM `{source_table_id}`"))
+        if not rows or rows[0]["min_value"] is None:
+            return None
+
+        return (
+            f"target.{partition_column} BETWEEN {self.sql_literal(rows[0]['min_value'], column_type)} "
+            f"AND {self.sql_literal(rows[0]['max_value'], column_type)}"
+        )
+
+    def create_partitioned_table(self, target_table_id, source_table_id, partition_column, cluster_columns: list = None):
+        """
+        Create target_table_id empty with the schema of source_table_id, partitioned by day of partition_column
+        """
+        column_type = dict(self.get_schema(source_table_id)).get(partition_column)
+        partition_expression = partition_column if column_type == "DATE" else f"DATE({partition_column})"
+        cluster_clause = f"CLUSTER BY {', '.join(cluster_columns)}" if cluster_columns else ""
+
+        self.logger.debug(f"Create table {target_table_id} partitioned by {partition_expression} {cluster_clause}")
+        self.execute(f"""
+        CREATE TABLE IF NOT EXISTS `{target_table_id}`
+        PARTITION BY {partition_expression}
+        {cluster_clause}
+        AS SELECT * FROM `{source_table_id}` WHERE FALSE
+        """)
+
+    def merge_table(
+            self,
+            table_name,
+            dataset_id,
+            key_columns: list,
+            source_table_id=None,
+            project_id=config.PROJECT_ID,
+            partition_column: str = None,
+            create_partitioned: bool = False,
+            **kwargs
+        ):
+        """
+        Build and run the MERGE from the staging table (or source_table_id) into dataset_id.table_name, see build_merge_query
+
+        :param partition_column: prune the target to the [min, max] range of this column in the staged rows
+        :param create_partitioned: create a missing target partitioned by partition_column and clustered by key_columns
+        :return: query results
+        """
+        target_table_id = f"{project_id}.{dataset_id}.{table_name}"
+        source_table_id = source_table_id or f"{project_id}.{config.DATASET_STAGING_ID}.{table_name}"
+
+        if partition_column:
+            if create_partitioned:
+                try:
+                    self.client.get_table(target_table_id)
+                except NotFound:
+                    self.create_partitioned_table(target_table_id, source_table_id, partition_column, cluster_columns=key_columns[:4])
+
+            partition_filter = self.build_partition_filter(target_table_id, source_table_id, partition_column)
+            if partition_filter:
+                kwargs["partition_filter"] = f"{kwargs['partition_filter']} AND {partition_filter}" if kwargs.get("partition_filter") else partition_filter
+
+        merge_query = self.build_merge_query(target_table_id=target_table_id, source_table_id=source_table_id, key_columns=key_columns, **kwargs)
+        self.logger.debug(merge_query)
+        try:
+            results = self.execute(query=merge_query)
+        except BadRequest as e:
+            if kwargs.get("columns"):
+                raise e
+            # The cached schema may be outdated, retry once with a fresh one
+            self.logger.debug(f"MERGE failed, refresh schema of {source_table_id} and retry, error: {e}")
+            self.invalidate_schema(source_table_id)
+            merge_query = self.build_merge_query(target_table_id=target_table_id, source_table_id=source_table_id, key_columns=key_columns, **kwargs)
+            results = self.execute(query=merge_query)
+
+        self.logger.debug(f"Job ID: {results.job_id}")
+        return results
+
+class BQStorageWriter:
+    """
+    Stream DataFrames into a table through the Storage Write API, in Arrow format, on a pending stream.
+
+    Rows are only visible once commit() is called and are committed atomically; if the writer is
+    never committed (task failure), the pending stream is dropped by BigQuery and nothing is written.
+    No load job is used, so nothing counts against the load job quota.
+
+    with bq.open_storage_writer(table_name, dataset_id) as storage_writer:
+        for df in pages:
+            storage_writer.append(df)
+    """
+
+    def __init__(self, logger: Logger, bq: BQHelper, table_name, dataset_id, project_id=config.PROJECT_ID):
+        self.logger = logger
+        self.bq = bq
+        self.table_id = f"{project_id}.{dataset_id}.{table_name}"
 
-        # Extract column names
-        column_names = [field.name for field in table.schema]
+        self.write_client = bigquery_storage_v1.BigQueryWriteClient(credentials=getattr(bq, "credentials", None))
+        self.parent = self.write_client.table_path(project_id, dataset_id, table_name)
+        self.schema = bq.client.get_table(self.table_id).schema
 
-        return column_names
\ No newline at end of file
+        # The writer schema comes from the table, so every DataFrame is sent with the same columns and types
+        # whatever the columns of the first one (missing or all None)
+        self.arrow_schema = bq.arrow_schema(self.schema)
+
+        self.write_stream = None
+        self.append_stream = None
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+    def open(self):
+        """
+        Create the pending stream with the Arrow schema of the table as writer schema
+        """
+        write_stream = types.WriteStream()
+        write_stream.type_ = types.WriteStream.Type.PENDING
+        self.write_stream = self.write_client.create_write_stream(parent=self.parent, write_stream=write_stream)
+
+        arrow_data = types.AppendRowsRequest.ArrowData()
+        arrow_data.writer_schema.serialized_schema = self.arrow_schema.serialize().to_pybytes()
+
+        request_template = types.AppendRowsRequest()
+        request_template.write_stream = self.write_stream.name
+        request_template.arrow_rows = arrow_data
+
+        self.append_stream = writer.AppendRowsStream(self.write_client, request_template)
+        self.logger.debug(f"Opened pending write stream {self.write_stream.name}")
+
+    def append(self, dataframe: pd.DataFrame):
+        """
+        Send a DataFrame to the pending stream, its columns are aligned on the table schema:
+        missing columns are sent as NULL and columns not in the table are skipped
+        """
+        if dataframe is None or dataframe.empty:
+            return 0
+
+        if self.write_stream is None:
+            self.open()
+
+        extra_columns = [column for column in dataframe.columns if column not in self.arrow_schema.names]
+        if extra_columns:
+            self.logger.warning(f"Columns {extra_columns} are not in the schema of {self.table_id}, skip them")
+        arrow_table = self.bq.to_arrow_table(dataframe=dataframe.reindex(columns=self.arrow_schema.names), schema=self.schema)
+        # to_arrow_table already truncated the datetimes, any other mismatch fails the append before it is sent
+        arrow_table = arrow_table.cast(self.arrow_schema)
+
+        futures = []
+        for record_batch in arrow_table.to_batches(max_chunksize=config.BQ_STORAGE_WRITE_BATCH_ROWS):
+            arrow_data = types.AppendRowsRequest.ArrowData()
+            arrow_data.rows.serialized_record_batch = record_batch.serialize().to_pybytes()
+
+            request = types.AppendRowsRequest()
+            request.offset = self.offset
+            request.arrow_rows = arrow_data
+
+            futures.append(self.append_stream.send(request))
+            self.offset += record_batch.num_rows
+
+        # Wait for the acknowledgements so only one DataFrame is in flight at a time
+        for future in futures:
+            future.result()
+
+        return arrow_table.num_rows
+
+    def commit(self):
+        """
+        Finalize the stream and commit every appended row atomically
+
+        :return: number of committed rows
+        """
+        if self.write_stream is None:
+            self.logger.debug(f"Nothing appended to {self.table_id}, skip commit")
+            return 0
+
+        self.append_stream.close()
+        self.write_client.finalize_write_stream(name=self.write_stream.name)
+
+        commit_request = types.BatchCommitWriteStreamsRequest()
+        commit_request.parent = self.parent
+        commit_request.write_streams = [self.write_stream.name]
+        response = self.write_client.batch_commit_write_streams(commit_request)
+
+        if response.stream_errors:
+            message = f"Error when committing write stream to {self.table_id}, error: {response.stream_errors}"
+            self.logger.error(message)
+            raise Exception(message)
+
+        self.logger.debug(f"Committed {self.offset} rows to {self.table_id} at {response.commit_time}")
+        return self.offset
+
+    def abort(self):
+        """
+        Close the stream without committing, the pending rows are discarded
+        """
+        if self.append_stream is not None:
+            self.append_stream.close()
+        self.logger.debug(f"Aborted write stream to {self.table_id}, {self.offset} pending rows discarded")
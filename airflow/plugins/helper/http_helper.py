@@ -0,0 +1,105 @@
+"""
+This module helps to share pooled, retrying HTTP sessions between the source API helpers
+"""
+import os
+import random
+import threading
+from urllib.parse import urlsplit
+from requests import Session
+from requests.adapters import HTTPAdapter, Retry
+from config import config
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_sessions = {}
+_host_semaphores = {}
+
+
+class JitterRetry(Retry):
+    """
+    Exponential backoff plus a random share of it, so parallel workers failing together don't retry together.
+    A Retry-After header, when sent, is honoured instead of the backoff.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff + random.uniform(0, backoff * config.HTTP_BACKOFF_JITTER)
+
+
+class HttpSession(Session):
+    """
+    Session which runs at most max_per_host requests at once against the same host, across every
+    session of the process
+    """
+
+    def __init__(self, max_per_host: int):
+        super().__init__()
+        self.max_per_host = max_per_host
+
+    def host_semaphore(self, url) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with _lock:
+            semaphore = _host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_per_host)
+                _host_semaphores[host] = semaphore
+            return semaphore
+
+    def request(self, method, url, *args, **kwargs):
+        with self.host_semaphore(url):
+            return super().request(method, url, *args, **kwargs)
+
+
+def create_session(
+        pool_maxsize: int = config.HTTP_POOL_MAXSIZE,
+        max_per_host: int = config.HTTP_MAX_PER_HOST,
+        total_retry: int = config.HTTP_TOTAL_RETRY,
+        backoff_factor: float = config.HTTP_BACKOFF_FACTOR,
+        status_forcelist=config.HTTP_CODE_RETRY + [429],
+        allowed_methods=None,
+    ) -> HttpSession:
+    """
+    Create a keep-alive session with a connection pool of pool_maxsize and retry handling.
+
+    Connection errors and status_forcelist responses are retried with jittered backoff, honouring Retry-After.
+    The last response is returned instead of raising, so the helpers keep handling the status code themselves.
+
+    :param status_forcelist: empty when the caller already handles 429/5xx itself (e.g. an adaptive rate limiter)
+    :param allowed_methods: methods retried on read errors and statuses, None for every method
+    """
+    retries = JitterRetry(
+        total=total_retry,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+        allowed_methods=allowed_methods,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+
+    session = HttpSession(max_per_host=max_per_host)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+def get_session(name: str, **kwargs) -> HttpSession:
+    """
+    Return the session shared by every helper of the process named name, created by create_session(**kwargs)
+    """
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            # A forked worker must not reuse the sockets of its parent, nor semaphores a parent thread may hold
+            _sessions.clear()
+            _host_semaphores.clear()
+            _pid = os.getpid()
+        session = _sessions.get(name)
+        if session is None:
+            session = create_session(**kwargs)
+            _sessions[name] = session
+        return session
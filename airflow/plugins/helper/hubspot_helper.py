@@ -1,31 +1,32 @@
 from typing import Dict, List, Optional, Type
+import asyncio
 import requests
 import json
+import concurrent.futures
 from requests.exceptions import HTTPError, RequestException
-from urllib import request, parse
+from helper.http_helper import get_session
+from helper.async_http_helper import get_async_client, request, map_concurrently
+from helper.token_helper import get_token_manager
 from config import config
 from logging import Logger
 
 class HubspotHelper:
 
-    session = None
-
     def __init__(self, logger: Logger, redis=None):
         self.logger = logger
         self.redis = redis
 
         self.session = self.request_session()
+        # the token is refreshed by the HubSpot CLI task of the DAG, only read here
+        self.token = get_token_manager(logger, redis, config.HUBSPOT_ACCESS_TOKEN_REDIS) if redis else None
 
     def request_session(self):
         """
-        Create a session with retry handling
+        Return the session shared by every HubspotHelper, with pooled keep-alive connections and retry handling
 
-        :param session (_type_, optional): user session.
         :returns session: request session
         """
-        if self.session is None:
-            session = requests.Session()
-        return session
+        return get_session("hubspot")
 
     @property
     def headers(self):
@@ -38,8 +39,8 @@ class HubspotHelper:
     def access_token(self):
         # Prefer the short-lived token cached in Redis (produced by the HubSpot CLI
         # refresh task), fall back to the static private-app token from env.
-        if self.redis:
-            token = self.redis.get_cached_value_for_key(config.HUBSPOT_ACCESS_TOKEN_REDIS)
+        if self.token:
+            token = self.token.get()
             if token:
                 return token
         return config.HUBSPOT_APP_TOKEN
@@ -123,6 +124,133 @@ class HubspotHelper:
         except Exception as e:
             raise e
         
+    def search_objects(self, object_type, limit=None, after=None, properties: list = None, filterGroups=None, sortGroups=None):
+        """
+        Search any CRM object, same as search_contacts but also returns the total number of matches
+
+        :returns: results, after, total
+        """
+        payload = {
+            "limit": str(limit) if limit else config.HUBSPOT_PAGE_SIZE
+            }
+        if after:
+            payload.update({"after": after}) 
+        if properties:
+            payload.update({"properties": properties}) 
+        if filterGroups:
+            payload.update({"filterGroups": filterGroups})    
+        if sortGroups:
+            payload.update({"sorts": sortGroups})
+
+        url = f"{config.HUBSPOT_BASE_URL}/crm/v3/objects/{object_type}/search" 
+
+        try:
+            payload = json.dumps(payload)
+            response = self.session.post(url=url, headers=self.headers, data=payload, timeout=config.HUBSPOT_API_TIMEOUT)
+            response_json = response.json()
+
+            if response.status_code == 200:
+                results = response_json.get("results",[])
+                after = response_json.get("paging", {}).get("next", {}).get("after", None)
+                total = response_json.get("total", 0)
+
+                return results, after, total
+
+            else:
+                message = f"Error when searching {object_type} record from HupSpot, status_code: {response.status_code}, error: {response.text}"
+                self.logger.error(message)
+                raise HTTPError(message)
+
+        except HTTPError as e:
+            raise e       
+        except RequestException as e:
+            error_msg = f"Request exception when searching {object_type} record from HupSpot, error: {e}"
+            raise Exception(error_msg)
+        except Exception as e:
+            raise e
+
+    @staticmethod
+    def window_filter_groups(filterGroups, date_property, start_timestamp, end_timestamp):
+        """
+        AND the [start_timestamp, end_timestamp] range of date_property into every filter group
+        """
+        date_filters = [
+            {"propertyName": date_property, "operator": "GTE", "value": start_timestamp},
+            {"propertyName": date_property, "operator": "LTE", "value": end_timestamp}
+        ]
+        if not filterGroups:
+            return [{"filters": date_filters}]
+        return [{**group, "filters": date_filters + group.get("filters", [])} for group in filterGroups]
+
+    def split_time_window(self, object_type, date_property, start_timestamp, end_timestamp, filterGroups=None):
+        """
+        Bisect [start_timestamp, end_timestamp] (epoch ms) until every sub-window holds at most
+        HUBSPOT_SEARCH_RESULT_CAP results, using the total returned by a 1-result search
+
+        :returns: list of (start_timestamp, end_timestamp), ordered and non-overlapping
+        """
+        _, _, total = self.search_objects(
+            object_type=object_type,
+            limit=1,
+            filterGroups=self.window_filter_groups(filterGroups, date_property, start_timestamp, end_timestamp)
+        )
+
+        if total <= config.HUBSPOT_SEARCH_RESULT_CAP:
+            return [(start_timestamp, end_timestamp)] if total else []
+
+        if end_timestamp - start_timestamp < 1:
+            self.logger.warning(f"{total} {object_type} at {date_property}={start_timestamp}, only the first {config.HUBSPOT_SEARCH_RESULT_CAP} can be fetched")
+            return [(start_timestamp, end_timestamp)]
+
+        middle_timestamp = (start_timestamp + end_timestamp) // 2
+        self.logger.debug(f"{total} {object_type} in [{start_timestamp}, {end_timestamp}], split at {middle_timestamp}")
+
+        return (
+            self.split_time_window(object_type, date_property, start_timestamp, middle_timestamp, filterGroups)
+            + self.split_time_window(object_type, date_property, middle_timestamp + 1, end_timestamp, filterGroups)
+        )
+
+    def search_window(self, object_type, date_property, start_timestamp, end_timestamp, properties: list = None, filterGroups=None, sortGroups=None):
+        """
+        Page through every result of a single window
+        """
+        window_filter_groups = self.window_filter_groups(filterGroups, date_property, start_timestamp, end_timestamp)
+
+        records, after, _ = self.search_objects(object_type=object_type, properties=properties, filterGroups=window_filter_groups, sortGroups=sortGroups)
+        while after:
+            results, after, _ = self.search_objects(object_type=object_type, after=after, properties=properties, filterGroups=window_filter_groups, sortGroups=sortGroups)
+            records.extend(results)
+
+        self.logger.debug(f"Got {len(records)} {object_type} in [{start_timestamp}, {end_timestamp}]")
+        return records
+
+    def search_by_time_window(self, object_type, date_property, start_timestamp, end_timestamp, properties: list = None, filterGroups=None, sortGroups=None, max_workers=None):
+        """
+        Iterate over every search result in [start_timestamp, end_timestamp] regardless of the 10k result cap.
+
+        The range is split into sub-windows under the cap, which are fetched concurrently.
+        A record updated while the search runs may show up in two windows, it is yielded once.
+
+        :param date_property: epoch ms property to split on, e.g. lastmodifieddate or createdate
+        :param filterGroups: extra filter groups, the date range is AND-ed into each of them
+        :returns: generator of records
+        """
+        windows = self.split_time_window(object_type, date_property, start_timestamp, end_timestamp, filterGroups)
+        self.logger.debug(f"Search {object_type} in {len(windows)} windows")
+
+        seen_ids = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or config.HUBSPOT_SEARCH_MAX_WORKERS) as executor:
+            futures = [
+                executor.submit(self.search_window, object_type, date_property, window_start, window_end, properties, filterGroups, sortGroups)
+                for window_start, window_end in windows
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                for record in future.result():
+                    if record.get("id") in seen_ids:
+                        continue
+                    seen_ids.add(record.get("id"))
+                    yield record
+
     def list_deals(self, limit=None, archived="false", after=None, properties: list = None, associations: list = None):
         params = {
             "limit": limit if limit else config.HUBSPOT_PAGE_SIZE
@@ -383,38 +511,121 @@ class HubspotHelper:
         except Exception as e:
             raise e
 
+    def resolve_associations(self, from_object: str, to_object: str, ids: list, association_type_id: int = None, max_workers=None):
+        """
+        Resolve associations of many records at once, batch reads of HUBSPOT_ASSOCIATION_BATCH_SIZE ids are sent concurrently
+
+        :param association_type_id: only keep associations of this type, https://developers.hubspot.com/docs/api/crm/associations#association-type-id-values
+        :returns: dict from_id -> list of to_ids
+        """
+        ids = list(dict.fromkeys(str(id) for id in ids))
+        chunks = [ids[i:i + config.HUBSPOT_ASSOCIATION_BATCH_SIZE] for i in range(0, len(ids), config.HUBSPOT_ASSOCIATION_BATCH_SIZE)]
+
+        def read_chunk(chunk):
+            return self.read_associations(from_object=from_object, to_object=to_object, inputs=[{"id": id} for id in chunk])
+
+        associations = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or config.HUBSPOT_ASSOCIATION_MAX_WORKERS) as executor:
+            for association_results in executor.map(read_chunk, chunks):
+                for association in association_results:
+                    to_ids = [
+                        str(i.get("toObjectId")) for i in association.get("to", [])
+                        if association_type_id is None or any(j.get("typeId") == association_type_id for j in i.get("associationTypes", []))
+                    ]
+                    if to_ids:
+                        associations[str(association.get("from", {}).get("id"))] = to_ids
+
+        self.logger.debug(f"Resolved {to_object} of {len(associations)}/{len(ids)} {from_object} in {len(chunks)} batches")
+        return associations
+
     def merge_association_to_search_result(self, from_object: str, to_object: str, association_type_id: int, results):
-        list_id = [result.get("id") for result in results]
-        inputs = []
-        for id in list_id:
-            inputs.append({
-                "id": f"{id}"
-            })
-        association_results = self.read_associations(from_object=from_object, to_object=to_object, inputs=inputs)
-        object_to_contact = {}
-        for association in association_results:
-            from_id = association.get("from", {}).get("id")
-
-            for i in association.get("to", []):
-                for j in i.get("associationTypes", []):
-                    if j.get("typeId") == association_type_id: #https://developers.hubspot.com/docs/api/crm/associations#association-type-id-values
-                        result_association = {
-                            from_id: {
-                                to_object : {
-                                    "results": [
-                                        {
-                                            "id": str(i.get("toObjectId")),
-                                            "type": f"{from_object[0:-1]}_to_{to_object[0:-1]}"
-                                        }
-                                    ]
-                                }
-                            }
-                        }
-                        object_to_contact.update(result_association)
+        """
+        Attach associations to search results in the same shape as the list endpoints return them
+        """
+        associations = self.resolve_associations(from_object=from_object, to_object=to_object, ids=[result.get("id") for result in results], association_type_id=association_type_id)
 
         for i in results:
-            id = i.get("id")
-            if id in object_to_contact:
-                i.update({"associations": object_to_contact.get(id)})
-                
+            to_ids = associations.get(str(i.get("id")))
+            if to_ids:
+                i.update({"associations": {
+                    to_object: {
+                        "results": [{"id": to_id, "type": f"{from_object[0:-1]}_to_{to_object[0:-1]}"} for to_id in to_ids]
+                    }
+                }})
+
         return results
+
+
+class AsyncHubspotHelper:
+    """
+    asyncio variant of HubspotHelper on the shared event loop
+    """
+
+    def __init__(self, logger: Logger, redis=None):
+        self.logger = logger
+        # the sync helper provides the token, and split_time_window to plan the windows
+        self.helper = HubspotHelper(logger, redis)
+        self.client = get_async_client("hubspot", max_connections=config.HUBSPOT_SEARCH_MAX_WORKERS)
+
+    async def search_objects(self, object_type, limit=None, after=None, properties: list = None, filterGroups=None, sortGroups=None):
+        """
+        Search any CRM object
+
+        :returns: results, after, total
+        """
+        payload = {
+            "limit": str(limit) if limit else config.HUBSPOT_PAGE_SIZE
+            }
+        if after:
+            payload.update({"after": after}) 
+        if properties:
+            payload.update({"properties": properties}) 
+        if filterGroups:
+            payload.update({"filterGroups": filterGroups})    
+        if sortGroups:
+            payload.update({"sorts": sortGroups})
+
+        url = f"{config.HUBSPOT_BASE_URL}/crm/v3/objects/{object_type}/search" 
+
+        headers = await asyncio.to_thread(lambda: self.helper.headers)
+        response = await request(self.client, "POST", url, headers=headers, content=json.dumps(payload), timeout=config.HUBSPOT_API_TIMEOUT)
+        response_json = response.json()
+
+        if response.status_code == 200:
+            results = response_json.get("results",[])
+            after = response_json.get("paging", {}).get("next", {}).get("after", None)
+            total = response_json.get("total", 0)
+            return results, after, total
+
+        message = f"Error when searching {object_type} record from HupSpot, status_code: {response.status_code}, error: {response.text}"
+        self.logger.error(message)
+        raise HTTPError(message)
+
+    async def iter_search(self, object_type, properties: list = None, filterGroups=None, sortGroups=None, after=None):
+        """
+        Follow the after cursor of a search, up to the HUBSPOT_SEARCH_RESULT_CAP results a search can return
+
+        :return: async generator of result pages
+        """
+        fetched = 0
+        while True:
+            results, after, _ = await self.search_objects(object_type, after=after, properties=properties, filterGroups=filterGroups, sortGroups=sortGroups)
+            if results:
+                yield results
+                fetched += len(results)
+            if not after or fetched >= config.HUBSPOT_SEARCH_RESULT_CAP:
+                return
+
+    async def iter_search_windows(self, object_type, date_property, windows, properties: list = None, filterGroups=None, sortGroups=None, concurrency=config.HUBSPOT_SEARCH_MAX_WORKERS):
+        """
+        Search several (start_timestamp, end_timestamp) windows of date_property concurrently,
+        e.g. the windows returned by HubspotHelper.split_time_window
+
+        :return: async generator of ((start_timestamp, end_timestamp), results) in completion order
+        """
+        async def fetch(window):
+            window_filter_groups = HubspotHelper.window_filter_groups(filterGroups, date_property, *window)
+            return [record async for page in self.iter_search(object_type, properties, window_filter_groups, sortGroups) for record in page]
+
+        async for window, results in map_concurrently(fetch, windows, concurrency=concurrency):
+            yield window, results
@@ -2,18 +2,19 @@ import requests
 import json
 from requests.exceptions import HTTPError, RequestException
 from urllib import request, parse
+from helper.http_helper import get_session, JitterRetry
 from config import config
 from logging import Logger
 from helper.redis_helper import RedisHelper, RedisError
+from helper.token_helper import get_token_manager
 
 class LarkHelper:
 
-    session = None
-
     def __init__(self, logger: Logger, redis: RedisHelper):
         self.logger = logger
         self.redis = redis
         self.session = self.request_session()
+        self.token = get_token_manager(logger, redis, config.LARK_TOKEN_REDIS_KEY, fetch=self._get_tenant_access_token)
     
     @property
     def headers(self):
@@ -24,35 +25,21 @@ class LarkHelper:
 
     @property
     def tenant_access_token(self):
-        try:
-            cached_token = self.redis.get_cached_value_for_key(config.LARK_TOKEN_REDIS_KEY)
-            if cached_token:
-                self.logger.debug(f"Get tenant_access_token from Redis: {cached_token}")
-                return cached_token
-            else:
-                tenant_access_token = self._get_tenant_access_token()
-                self.logger.debug(f"Get tenant_access_token from Lark: {tenant_access_token}")
-                return tenant_access_token
-            
-        except RedisError as e:
-            raise e
-        except HTTPError as e:
-            raise e
-        except Exception as e:
-            raise e
+        return self.token.get()
 
     def request_session(self):
         """
-        Create a session with retry handling
+        Return the session shared by every LarkHelper, with pooled keep-alive connections and retry handling
+        (POST is not retried on a status, a message must not be sent twice)
 
-        :param session (_type_, optional): user session.
         :returns session: request session
         """
-        if self.session is None:
-            session = requests.Session()
-        return session
+        return get_session("lark", allowed_methods=JitterRetry.DEFAULT_ALLOWED_METHODS)
 
     def _get_tenant_access_token(self):
+        """
+        :returns: (tenant_access_token, ttl in seconds)
+        """
         url = f"{config.LARK_OPEN_URL}/open-apis/auth/v3/tenant_access_token/internal"
         headers = {
             "Content-Type" : "application/json"
@@ -63,13 +50,14 @@ class LarkHelper:
         }
 
         try:
-            response = requests.post(url=url, headers=headers, json=payload, timeout=30)
+            response = self.session.post(url=url, headers=headers, json=payload, timeout=30)
             response_json = response.json()
 
             if response.status_code == 200 and response_json.get("code") == 0:
                 tenant_access_token = response_json.get("tenant_access_token")
-                self.redis.put_cached_value_for_key(config.LARK_TOKEN_REDIS_KEY, tenant_access_token, config.LARK_TOKEN_REDIS_TTL)
-                return tenant_access_token
+                # Lark returns the seconds left in expire, which is less than 2 hours when the token is reused
+                ttl = min(int(config.LARK_TOKEN_REDIS_TTL), int(response_json.get("expire", config.LARK_TOKEN_REDIS_TTL)))
+                return tenant_access_token, ttl
 
             else:
                 message = f"Error when getting tenant_access_token from Lark API, status_code: {response.status_code}, error: {response.text}"
@@ -110,7 +98,7 @@ class LarkMessage(LarkHelper):
         payload = json.dumps(req_body)
 
         try:
-            response = requests.post(url=url, headers=self.headers, data=payload, timeout=config.LARK_API_TIMEOUT)
+            response = self.session.post(url=url, headers=self.headers, data=payload, timeout=config.LARK_API_TIMEOUT)
             response_json = response.json()
 
             if response.status_code == 200 and response_json.get("code") == 0:
@@ -1,18 +1,17 @@
-from pymongo import MongoClient
+from pymongo import UpdateOne
+import pandas as pd
 from logging import Logger
+from helper.client_helper import get_mongo_client
 from config import config
 
 class MongoDBHeler:
 
-    client = None
-
     def __init__(self, logger: Logger):
 
         self.logger = logger
 
-        if self.client is None:
-            conn_string = config.MONGODB_CONN
-            self.client = MongoClient(conn_string)
+        # share the pooled client with every other helper of the process
+        self.client = get_mongo_client(config.MONGODB_CONN)
 
     def find(self, database=None, collection=None, *args, **kwargs):
         try:
@@ -24,6 +23,33 @@ class MongoDBHeler:
             self.logger.error(e)
             raise e
 
+    def find_batches(self, database=None, collection=None, filter=None, projection=None, batch_size=None):
+        """
+        Stream the cursor as DataFrame chunks so memory stays flat regardless of collection size
+
+        :param projection: fields to return, only these columns are read from Mongo
+        :param batch_size: number of documents per chunk, default config.MONGODB_FIND_BATCH_SIZE
+        :return: generator of DataFrame
+        """
+        batch_size = batch_size or config.MONGODB_FIND_BATCH_SIZE
+        try:
+            db = self.client[database]
+            collection = db[collection]
+            cursor = collection.find(filter or {}, projection, batch_size=batch_size)
+
+            documents = []
+            for document in cursor:
+                documents.append(document)
+                if len(documents) >= batch_size:
+                    yield pd.DataFrame(documents)
+                    documents = []
+
+            if documents:
+                yield pd.DataFrame(documents)
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+
     def insert_one(self, database=None, collection=None, document=None):
         try:
             db = self.client[database]
@@ -60,6 +86,29 @@ class MongoDBHeler:
             self.logger.error(e)
             raise e
 
+    def bulk_write(self, database=None, collection=None, requests=None, ordered=False):
+        try:
+            db = self.client[database]
+            collection = db[collection]
+            return collection.bulk_write(requests=requests, ordered=ordered)
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+
+    def bulk_upsert(self, database=None, collection=None, operations=None, batch_size=None, upsert=True):
+        """
+        Send (filter, update) pairs as unordered bulk_write batches, one round trip per batch
+
+        :param operations: list of (filter, update) pairs
+        :param batch_size: number of operations per batch, default config.MONGODB_BULK_BATCH_SIZE
+        """
+        batch_size = batch_size or config.MONGODB_BULK_BATCH_SIZE
+        operations = list(operations or [])
+
+        for start in range(0, len(operations), batch_size):
+            requests = [UpdateOne(filter=contition, update=update_query, upsert=upsert) for contition, update_query in operations[start:start + batch_size]]
+            self.bulk_write(database=database, collection=collection, requests=requests, ordered=False)
+
     def truncate_collection(self, database=None, collection=None):
         try:
             db = self.client[database]
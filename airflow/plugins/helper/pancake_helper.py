@@ -1,39 +1,62 @@
+import asyncio
 import requests
 import json
 import hmac
 import hashlib
 from requests.exceptions import HTTPError, RequestException
-from requests.adapters import HTTPAdapter, Retry
+from helper.http_helper import get_session
+from helper.async_http_helper import get_async_client, request, map_concurrently, iter_numbered_pages
 from config import config
 from logging import Logger
+from helper.rate_limit_helper import RateLimiter
 
 class PancakeHelper:
 
-    session = None
-
     def __init__(self, logger: Logger,):
         self.logger = logger
         self.headers = {}
 
-        if self.session is None:
-            self.session = self.request_session()
+        self.session = self.request_session()
+
+        self.rate_limiter = RateLimiter(
+            logger=logger,
+            max_requests_per_second=config.PANCAKE_REQUESTS_PER_SECOND,
+            min_requests_per_second=config.PANCAKE_MIN_REQUESTS_PER_SECOND
+        )
 
     def request_session(self):
         """
-        Create a session with retry handling
+        Return the session shared by every PancakeHelper, with pooled keep-alive connections and retry handling
+        (429/5xx are left to the rate limiter, only connection errors are retried here)
 
-        :param session (_type_, optional): user session.
         :returns session: request session
         """
-        if self.session is None:
-            session = requests.Session()
-        return session
+        return get_session("pancake", status_forcelist=[])
+
+    def get_with_rate_limit(self, page_id, url, params):
+        """
+        Send a GET request within the rate budget of page_id, slow down and retry on 429/5xx
+
+        :returns response: last response received
+        """
+        for attempt in range(config.PANCAKE_MAX_RETRY + 1):
+            self.rate_limiter.acquire(page_id)
+            response = self.session.get(url=url, params=params, timeout=config.PANCAKE_TIMEOUT)
+
+            if response.status_code != 429 and response.status_code not in config.HTTP_CODE_RETRY:
+                self.rate_limiter.on_success(page_id)
+                return response
+
+            self.logger.debug(f"Pancake throttled page {page_id}, status_code: {response.status_code}, attempt {attempt + 1}")
+            self.rate_limiter.on_throttle(page_id, retry_after=response.headers.get("Retry-After"))
+
+        return response
     
     def get_page_customer(self, page_access_token, page_id, since, until, page_number=1, page_size=100, order_by="updated_at"):
         '''
         https://docs.pancake.biz/pancake/st-f12/st-p2?lang=vi#5ec5a02c-75d3-440d-900b-0567e8acc227
         '''
-        url = f"https://pages.fm/api/public_api/v1/pages/{page_id}/page_customers"
+        url = f"{config.PANCAKE_BASE_URL}/v1/pages/{page_id}/page_customers"
         params = {
             "page_access_token": page_access_token,
             "since": since,
@@ -43,7 +66,7 @@ class PancakeHelper:
             "order_by": order_by
         }
         try:
-            response = self.session.get(url=url, params=params, timeout=config.PANCAKE_TIMEOUT)
+            response = self.get_with_rate_limit(page_id=page_id, url=url, params=params)
             response_json = response.json()
 
             if response.status_code == 200:
@@ -63,7 +86,7 @@ class PancakeHelper:
         '''
         https://docs.pancake.biz/pancake/st-f12/st-p2?lang=vi#103388f8-a942-4754-8504-fb001065c423
         '''
-        url = f"https://pages.fm/api/public_api/v2/pages/{page_id}/conversations"
+        url = f"{config.PANCAKE_BASE_URL}/v2/pages/{page_id}/conversations"
         params = {
             "page_access_token": page_access_token,
             "since": since,
@@ -79,7 +102,7 @@ class PancakeHelper:
 
         try:
             # self.logger.debug(f"params {params}")
-            response = self.session.get(url=url, params=params, timeout=config.PANCAKE_TIMEOUT)
+            response = self.get_with_rate_limit(page_id=page_id, url=url, params=params)
             response_json = response.json()
 
             if response.status_code == 200:
@@ -99,7 +122,7 @@ class PancakeHelper:
         https://docs.pancake.biz/pancake/st-f12/st-p2?lang=vi#103388f8-a942-4754-8504-fb001065c423
         '''
 
-        url = f"https://pages.fm/api/public_api/v1/pages/{page_id}/conversations/{conversation_id}/messages"
+        url = f"{config.PANCAKE_BASE_URL}/v1/pages/{page_id}/conversations/{conversation_id}/messages"
         params = {
             "page_access_token": page_access_token,
         }
@@ -107,7 +130,7 @@ class PancakeHelper:
             params.update({"current_count": current_count})
 
         try:
-            response = self.session.get(url=url, params=params, timeout=config.PANCAKE_TIMEOUT)
+            response = self.get_with_rate_limit(page_id=page_id, url=url, params=params)
             response_json = response.json()
 
             if response.status_code == 200:
@@ -128,13 +151,13 @@ class PancakeHelper:
         https://developer.pancake.biz/#/paths/pages-page_id--users/get
         '''
 
-        url = f"https://pages.fm/api/public_api/v1/pages/{page_id}/users"
+        url = f"{config.PANCAKE_BASE_URL}/v1/pages/{page_id}/users"
         params = {
             "page_access_token": page_access_token,
         }
 
         try:
-            response = self.session.get(url=url, params=params, timeout=config.PANCAKE_TIMEOUT)
+            response = self.get_with_rate_limit(page_id=page_id, url=url, params=params)
             response_json = response.json()
 
             if response.status_code == 200:
@@ -148,4 +171,128 @@ class PancakeHelper:
                 raise HTTPError(message)
             
         except Exception as e:
-            raise e
\ No newline at end of file
+            raise e
+
+class AsyncPancakeHelper:
+    """
+    asyncio variant of PancakeHelper on the shared event loop, many pages or conversations can be in flight at once
+    while the rate limiter of each page_id still applies
+    """
+
+    def __init__(self, logger: Logger,):
+        self.logger = logger
+        # the sync helper provides the rate limiter keeping the budget of each page_id
+        self.helper = PancakeHelper(logger)
+        self.client = get_async_client("pancake")
+
+    async def get_with_rate_limit(self, page_id, url, params):
+        """
+        Send a GET request within the rate budget of page_id, slow down and retry on 429/5xx
+
+        :returns response: last response received
+        """
+        for attempt in range(config.PANCAKE_MAX_RETRY + 1):
+            await asyncio.to_thread(self.helper.rate_limiter.acquire, page_id)
+            response = await request(self.client, "GET", url, status_forcelist=[], params=params, timeout=config.PANCAKE_TIMEOUT)
+
+            if response.status_code != 429 and response.status_code not in config.HTTP_CODE_RETRY:
+                self.helper.rate_limiter.on_success(page_id)
+                return response
+
+            self.logger.debug(f"Pancake throttled page {page_id}, status_code: {response.status_code}, attempt {attempt + 1}")
+            self.helper.rate_limiter.on_throttle(page_id, retry_after=response.headers.get("Retry-After"))
+
+        return response
+
+    async def get_json(self, page_id, url, params, what):
+        response = await self.get_with_rate_limit(page_id=page_id, url=url, params=params)
+
+        if response.status_code == 200:
+            return response.json()
+
+        message = f"Error when getting list {what} from Pancake, status_code: {response.status_code}, error: {response.text}"
+        self.logger.error(message)
+        raise HTTPError(message)
+
+    async def get_page_customer(self, page_access_token, page_id, since, until, page_number=1, page_size=100, order_by="updated_at"):
+        url = f"{config.PANCAKE_BASE_URL}/v1/pages/{page_id}/page_customers"
+        params = {
+            "page_access_token": page_access_token,
+            "since": since,
+            "until": until,
+            "page_number": page_number,
+            "page_size": page_size,
+            "order_by": order_by
+        }
+        response_json = await self.get_json(page_id, url, params, "customer")
+        return response_json.get("customers")
+
+    async def iter_page_customer(self, page_access_token, page_id, since, until, page_size=100, concurrency=config.ASYNC_HTTP_CONCURRENCY):
+        """
+        :return: async generator of (page_number, customers), concurrency pages are fetched at once
+        """
+        async def fetch_page(page_number):
+            return await self.get_page_customer(page_access_token, page_id, since, until, page_number=page_number, page_size=page_size)
+
+        async for page_number, customers in iter_numbered_pages(fetch_page, page_size=page_size, concurrency=concurrency):
+            yield page_number, customers
+
+    async def get_conversations(self, page_access_token, page_id, last_conversation_id=None, since=None, until=None, order_by="updated_at"):
+        url = f"{config.PANCAKE_BASE_URL}/v2/pages/{page_id}/conversations"
+        params = {
+            "page_access_token": page_access_token,
+            "since": since,
+            "until": until,
+            "order_by": order_by,
+            "last_conversation_id": last_conversation_id
+        }
+        response_json = await self.get_json(page_id, url, params, "conversations")
+        return response_json.get("conversations")
+
+    async def iter_conversations(self, page_access_token, page_id, since=None, until=None, last_conversation_id=None):
+        """
+        Follow the last_conversation_id cursor, pages can only be fetched one after the other
+
+        :return: async generator of conversation pages
+        """
+        while True:
+            conversations = await self.get_conversations(page_access_token, page_id, last_conversation_id=last_conversation_id, since=since, until=until)
+            if not conversations:
+                return
+            yield conversations
+            last_conversation_id = conversations[-1].get("id")
+
+    async def get_messages(self, page_access_token, page_id, conversation_id, current_count=None):
+        url = f"{config.PANCAKE_BASE_URL}/v1/pages/{page_id}/conversations/{conversation_id}/messages"
+        params = {
+            "page_access_token": page_access_token,
+            "current_count": current_count
+        }
+        response_json = await self.get_json(page_id, url, params, "messages")
+        return response_json.get("messages")
+
+    async def iter_messages(self, page_access_token, page_id, conversation_id):
+        """
+        Page through the messages of one conversation, newest first. Stop consuming to stop paging.
+
+        :return: async generator of message pages
+        """
+        current_count = None
+        while True:
+            messages = await self.get_messages(page_access_token, page_id, conversation_id, current_count=current_count)
+            if not messages:
+                return
+            yield messages
+            current_count = (current_count or 0) + len(messages)
+
+    async def iter_conversations_messages(self, page_access_token, page_id, conversation_ids, concurrency=config.ASYNC_HTTP_CONCURRENCY):
+        """
+        Fetch the first page of messages of many conversations with concurrency in flight
+
+        :return: async generator of (conversation_id, messages) in completion order
+        """
+        async def fetch(conversation_id):
+            return await self.get_messages(page_access_token, page_id, conversation_id)
+
+        async for conversation_id, messages in map_concurrently(fetch, conversation_ids, concurrency=concurrency):
+            yield conversation_id, messages
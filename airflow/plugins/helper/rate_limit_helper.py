@@ -0,0 +1,115 @@
+"""
+This module helps to throttle requests to third-party APIs
+"""
+import threading
+import time
+from logging import Logger
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` tokens per second, holding at most `capacity` tokens
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """
+        Block until one token is available and consume it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.refill(now)
+                if now < self.blocked_until:
+                    wait_seconds = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class RateLimiter:
+    """
+    Adaptive rate limiter with one token bucket per key (e.g. Pancake page_id).
+
+    The rate starts at max_requests_per_second, is multiplied by backoff_factor (not lower than
+    min_requests_per_second) on every throttled response and grows back by recovery_step on every
+    healthy response until it reaches max_requests_per_second again.
+    """
+
+    def __init__(
+            self,
+            logger: Logger,
+            max_requests_per_second: float,
+            min_requests_per_second: float,
+            backoff_factor: float = 0.5,
+            recovery_step: float = 0.1,
+            burst: float = 1,
+        ):
+        self.logger = logger
+        self.max_requests_per_second = max_requests_per_second
+        self.min_requests_per_second = min_requests_per_second
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self.burst = burst
+
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get_bucket(self, key) -> TokenBucket:
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate=self.max_requests_per_second, capacity=self.burst)
+                self.buckets[key] = bucket
+            return bucket
+
+    def acquire(self, key):
+        """
+        Block until a request for key is allowed
+        """
+        self.get_bucket(key).acquire()
+
+    def on_success(self, key):
+        """
+        Speed back up after a healthy response
+        """
+        bucket = self.get_bucket(key)
+        with bucket.lock:
+            if bucket.rate < self.max_requests_per_second:
+                bucket.rate = min(self.max_requests_per_second, bucket.rate + self.recovery_step)
+
+    def on_throttle(self, key, retry_after=None):
+        """
+        Slow down after a 429/5xx response, and pause the key for Retry-After seconds when given
+        """
+        bucket = self.get_bucket(key)
+        with bucket.lock:
+            bucket.rate = max(self.min_requests_per_second, bucket.rate * self.backoff_factor)
+            bucket.tokens = 0
+            pause_seconds = self.parse_retry_after(retry_after)
+            if pause_seconds:
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + pause_seconds)
+            rate = bucket.rate
+
+        self.logger.debug(f"Throttled on {key}, slow down to {rate:.2f} requests/second, retry after {pause_seconds or 0}s")
+
+    @staticmethod
+    def parse_retry_after(retry_after):
+        try:
+            return max(0.0, float(retry_after)) if retry_after is not None else None
+        except (TypeError, ValueError):
+            return None
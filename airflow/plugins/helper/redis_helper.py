@@ -1,16 +1,20 @@
 """
 This module helps to cache the values to Redis
 """
+import time
+import uuid
+import threading
 from logging import Logger
-from redis import Redis
 from helper.exceptions import RedisError
+from helper.client_helper import get_redis_client
+from config import config
 
 class RedisHelper:
     """
     Redis Helper to use with our service
     """
 
-    def __init__(self, logger: Logger, redis_host, redis_port, redis_db_num=0, expire_time: int = None, health_check_interval: int = 0):
+    def __init__(self, logger: Logger, redis_host, redis_port, redis_db_num=0, expire_time: int = None, health_check_interval: int = config.REDIS_HEALTH_CHECK_INTERVAL):
         """
         Init class
         """
@@ -21,12 +25,11 @@ class RedisHelper:
         self.expire_time = expire_time
         self.health_check_interval = health_check_interval
 
-        # create resdis client for using
-        self.redis_client = Redis(
-            host=self.redis_host, 
-            port=self.redis_port, 
-            db=self.redis_db, 
-            decode_responses=True, 
+        # share the pooled client of this endpoint with every other helper of the process
+        self.redis_client = get_redis_client(
+            host=self.redis_host,
+            port=self.redis_port,
+            db=self.redis_db,
             health_check_interval=self.health_check_interval)
 
     @staticmethod
@@ -113,20 +116,25 @@ class RedisHelper:
             self.logger.error(message)
             raise RedisError(f"Set value failed: {message}")
 
-    def put_cached_value_for_as_list(self, key, values: list, expire_time: int = None):
+    def put_cached_value_for_as_list(self, key, values: list, expire_time: int = None, chunk_size: int = config.REDIS_BATCH_SIZE):
         """
         Put value to Redis for caching
+        The values are appended by multi-value RPUSH of chunk_size values, sent with EXPIRE in one MULTI/EXEC pipeline
+
         :param key: key for caching to Redis
         :param value: value for catching to Redis
         """
         try:
             cache_ttl = expire_time or self.expire_time
-            for value in values:
-                self.redis_client.rpush(key, value)
-            if cache_ttl:
-                self.redis_client.expire(key, cache_ttl)
+            values = list(values)
+            with self.redis_client.pipeline(transaction=True) as pipe:
+                for i in range(0, len(values), chunk_size):
+                    pipe.rpush(key, *values[i:i + chunk_size])
+                if cache_ttl:
+                    pipe.expire(key, cache_ttl)
+                return pipe.execute()
         except Exception as err:
-            message = f"Got error when putting value to redis with key:{key}, value:{value} and error:{err}"
+            message = f"Got error when putting {len(values)} values to redis with key:{key} and error:{err}"
             self.logger.error(message)
             raise RedisError(f"Set value failed: {message}")
 
@@ -136,14 +144,66 @@ class RedisHelper:
         :param key: key for fetching value from Redis
         :return: value from key as a list
         """
+        return [value for chunk in self.iter_cached_value_for_key_as_list(key) for value in chunk]
+
+    def iter_cached_value_for_key_as_list(self, key, chunk_size: int = config.REDIS_BATCH_SIZE):
+        """
+        Read a list by LRANGE of chunk_size values, so a long list is never fetched in a single reply
+        :param key: key for fetching value from Redis
+        :return: generator of lists of at most chunk_size values
+        """
+        start = 0
+        while True:
+            try:
+                chunk = self.redis_client.lrange(key, start, start + chunk_size - 1)
+            except Exception as err:
+                message = f"Got error when getting cached value with key:{key} and error:{err}"
+                self.logger.error(message)
+                raise RedisError(f"Get value failed: {message}")
+
+            if chunk:
+                yield chunk
+            if len(chunk) < chunk_size:
+                return
+            start += chunk_size
+
+    def get_cached_values_for_keys(self, keys: list, chunk_size: int = config.REDIS_BATCH_SIZE) -> dict:
+        """
+        Return the values of many keys, one MGET per chunk_size keys
+        :param keys: keys for fetching values from Redis
+        :return: dict of key to value, None if value is not exist
+        """
+        keys = list(keys)
+        values = {}
         try:
-            len_list = self.redis_client.llen(key)
-            return self.redis_client.lrange(key, 0, len_list)
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                values.update(zip(chunk, self.redis_client.mget(chunk)))
+            return values
         except Exception as err:
-            message = f"Got error when getting cached value with key:{key} and error:{err}"
+            message = f"Got error when getting {len(keys)} cached values from Redis and error:{err}"
             self.logger.error(message)
             raise RedisError(f"Get value failed: {message}")
 
+    def put_cached_values_for_keys(self, mapping: dict, expire_time: int = None, chunk_size: int = config.REDIS_BATCH_SIZE):
+        """
+        Put many key/values to Redis, one pipeline of SET per chunk_size keys
+        :param mapping: dict of key to value for caching to Redis
+        """
+        try:
+            if expire_time is None:
+                expire_time = self.expire_time
+            items = list(mapping.items())
+            for i in range(0, len(items), chunk_size):
+                with self.redis_client.pipeline(transaction=False) as pipe:
+                    for key, value in items[i:i + chunk_size]:
+                        pipe.set(key, value, ex=expire_time)
+                    pipe.execute()
+        except Exception as err:
+            message = f"Got error when putting {len(mapping)} values to Redis and error:{err}"
+            self.logger.error(message)
+            raise RedisError(f"Set value failed: {message}")
+
     def remove_cached_value_for_key(self, key):
         """
         Remove cache value of key input
@@ -155,3 +215,188 @@ class RedisHelper:
             message = f"Got error when remove cached value with key:{key} and error:{err}"
             self.logger.error(message)
             raise RedisError(f"Remove key failed: {message}")
+
+    def lock(self, name, ttl: int = config.REDIS_LOCK_TTL, auto_renew: bool = True):
+        """
+        Return a lock on name shared by every worker, see RedisLock
+
+        :param ttl: seconds the lock is kept when its holder stops renewing it
+        """
+        return RedisLock(self, name, ttl=ttl, auto_renew=auto_renew)
+
+    def single_flight(self, key, fetch, expire_time: int = None, timeout: int = config.REDIS_LOCK_TIMEOUT) -> str:
+        """
+        Return the value cached under key, computed by fetch() in only one worker at a time:
+        the others wait for it to be cached instead of calling fetch() too
+
+        :param fetch: function returning the value to cache, called under the lock of key
+        :param timeout: seconds to wait for the worker computing it
+        :return: value from key
+        """
+        deadline = time.time() + timeout
+        lock = self.lock(key)
+        while True:
+            value = self.get_cached_value_for_key(key)
+            if value is not None:
+                return value
+
+            if lock.acquire(blocking=False):
+                try:
+                    # the previous holder may have cached it just before releasing the lock
+                    value = self.get_cached_value_for_key(key)
+                    if value is None:
+                        value = fetch()
+                        if not lock.put_fenced(key, value, expire_time or self.expire_time):
+                            self.logger.warning(f"Lock {lock.key} was taken over, keep the value cached by the other worker")
+                    return value
+                finally:
+                    lock.release()
+
+            if time.time() >= deadline:
+                raise RedisError(f"Single flight failed: no value for key:{key} after {timeout}s")
+            time.sleep(config.REDIS_LOCK_POLL_INTERVAL)
+
+
+class RedisLock:
+    """
+    Lock shared by every worker, held under LOCK:<name> with a TTL so that a crashed holder frees it.
+
+    Each acquisition gets a fencing token, the number of times name was acquired. A write through
+    put_fenced() only lands while nobody acquired the lock after us, so a holder stalled past its TTL
+    cannot overwrite the work of the next one. With auto_renew a daemon thread extends the TTL every
+    third of it until the lock is released.
+    """
+
+    # SET the lock and return the next fencing token, or nil when it is held
+    ACQUIRE_SCRIPT = """
+    if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        return false
+    end
+    local fence = redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return fence
+    """
+
+    RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    # SET KEYS[2] only while the fencing token of the lock is still ours
+    FENCED_SET_SCRIPT = """
+    if tonumber(redis.call('GET', KEYS[1])) ~= tonumber(ARGV[1]) then
+        return 0
+    end
+    if tonumber(ARGV[3]) > 0 then
+        redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+    else
+        redis.call('SET', KEYS[2], ARGV[2])
+    end
+    return 1
+    """
+
+    def __init__(self, redis: RedisHelper, name, ttl: int = config.REDIS_LOCK_TTL, auto_renew: bool = True):
+        self.redis = redis
+        self.logger = redis.logger
+        self.key = f"{config.REDIS_LOCK_REDIS}:{name}"
+        self.fence_key = f"{config.REDIS_LOCK_FENCE_REDIS}:{name}"
+        self.ttl = ttl
+        self.auto_renew = auto_renew
+
+        self.token = str(uuid.uuid4())
+        self.fence = None
+        self.stopped = threading.Event()
+        self.renewer = None
+
+        client = redis.redis_client
+        self.acquire_script = client.register_script(self.ACQUIRE_SCRIPT)
+        self.renew_script = client.register_script(self.RENEW_SCRIPT)
+        self.release_script = client.register_script(self.RELEASE_SCRIPT)
+        self.fenced_set_script = client.register_script(self.FENCED_SET_SCRIPT)
+
+    def acquire(self, blocking: bool = True, timeout: int = config.REDIS_LOCK_TIMEOUT) -> bool:
+        """
+        Take the lock, waiting up to timeout seconds for its holder when blocking
+
+        :return: True if the lock is ours, its fencing token is in fence
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fence = self.acquire_script(keys=[self.key, self.fence_key], args=[self.token, int(self.ttl * 1000), config.REDIS_LOCK_FENCE_TTL])
+            except Exception as err:
+                message = f"Got error when acquiring lock {self.key} and error:{err}"
+                self.logger.error(message)
+                raise RedisError(f"Acquire lock failed: {message}")
+
+            if fence is not None:
+                self.fence = int(fence)
+                if self.auto_renew:
+                    self.stopped = threading.Event()
+                    self.renewer = threading.Thread(target=self.renew_until_released, name=f"renew-{self.key}", daemon=True)
+                    self.renewer.start()
+                return True
+
+            if not blocking or time.time() >= deadline:
+                return False
+            time.sleep(config.REDIS_LOCK_POLL_INTERVAL)
+
+    def renew_until_released(self):
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                if not self.renew_script(keys=[self.key], args=[self.token, int(self.ttl * 1000)]):
+                    self.logger.warning(f"Lock {self.key} expired before it was renewed, fencing token {self.fence} is stale")
+                    return
+            except Exception as err:
+                # keep trying, the lock is only lost once its TTL is over
+                self.logger.warning(f"Got error when renewing lock {self.key} and error:{err}")
+
+    def release(self):
+        """
+        Free the lock if it is still ours
+        """
+        self.stopped.set()
+        if self.renewer:
+            self.renewer.join()
+            self.renewer = None
+
+        if self.fence is None:
+            return
+        try:
+            self.release_script(keys=[self.key], args=[self.token])
+        except Exception as err:
+            message = f"Got error when releasing lock {self.key} and error:{err}"
+            self.logger.error(message)
+            raise RedisError(f"Release lock failed: {message}")
+        finally:
+            self.fence = None
+
+    def put_fenced(self, key, value, expire_time: int = None) -> bool:
+        """
+        Put value to Redis unless another worker acquired the lock since us
+
+        :return: True if the value was written
+        """
+        try:
+            return bool(self.fenced_set_script(keys=[self.fence_key, key], args=[self.fence, value, int(expire_time or 0)]))
+        except Exception as err:
+            message = f"Got error when putting value to Redis with key:{key} under lock {self.key} and error:{err}"
+            self.logger.error(message)
+            raise RedisError(f"Set value failed: {message}")
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RedisError(f"Acquire lock failed: {self.key} is still held by another worker")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
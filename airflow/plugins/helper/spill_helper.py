@@ -0,0 +1,75 @@
+"""
+This module helps to buffer extracted pages on local disk as Parquet instead of a staging database
+"""
+import os
+import re
+import shutil
+from logging import Logger
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import config
+
+
+class ParquetSpillBuffer:
+    """
+    Append-only buffer of DataFrames spilled to Parquet part files under spill_dir/name.
+
+    Only the current page is kept in memory while extracting, parts are read back in chunks of
+    about chunk_rows rows when loading. The directory is cleared when entering the context, so
+    parts left by a failed attempt are never loaded twice, and removed when leaving it.
+    """
+
+    def __init__(self, logger: Logger, name: str, spill_dir: str = config.SPILL_DIR, chunk_rows: int = config.SPILL_CHUNK_ROWS):
+        self.logger = logger
+        self.path = os.path.join(spill_dir, re.sub(r"[^\w.-]", "_", name))
+        self.chunk_rows = chunk_rows
+        self.parts = []
+        self.row_count = 0
+
+    def __enter__(self):
+        self.clear()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.clear()
+        return False
+
+    def append(self, dataframe: pd.DataFrame):
+        """
+        Write a DataFrame as a new Parquet part
+        """
+        if dataframe is None or dataframe.empty:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        part = os.path.join(self.path, f"part-{len(self.parts):05d}.parquet")
+        pq.write_table(pa.Table.from_pandas(dataframe, preserve_index=False), part)
+        self.parts.append(part)
+        self.row_count += len(dataframe)
+        self.logger.debug(f"Spilled {len(dataframe)} rows to {part}, {self.row_count} rows buffered")
+
+    def read_chunks(self):
+        """
+        Read the parts back in spill order, concatenated up to chunk_rows rows
+
+        :return: generator of DataFrame
+        """
+        chunk, chunk_size = [], 0
+        for part in self.parts:
+            df = pq.read_table(part).to_pandas()
+            chunk.append(df)
+            chunk_size += len(df)
+            if chunk_size >= self.chunk_rows:
+                yield pd.concat(chunk, ignore_index=True)
+                chunk, chunk_size = [], 0
+        if chunk:
+            yield pd.concat(chunk, ignore_index=True)
+
+    def clear(self):
+        """
+        Delete every part
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.parts = []
+        self.row_count = 0
@@ -1,6 +1,7 @@
 from datetime import datetime, timezone, timedelta
 from dateutil.parser import parse
 import pytz
+import pandas as pd
 from config import config
 
 # Shared timezone objects (avoid recreating them on every call)
@@ -84,6 +85,10 @@ def utc7_str_to_unix(timestamp_str: str) -> int:
     dt = datetime.strptime(timestamp_str, "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=UTC7)
     return int(dt.timestamp())
 
+def get_now_epoch():
+    """Current epoch (ms)."""
+    return _to_epoch_ms(_now_utc7())
+
 def get_start_end_current_date_hour_epoch():
     """Start/end epoch (ms) of the current hour in UTC+7."""
     start_of_hour, end_of_hour = _hour_bounds(_now_utc7())
@@ -118,6 +123,13 @@ def convert_to_local_datetime_string(datetime_str):
     dt_local = parse(datetime_str).astimezone(pytz.timezone(config.DWH_TIMEZONE))
     return dt_local.strftime("%Y-%m-%dT%H:%M:%S.%f")
 
+def convert_to_local_datetime_series(datetime_series: pd.Series) -> pd.Series:
+    """
+    Vectorized convert_to_local_datetime_string for a whole column, unparsable or missing values become None
+    """
+    dt_local = pd.to_datetime(datetime_series, utc=True, errors="coerce", format="ISO8601").dt.tz_convert(config.DWH_TIMEZONE)
+    return dt_local.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").where(dt_local.notna(), None)
+
 def convert_formated_to_local_datetime_string(datetime_str):
     """
     Converts a date string in format like "18/06/2024 18:50:29" in UTC+7 to datetime string like "2024-06-02T17:06:55.179000"
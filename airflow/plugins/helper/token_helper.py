@@ -0,0 +1,171 @@
+"""
+This module keeps the access tokens of the source APIs in process memory, refreshed ahead of expiry
+"""
+import os
+import json
+import time
+import threading
+from logging import Logger
+from helper.redis_helper import RedisHelper
+from helper.exceptions import RedisError
+from config import config
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_managers = {}
+
+
+class TokenManager:
+    """
+    Access token of one API (a string, or a dict when the login returns more than the token) kept in
+    memory with its expiry, and shared with the other workers as JSON in Redis under key.
+
+    Requests read the memory copy without any Redis round trip. Once the token is within margin seconds
+    of expiry, one worker takes the RedisLock of key and logs in again while the others keep using the
+    token still valid. A worker without a token waits for the lock holder instead of logging in too.
+    """
+
+    def __init__(self, logger: Logger, redis: RedisHelper, key: str, fetch=None, margin: int = config.TOKEN_REFRESH_MARGIN):
+        """
+        :param key: Redis key of the token
+        :param fetch: function logging in and returning (token, ttl in seconds), None when the token
+            is refreshed outside of the helpers (e.g. the HubSpot CLI task)
+        :param margin: seconds before expiry at which the token is refreshed
+        """
+        self.logger = logger
+        self.redis = redis
+        self.key = key
+        self.fetch = fetch
+        self.margin = margin
+
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires_at = 0
+        # no Redis lookup before retry_at, after a miss without fetch
+        self.retry_at = 0
+
+    def due(self) -> bool:
+        now = time.time()
+        return now >= self.retry_at and now >= self.expires_at - self.margin
+
+    def valid(self) -> bool:
+        return self.token is not None and time.time() < self.expires_at
+
+    def get(self):
+        """
+        Return the token, from memory while it is not due for refresh
+        """
+        if not self.due():
+            return self.token
+
+        with self.lock:
+            # another thread may have refreshed it while this one waited
+            if not self.due():
+                return self.token
+
+            self.load()
+            if not self.due():
+                return self.token
+
+            if self.fetch is None:
+                if not self.valid():
+                    # nothing cached, don't ask Redis again before margin seconds
+                    self.token, self.expires_at, self.retry_at = None, 0, time.time() + self.margin
+                return self.token
+
+            return self.refresh()
+
+    def load(self):
+        """
+        Read the token and its remaining time to live from Redis
+        """
+        try:
+            pipeline = self.redis.redis_client.pipeline(transaction=False)
+            pipeline.get(self.key)
+            pipeline.pttl(self.key)
+            value, pttl = pipeline.execute()
+        except Exception as err:
+            message = f"Got error when getting token from Redis with key:{self.key} and error:{err}"
+            self.logger.error(message)
+            raise RedisError(f"Get token failed: {message}")
+
+        if value is None or pttl is None or pttl <= 0:
+            return
+
+        try:
+            token = json.loads(value)
+        except ValueError:
+            # written in another format before, log in again
+            self.logger.debug(f"Token {self.key} is not JSON, ignore it")
+            return
+
+        self.token, self.expires_at = token, time.time() + pttl / 1000
+        self.logger.debug(f"Get token {self.key} from Redis cache, expire in {int(pttl / 1000)}s")
+
+    def put(self, token, ttl: int):
+        """
+        Keep token for ttl seconds, in memory and in Redis for the other workers
+        """
+        self.redis.put_cached_value_for_key(self.key, json.dumps(token), int(ttl))
+        self.token, self.expires_at = token, time.time() + int(ttl)
+
+    def refresh(self):
+        """
+        Log in under the Redis lock of the token, or wait for the worker holding it
+        """
+        lock = self.redis.lock(self.key)
+        deadline = time.time() + config.REDIS_LOCK_TIMEOUT
+        while not lock.acquire(blocking=False):
+            if self.valid():
+                # another worker refreshes it, this one is still good meanwhile
+                return self.token
+            if time.time() >= deadline:
+                self.logger.warning(f"Lock {lock.key} still held after {config.REDIS_LOCK_TIMEOUT}s, log in anyway")
+                return self.login()
+
+            time.sleep(config.REDIS_LOCK_POLL_INTERVAL)
+            self.load()
+            if not self.due():
+                return self.token
+
+        try:
+            # the previous holder may have refreshed it just before releasing the lock
+            self.load()
+            if not self.due():
+                return self.token
+            return self.login(lock)
+        finally:
+            lock.release()
+
+    def login(self, lock=None):
+        """
+        Log in and keep the new token, in Redis only while lock was not taken over by another worker
+        """
+        token, ttl = self.fetch()
+        if lock is None:
+            self.put(token, ttl)
+        else:
+            if not lock.put_fenced(self.key, json.dumps(token), int(ttl)):
+                # the login outlasted the lock and the next holder cached its own token, ours is valid all the same
+                self.logger.warning(f"Lock {lock.key} was taken over, keep token {self.key} in memory only")
+            self.token, self.expires_at = token, time.time() + int(ttl)
+
+        self.logger.debug(f"Refresh token {self.key}, expire in {int(ttl)}s")
+        return token
+
+
+def get_token_manager(logger: Logger, redis: RedisHelper, key: str, fetch=None, margin: int = config.TOKEN_REFRESH_MARGIN) -> TokenManager:
+    """
+    Return the TokenManager shared by every helper of the process using key
+    """
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            # A forked worker starts with the token of its parent but its own locks
+            _managers.clear()
+            _pid = os.getpid()
+        manager = _managers.get(key)
+        if manager is None:
+            manager = TokenManager(logger, redis, key, fetch=fetch, margin=margin)
+            _managers[key] = manager
+        return manager
@@ -0,0 +1,95 @@
+"""
+This module helps to keep the high-water mark of incremental extractions in Redis
+"""
+from logging import Logger
+from helper.redis_helper import RedisHelper
+from helper.exceptions import RedisError
+from config import config
+
+
+class WatermarkStore:
+    """
+    High-water marks of one source/table, one per scope (e.g. Pancake page_id), stored as numbers
+    under WATERMARK:<source>:<table>:<scope> without expiry.
+
+    Extract stages the end of the window it fetched and load commits the staged marks once the
+    MERGE succeeded, so a failed run is fetched again by the next one. A mark only moves forward.
+    """
+
+    # SET the key only when the new value is greater than the current one
+    ADVANCE_SCRIPT = """
+    local current = redis.call('GET', KEYS[1])
+    if current and tonumber(current) >= tonumber(ARGV[1]) then
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[1])
+    return 1
+    """
+
+    def __init__(self, logger: Logger, redis: RedisHelper, source: str, table: str):
+        self.logger = logger
+        self.redis = redis
+        self.source = source
+        self.table = table
+        self.pending_key = RedisHelper.make_cache_key(config.WATERMARK_PENDING_REDIS, source, table)
+        self.advance_script = self.redis.redis_client.register_script(self.ADVANCE_SCRIPT)
+
+    def key(self, scope) -> str:
+        return f"{RedisHelper.make_cache_key(config.WATERMARK_REDIS, self.source, self.table)}:{scope}"
+
+    def get(self, scope):
+        """
+        Return the committed mark of scope, None if nothing was loaded yet
+        """
+        value = self.redis.get_cached_value_for_key(self.key(scope))
+        return int(float(value)) if value is not None else None
+
+    def window(self, scope, default_start, end, overlap=0):
+        """
+        Return the (start, end) window to fetch: from the mark minus overlap, or from default_start on the first run
+
+        :param overlap: re-read this much before the mark, to catch records updated late at the source
+        """
+        watermark = self.get(scope)
+        if watermark is None:
+            self.logger.debug(f"No watermark for {self.key(scope)}, start from {default_start}")
+            return default_start, end
+
+        self.logger.debug(f"Watermark of {self.key(scope)} is {watermark}, start from {watermark - overlap}")
+        return watermark - overlap, end
+
+    def stage(self, scope, value):
+        """
+        Remember the end of the window fetched for scope, applied by commit()
+        """
+        try:
+            self.redis.redis_client.hset(self.pending_key, scope, value)
+            self.redis.redis_client.expire(self.pending_key, config.WATERMARK_PENDING_TTL)
+        except Exception as err:
+            message = f"Got error when staging watermark {self.pending_key}:{scope} and error:{err}"
+            self.logger.error(message)
+            raise RedisError(f"Stage watermark failed: {message}")
+
+    def advance(self, scope, value) -> bool:
+        """
+        Move the mark of scope forward to value, never backward
+
+        :return: True if the mark moved
+        """
+        try:
+            return bool(self.advance_script(keys=[self.key(scope)], args=[value]))
+        except Exception as err:
+            message = f"Got error when advancing watermark {self.key(scope)} to {value} and error:{err}"
+            self.logger.error(message)
+            raise RedisError(f"Advance watermark failed: {message}")
+
+    def commit(self):
+        """
+        Advance every staged mark, to be called after the data of the window is loaded
+        """
+        pending = self.redis.get_cached_value_for_key_as_dict(self.pending_key)
+        for scope, value in pending.items():
+            moved = self.advance(scope, value)
+            self.logger.debug(f"Watermark {self.key(scope)} {'advanced to' if moved else 'kept, not behind'} {value}")
+        self.redis.remove_cached_value_for_key(self.pending_key)
+        return pending
@@ -10,6 +10,7 @@ from helper.gcp_helper import GCSHelper, BQHelper
 import helper.time_helper as TimeHelper  
 from helper.mongodb_helper import MongoDBHeler
 from helper.redis_helper import RedisHelper
+from helper.etl_helper import fetch_pages_concurrently, record_fingerprint
 from config import config
 
 
@@ -45,6 +46,7 @@ class StocksETL:
         self.run_config = self.context['dag_run'].conf.get(table_name) if self.context['dag_run'].conf.get(table_name) else self.context['vars'].get(table_name)
 
         self.dataset_staging_id = config.DATASET_STAGING_ID
+        self.fingerprint_collection = f"{self.table_name}_fingerprints"
 
     def extract(self):
         """
@@ -61,28 +63,66 @@ class StocksETL:
         number_of_items = summary_stocks.get("Total")
         number_of_pages = math.ceil(number_of_items/config.AMIS_WEB_PAGE_LIMIT)
 
-        for page in range(1, number_of_pages+1):
+        max_workers = self.run_config.get("max_workers") or config.AMIS_WEB_MAX_WORKERS
 
-            self.logger.debug(f"Get data {self.table_name} from Amis | page {page}")
+        # Staging only carries the delta of this run
+        self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
+
+        if self.run_config.get("full_refresh"):
+            self.logger.debug("Full refresh, ignore stored fingerprints")
+            fingerprints = {}
+        else:
+            fingerprints = self.get_fingerprints()
+            self.logger.debug(f"Got {len(fingerprints)} stored fingerprints")
 
+        def fetch_page(page):
+            self.logger.debug(f"Get data {self.table_name} from Amis | page {page}")
             stock_data = self.amis.get_stocks(page=page, load_mode=2)
-            list_stocks = stock_data.get("PageData")
-    
-            if list_stocks:
-                self.context['ti'].xcom_push(key=config.NEW_DATA, value=True)
-            else:
-                self.context['ti'].xcom_push(key=config.NEW_DATA, value=False)
-                self.logger.debug("There is no new data. Skip extract job !")
-                return "Success"
-            
+            return stock_data.get("PageData")
+
+        number_of_records = 0
+        number_of_changes = 0
+
+        # Page range is known up front, fan out over a bounded pool and persist pages as they arrive
+        for page, list_stocks in fetch_pages_concurrently(
+                fetch_page=fetch_page,
+                pages=range(1, number_of_pages+1),
+                logger=self.logger,
+                max_workers=max_workers,
+                max_retry=config.AMIS_WEB_MAX_RETRY,
+                retry_delay=config.AMIS_WEB_RETRY_DELAY
+            ):
+
+            if not list_stocks:
+                self.logger.debug(f"Page {page} of {self.table_name} is empty")
+                continue
+
+            number_of_records += len(list_stocks)
+
+            # Only keep records whose version or content changed since the last load
+            changed_records = []
             for stock in list_stocks:
-                self.mongodb.update_one(database=config.MONGODB_STAGING, collection=self.table_name, 
-                                        contition={"_id": stock.get("stock_id")}, 
-                                        update_query={"$set": stock},
-                                        upsert=True
-                                        )
+                fingerprint = record_fingerprint(stock)
+                if fingerprints.get(stock.get("stock_id")) != fingerprint:
+                    changed_records.append({**stock, config.FINGERPRINT_FIELD: fingerprint})
 
-        return "Success"  
+            if not changed_records:
+                continue
+
+            self.mongodb.bulk_upsert(database=config.MONGODB_STAGING, collection=self.table_name,
+                                     operations=[({"_id": stock.get("stock_id")}, {"$set": stock}) for stock in changed_records]
+                                     )
+            number_of_changes += len(changed_records)
+
+        self.logger.debug(f"Got {number_of_records} records of {self.table_name} from {number_of_pages} pages, {number_of_changes} changed")
+
+        if number_of_changes:
+            self.context['ti'].xcom_push(key=config.NEW_DATA, value=True)
+        else:
+            self.context['ti'].xcom_push(key=config.NEW_DATA, value=False)
+            self.logger.debug("There is no new data. Skip extract job !")
+
+        return "Success"
 
     def transform(self):
         """
@@ -99,24 +139,24 @@ class StocksETL:
             return "Success"            
 
         self.logger.debug("Truncate staging table...")
-        # truncate_result = self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
-        # self.logger.debug(f"Truncate staging table, result {truncate_result}")
+        truncate_result = self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
+        self.logger.debug(f"Truncate staging table, result {truncate_result}")
 
-        documents = self.mongodb.find(config.MONGODB_STAGING, self.table_name, {}, {"_id": 0})
+        # Stream the staging collection chunk by chunk instead of materializing the whole full load
+        chunks = (self.transform_chunk(df) for df in self.mongodb.find_batches(config.MONGODB_STAGING, self.table_name, {}, {"_id": 0, config.FINGERPRINT_FIELD: 0}))
+        total_rows = self.bq.bq_append_chunks(chunks=chunks, table_name=self.table_name, dataset_id=self.dataset_staging_id)
 
-        df = pd.DataFrame(documents)
-
-        df["created_date"] = df["created_date"].map(lambda i: i.split("+")[0])
-        df["modified_date"] = df["modified_date"].map(lambda i: i.split("+")[0])
-
-        self.logger.debug(f"The DataFrame has {len(df)} rows.")
-        # print(df.dtypes)
-        self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id)
+        self.logger.debug(f"Loaded {total_rows} rows to staging table.")
 
         # self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
 
         return "Success"  
 
+    def transform_chunk(self, df):
+        df["created_date"] = df["created_date"].map(lambda i: i.split("+")[0])
+        df["modified_date"] = df["modified_date"].map(lambda i: i.split("+")[0])
+        return df
+
     def load(self):
         """
         Execute MERGE statement to upsert (use SCD Type 2) from staging table to curated table and then clear staging table
@@ -131,45 +171,37 @@ class StocksETL:
             self.logger.debug("There is no new data. Skip transform job !")
             return "Success"  
 
-        merge_query = f'''
-        merge `{self.project_id}.{self.dataset_id}.{self.table_name}` t
-        using (
-            select *
-            from `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            where 1=1
-            qualify row_number() over(partition by stock_id order by modified_date desc) = 1
-        ) s
-        on t.stock_id = s.stock_id
-        when matched then
-        update set 
-            t.auto_refno = s.auto_refno,
-            t.branch_id = s.branch_id,
-            t.branch_name = s.branch_name,
-            t.created_by = s.created_by,
-            t.created_date = s.created_date,
-            t.edit_version = s.edit_version,
-            t.excel_row_index = s.excel_row_index,
-            t.from_stock_id = s.from_stock_id,
-            t.inactive = s.inactive,
-            t.inventory_account = s.inventory_account,
-            t.isCustomPrimaryKey = s.isCustomPrimaryKey,
-            t.isFromProcessBalance = s.isFromProcessBalance,
-            t.is_sync_corp = s.is_sync_corp,
-            t.is_valid = s.is_valid,
-            t.modified_by = s.modified_by,
-            t.modified_date = s.modified_date,
-            t.pass_edit_version = s.pass_edit_version,
-            t.reftype = s.reftype,
-            t.reftype_category = s.reftype_category,
-            t.state = s.state,
-            t.stock_code = s.stock_code,
-            t.stock_name = s.stock_name,
-            t.to_stock_id = s.to_stock_id
-        when not matched then
-        insert row
-        '''
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
-
-        return "Success"  
\ No newline at end of file
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['stock_id'],
+            order_by="modified_date DESC",
+        )
+
+        # Fingerprints are committed only once the delta is merged, a failed run is picked up again next time
+        self.commit_fingerprints()
+
+        return "Success"
+
+    def get_fingerprints(self):
+        """
+        Fingerprints of the records already loaded, keyed by record id
+        """
+        documents = self.mongodb.find(config.MONGODB_CACHING, self.fingerprint_collection, {}, {"fingerprint": 1})
+        return {document["_id"]: document.get("fingerprint") for document in documents}
+
+    def commit_fingerprints(self):
+        """
+        Store the fingerprints of the staged delta into the caching collection
+        """
+        number_of_fingerprints = 0
+        for df in self.mongodb.find_batches(config.MONGODB_STAGING, self.table_name, {}, {config.FINGERPRINT_FIELD: 1}):
+            if config.FINGERPRINT_FIELD not in df.columns:
+                continue
+            self.mongodb.bulk_upsert(database=config.MONGODB_CACHING, collection=self.fingerprint_collection,
+                                     operations=[({"_id": _id}, {"$set": {"fingerprint": fingerprint}}) for _id, fingerprint in zip(df["_id"], df[config.FINGERPRINT_FIELD])]
+                                     )
+            number_of_fingerprints += len(df)
+
+        self.logger.debug(f"Committed {number_of_fingerprints} fingerprints of {self.table_name}")  
\ No newline at end of file
@@ -10,6 +10,7 @@ from helper.gcp_helper import GCSHelper, BQHelper
 import helper.time_helper as TimeHelper  
 from helper.mongodb_helper import MongoDBHeler
 from helper.redis_helper import RedisHelper
+from helper.etl_helper import fetch_pages_concurrently, record_fingerprint
 from config import config
 
 
@@ -45,6 +46,7 @@ class SupplyGoodsETL:
         self.run_config = self.context['dag_run'].conf.get(table_name) if self.context['dag_run'].conf.get(table_name) else self.context['vars'].get(table_name)
 
         self.dataset_staging_id = config.DATASET_STAGING_ID
+        self.fingerprint_collection = f"{self.table_name}_fingerprints"
 
     def extract(self):
         """
@@ -61,27 +63,66 @@ class SupplyGoodsETL:
         number_of_items = summary_inventory_items.get("Total")
         number_of_pages = math.ceil(number_of_items/config.AMIS_WEB_PAGE_LIMIT)
 
-        for page in range(1, number_of_pages+1):
+        max_workers = self.run_config.get("max_workers") or config.AMIS_WEB_MAX_WORKERS
 
-            self.logger.debug(f"Get data {self.table_name} from Amis | page {page}")
+        # Staging only carries the delta of this run
+        self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
+
+        if self.run_config.get("full_refresh"):
+            self.logger.debug("Full refresh, ignore stored fingerprints")
+            fingerprints = {}
+        else:
+            fingerprints = self.get_fingerprints()
+            self.logger.debug(f"Got {len(fingerprints)} stored fingerprints")
 
+        def fetch_page(page):
+            self.logger.debug(f"Get data {self.table_name} from Amis | page {page}")
             inventory_items_data = self.amis.get_inventory_items(page=page, load_mode=2)
-            list_inventory_items = inventory_items_data.get("PageData")
-    
-            if list_inventory_items:
-                self.context['ti'].xcom_push(key=config.NEW_DATA, value=True)
-            else:
-                self.context['ti'].xcom_push(key=config.NEW_DATA, value=False)
-                self.logger.debug("There is no new data. Skip extract job !")
-                return "Success"
-            
+            return inventory_items_data.get("PageData")
+
+        number_of_records = 0
+        number_of_changes = 0
+
+        # Page range is known up front, fan out over a bounded pool and persist pages as they arrive
+        for page, list_inventory_items in fetch_pages_concurrently(
+                fetch_page=fetch_page,
+                pages=range(1, number_of_pages+1),
+                logger=self.logger,
+                max_workers=max_workers,
+                max_retry=config.AMIS_WEB_MAX_RETRY,
+                retry_delay=config.AMIS_WEB_RETRY_DELAY
+            ):
+
+            if not list_inventory_items:
+                self.logger.debug(f"Page {page} of {self.table_name} is empty")
+                continue
+
+            number_of_records += len(list_inventory_items)
+
+            # Only keep records whose version or content changed since the last load
+            changed_records = []
             for inventory_items in list_inventory_items:
-                self.mongodb.update_one(database=config.MONGODB_STAGING, collection=self.table_name, 
-                                        contition={"_id": inventory_items.get("inventory_item_id")}, 
-                                        update_query={"$set": inventory_items},
-                                        upsert=True
-                                        )
-        return "Success"  
+                fingerprint = record_fingerprint(inventory_items)
+                if fingerprints.get(inventory_items.get("inventory_item_id")) != fingerprint:
+                    changed_records.append({**inventory_items, config.FINGERPRINT_FIELD: fingerprint})
+
+            if not changed_records:
+                continue
+
+            self.mongodb.bulk_upsert(database=config.MONGODB_STAGING, collection=self.table_name,
+                                     operations=[({"_id": inventory_items.get("inventory_item_id")}, {"$set": inventory_items}) for inventory_items in changed_records]
+                                     )
+            number_of_changes += len(changed_records)
+
+        self.logger.debug(f"Got {number_of_records} records of {self.table_name} from {number_of_pages} pages, {number_of_changes} changed")
+
+        if number_of_changes:
+            self.context['ti'].xcom_push(key=config.NEW_DATA, value=True)
+        else:
+            self.context['ti'].xcom_push(key=config.NEW_DATA, value=False)
+            self.logger.debug("There is no new data. Skip extract job !")
+
+        return "Success"
 
     def transform(self):
         """
@@ -101,21 +142,21 @@ class SupplyGoodsETL:
         truncate_result = self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
         self.logger.debug(f"Truncate staging table, result {truncate_result}")
 
-        documents = self.mongodb.find(config.MONGODB_STAGING, self.table_name, {}, {"_id": 0})
+        # Stream the staging collection chunk by chunk instead of materializing the whole full load
+        chunks = (self.transform_chunk(df) for df in self.mongodb.find_batches(config.MONGODB_STAGING, self.table_name, {}, {"_id": 0, config.FINGERPRINT_FIELD: 0}))
+        total_rows = self.bq.bq_append_chunks(chunks=chunks, table_name=self.table_name, dataset_id=self.dataset_staging_id)
 
-        df = pd.DataFrame(documents)
-
-        df["created_date"] = df["created_date"].map(lambda i: i.split("+")[0])
-        df["modified_date"] = df["modified_date"].map(lambda i: i.split("+")[0])
-
-        self.logger.debug(f"The DataFrame has {len(df)} rows.")
-        # print(df.dtypes)
-        self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id)
+        self.logger.debug(f"Loaded {total_rows} rows to staging table.")
 
         # self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
 
         return "Success"  
 
+    def transform_chunk(self, df):
+        df["created_date"] = df["created_date"].map(lambda i: i.split("+")[0])
+        df["modified_date"] = df["modified_date"].map(lambda i: i.split("+")[0])
+        return df
+
     def load(self):
         """
         Execute MERGE statement to upsert (use SCD Type 2) from staging table to curated table and then clear staging table
@@ -130,72 +171,37 @@ class SupplyGoodsETL:
             self.logger.debug("There is no new data. Skip transform job !")
             return "Success"  
 
-        merge_query = f'''
-        merge `{self.project_id}.{self.dataset_id}.{self.table_name}` t
-        using (
-            select *
-            from `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            where 1=1
-            qualify row_number() over(partition by inventory_item_id order by modified_date desc) = 1
-        ) s
-        on t.inventory_item_id = s.inventory_item_id
-        when matched then
-        update set 
-            t.auto_refno = s.auto_refno,
-            t.branch_id = s.branch_id,
-            t.branch_name = s.branch_name,
-            t.cogs_account = s.cogs_account,
-            t.created_by = s.created_by,
-            t.created_date = s.created_date,
-            t.discount_account = s.discount_account,
-            t.discount_type = s.discount_type,
-            t.export_tax_rate = s.export_tax_rate,
-            t.fixed_sale_price = s.fixed_sale_price,
-            t.fixed_unit_price = s.fixed_unit_price,
-            t.import_tax_rate = s.import_tax_rate,
-            t.inactive = s.inactive,
-            t.inventory_account = s.inventory_account,
-            t.inventory_item_code = s.inventory_item_code,
-            t.inventory_item_cost_method = s.inventory_item_cost_method,
-            t.inventory_item_id = s.inventory_item_id,
-            t.inventory_item_name = s.inventory_item_name,
-            t.inventory_item_type = s.inventory_item_type,
-            t.is_allow_duplicate_serial_number = s.is_allow_duplicate_serial_number,
-            t.is_drug = s.is_drug,
-            t.is_follow_serial_number = s.is_follow_serial_number,
-            t.is_specific_inventory_item = s.is_specific_inventory_item,
-            t.is_sync_corp = s.is_sync_corp,
-            t.is_system = s.is_system,
-            t.is_unit_price_after_tax = s.is_unit_price_after_tax,
-            t.minimum_stock = s.minimum_stock,
-            t.modified_by = s.modified_by,
-            t.modified_date = s.modified_date,
-            t.pass_edit_version = s.pass_edit_version,
-            t.purchase_description = s.purchase_description,
-            t.purchase_discount_rate = s.purchase_discount_rate,
-            t.return_account = s.return_account,
-            t.sale_account = s.sale_account,
-            t.sale_description = s.sale_description,
-            t.sale_off_account = s.sale_off_account,
-            t.sale_price1 = s.sale_price1,
-            t.sale_price2 = s.sale_price2,
-            t.sale_price3 = s.sale_price3,
-            t.search_data = s.search_data,
-            t.state = s.state,
-            t.status_sync_medicine_national = s.status_sync_medicine_national,
-            t.tax_rate = s.tax_rate,
-            t.tax_reduction_type = s.tax_reduction_type,
-            t.unit_id = s.unit_id,
-            t.unit_name = s.unit_name,
-            t.unit_price = s.unit_price,
-            t.cost_method = s.cost_method,
-            t.edit_version = s.edit_version,
-            t.ta_career_group_id = s.ta_career_group_id
-        when not matched then
-        insert row
-        '''
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
-
-        return "Success"  
\ No newline at end of file
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['inventory_item_id'],
+            order_by="modified_date DESC",
+        )
+
+        # Fingerprints are committed only once the delta is merged, a failed run is picked up again next time
+        self.commit_fingerprints()
+
+        return "Success"
+
+    def get_fingerprints(self):
+        """
+        Fingerprints of the records already loaded, keyed by record id
+        """
+        documents = self.mongodb.find(config.MONGODB_CACHING, self.fingerprint_collection, {}, {"fingerprint": 1})
+        return {document["_id"]: document.get("fingerprint") for document in documents}
+
+    def commit_fingerprints(self):
+        """
+        Store the fingerprints of the staged delta into the caching collection
+        """
+        number_of_fingerprints = 0
+        for df in self.mongodb.find_batches(config.MONGODB_STAGING, self.table_name, {}, {config.FINGERPRINT_FIELD: 1}):
+            if config.FINGERPRINT_FIELD not in df.columns:
+                continue
+            self.mongodb.bulk_upsert(database=config.MONGODB_CACHING, collection=self.fingerprint_collection,
+                                     operations=[({"_id": _id}, {"$set": {"fingerprint": fingerprint}}) for _id, fingerprint in zip(df["_id"], df[config.FINGERPRINT_FIELD])]
+                                     )
+            number_of_fingerprints += len(df)
+
+        self.logger.debug(f"Committed {number_of_fingerprints} fingerprints of {self.table_name}")  
\ No newline at end of file
@@ -158,40 +158,13 @@ class DahahiCheckinETL:
             self.logger.debug("There is no new data. Skip load job !")
             return "Success"   
 
-        merge_query = f'''
-        merge `{self.project_id}.{self.dataset_id}.{self.table_name}` t
-        using `{self.project_id}.{self.dataset_staging_id}.{self.table_name}` s
-        on t.face_id = s.face_id and t.face_person_id = s.face_person_id and t.checkin_datetime = s.checkin_datetime
-        when matched then
-        update set 
-            t.face_id = s.face_id,
-            t.face_person_id = s.face_person_id,
-            t.employee_code = s.employee_code,
-            t.employee_id = s.employee_id,
-            t.employee_name = s.employee_name,
-            t.checkin_datetime = s.checkin_datetime
-        when not matched then
-        insert (
-            face_id,
-            face_person_id, 
-            employee_code, 
-            employee_id, 
-            employee_name, 
-            checkin_datetime, 
-            inserted_datetime
-            )
-        values (
-            face_id,
-            face_person_id, 
-            employee_code, 
-            employee_id, 
-            employee_name, 
-            checkin_datetime, 
-            CURRENT_DATETIME("+7")
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['face_id', 'face_person_id', 'checkin_datetime'],
+            columns=["face_id", "face_person_id", "employee_code", "employee_id", "employee_name", "checkin_datetime"],
+            insert_values={"inserted_datetime": 'CURRENT_DATETIME("+7")'},
         )
-        '''
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
 
         return "Success"  
\ No newline at end of file
@@ -130,34 +130,15 @@ class DahahiEmployeesETL:
             self.logger.debug(f"Temp table {self.temp_table_id} not found (no data extracted). Skip load !")
             return "Success"
 
-        # Build the MERGE dynamically from the temp table columns (same approach as ConversationsETL),
-        # keeping the latest row per EmployeeCode via QUALIFY on ingested_at.
-        identifier_cols = ['EmployeeCode']
-        table_cols = self.bq.get_columns(dataset_id=self.dataset_staging_id, table_id=self.temp_table_name)
-
-        partition_cols = ", ".join(identifier_cols)
-        on_clause = " and ".join([f"target.{col} = source.{col}" for col in identifier_cols])
-        update_set_clause = ", ".join([f"target.{col} = source.{col}" for col in table_cols if col not in identifier_cols])
-        insert_cols_clause = ", ".join(table_cols)
-        insert_values_clause = ", ".join([f"source.{col}" for col in table_cols])
-
-        merge_query = f"""
-        MERGE `{self.project_id}.{self.dataset_id}.{self.table_name}` AS target
-        USING (
-            SELECT *
-            FROM `{self.temp_table_id}`
-            QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition_cols} ORDER BY ingested_at DESC) = 1
-        ) AS source
-        ON {on_clause}
-        WHEN MATCHED THEN
-            UPDATE SET {update_set_clause}
-        WHEN NOT MATCHED THEN
-            INSERT ({insert_cols_clause})
-            VALUES ({insert_values_clause})
-        """
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
+        # Keep the latest row per key via QUALIFY on ingested_at
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            source_table_id=self.temp_table_id,
+            key_columns=['EmployeeCode'],
+            order_by="ingested_at DESC",
+        )
 
         # Temp table is left to auto-expire (expiration set during extract); no explicit DROP.
         return "Success"
@@ -9,6 +9,8 @@ from helper.gcp_helper import GCSHelper, BQHelper
 import helper.time_helper as TimeHelper  
 from helper.mongodb_helper import MongoDBHeler
 from helper.redis_helper import RedisHelper
+from helper.spill_helper import ParquetSpillBuffer
+from helper.checkpoint_helper import CheckpointStore
 from config import config
 
 
@@ -59,66 +61,80 @@ class InventoryItemsETL:
         else:
             self.logger.debug(f"start - Fullload")
 
-        self.logger.debug(f"Get last page")
-        page =  self.redis.get_cached_value_for_key(config.ESHOP_INVENTORY_LATEST_PAGE_REDIS)
-        page = int(page) if page else 1
+        if self.run_config.get("spill"):
+            return self.extract_spill()
 
-        self.logger.debug(f"Get data {self.table_name} from Eshop | page {page}")
+        with CheckpointStore(logger=self.logger, redis=self.redis, context=self.context) as checkpoint:
+            cursor = checkpoint.load()
+            page = cursor.get("page", 0) + 1
+            new_data = cursor.get("new_data", False)
 
-        results = self.eshop.get_inventory_items(page=page, last_sync_date=self.start_date)
-    
-        if results:
-            self.context['ti'].xcom_push(key=config.NEW_DATA, value=True)
-        else:
-            self.context['ti'].xcom_push(key=config.NEW_DATA, value=False)
-            self.logger.debug("There is no new data. Skip extract job !")
-            return "Success"
+            while True:
+                self.logger.debug(f"Get data {self.table_name} from Eshop | page {page}")
+                results = self.eshop.get_inventory_items(page=page, last_sync_date=self.start_date)
+
+                if results:
+                    self.mongodb.bulk_upsert(database=config.MONGODB_STAGING, collection=self.table_name,
+                                             operations=[({"_id": inventory_items.get("Id")}, {"$set": inventory_items}) for inventory_items in results]
+                                             )
+                    new_data = True
+                    checkpoint.save(page=page, new_data=new_data)
+
+                if not results or len(results) < config.ESHOP_PAGE_LIMIT:
+                    break
+                page += 1
 
-        # data_inventory_items = []
-        for inventory_items in results:
-        #     data_inventory_items.append({"_id": inventory_items.get("Id"), **inventory_items})
-            self.mongodb.update_one(database=config.MONGODB_STAGING, collection=self.table_name, 
-                                    contition={"_id": inventory_items.get("Id")}, 
-                                    update_query={"$set": inventory_items},
-                                    upsert=True
-                                    )
-        # self.mongodb.insert_many(database=config.MONGODB_STAGING, collection=self.table_name, list_document=data_inventory_items)
-        # self.mongodb.insert_many(database=config.MONGODB_STAGING, collection=self.table_name, list_document=results)
-
-        # json_data = '\n'.join(json.dumps(data_dict, ensure_ascii=False) for data_dict in results)
-        # file_name = f"{config.PREFIX_ESHOP_BUCKET}/{self.table_name}/{self.path_date}/{config.PREFIX_JSON_FILE}_{page}.json"
-        # self.logger.debug(f"Upload json data {self.table_name} to GCS: {file_name}")
-        # self.gcs.upload_json(json_string=json_data, file_name=file_name)
-
-        self.redis.put_cached_value_for_key(config.ESHOP_INVENTORY_LATEST_PAGE_REDIS, page, 300)
-
-        while len(results) == config.ESHOP_PAGE_LIMIT:
-            page += 1
-            self.logger.debug(f"Get data {self.table_name} from Eshop {page}")
-
-            results = self.eshop.get_inventory_items(page=page, last_sync_date=self.start_date)
-
-            if results:
-                # data_inventory_items = []
-                for inventory_items in results:
-                #     data_inventory_items.append({"_id": inventory_items.get("Id"), **inventory_items})
-                    self.mongodb.update_one(database=config.MONGODB_STAGING, collection=self.table_name, 
-                                            contition={"_id": inventory_items.get("Id")}, 
-                                            update_query={"$set": inventory_items},
-                                            upsert=True
-                                            )
-
-                # json_data = '\n'.join(json.dumps(data_dict, ensure_ascii=False) for data_dict in results)
-                # file_name = f"{config.PREFIX_ESHOP_BUCKET}/{self.table_name}/{self.path_date}/{config.PREFIX_JSON_FILE}_{page}.json"
-                # self.logger.debug(f"Upload json data {self.table_name} to GCS: {file_name}")
-                # self.gcs.upload_json(json_string=json_data, file_name=file_name)
-
-                self.redis.put_cached_value_for_key(config.ESHOP_INVENTORY_LATEST_PAGE_REDIS, page, 300)
-
-        self.redis.remove_cached_value_for_key(config.ESHOP_INVENTORY_LATEST_PAGE_REDIS)
+            checkpoint.clear()
+
+        self.context['ti'].xcom_push(key=config.NEW_DATA, value=new_data)
+        if not new_data:
+            self.logger.debug("There is no new data. Skip extract job !")
 
         return "Success"  
 
+    def extract_spill(self):
+        """
+        Transform every page as it arrives, spill it to local Parquet and load the staging table from the spill,
+        the staging collection in MongoDB is skipped and transform has nothing left to do.
+
+        The spill is flushed to the staging table every ESHOP_SPILL_FLUSH_PAGES pages and only then the page is
+        checkpointed, so a retry resumes after the last loaded page.
+        """
+        with CheckpointStore(logger=self.logger, redis=self.redis, context=self.context) as checkpoint:
+            cursor = checkpoint.load()
+            page = cursor.get("page", 0) + 1
+            total_rows = cursor.get("rows", 0)
+
+            if not cursor:
+                self.logger.debug("Truncate staging table...")
+                self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
+
+            spill_name = f"{self.context['dag'].dag_id}.{self.table_name}.{self.context['run_id']}"
+            with ParquetSpillBuffer(logger=self.logger, name=spill_name) as spill:
+                while True:
+                    self.logger.debug(f"Get data {self.table_name} from Eshop | page {page}")
+                    results = self.eshop.get_inventory_items(page=page, last_sync_date=self.start_date)
+
+                    if results:
+                        spill.append(self.transform_page(pd.DataFrame(results)))
+
+                    last_page = not results or len(results) < config.ESHOP_PAGE_LIMIT
+                    if spill.parts and (last_page or len(spill.parts) >= config.ESHOP_SPILL_FLUSH_PAGES):
+                        total_rows += self.bq.bq_append_chunks(chunks=spill.read_chunks(), table_name=self.table_name, dataset_id=self.dataset_staging_id, load_method="load_arrow")
+                        spill.clear()
+                        checkpoint.save(page=page, rows=total_rows)
+
+                    if last_page:
+                        break
+                    page += 1
+
+            checkpoint.clear()
+
+        self.context['ti'].xcom_push(key=config.NEW_DATA, value=bool(total_rows))
+        self.logger.debug(f"Loaded {total_rows} rows to staging table" if total_rows else "There is no new data. Skip extract job !")
+
+        return "Success"
+
     def transform(self):
         """
         Pull data from GCS, transform data and upload to staging table
@@ -126,6 +142,10 @@ class InventoryItemsETL:
         if not self.run_config.get("transform"):
             self.logger.debug("Skip tranform job !")
             return "Success"
+
+        if self.run_config.get("spill"):
+            self.logger.debug("Staging table was loaded by extract. Skip transform job !")
+            return "Success"
         
         if self.context['ti'].xcom_pull(task_ids=f"{self.namespace}.{self.table_name}.extract_{self.table_name}", key=config.NEW_DATA):
             if self.start_date:
@@ -156,11 +176,24 @@ class InventoryItemsETL:
 
         df = pd.DataFrame(documents)
 
+        df = self.transform_page(df)
+
+        self.logger.debug(f"The DataFrame has {len(df)} rows.")
+        self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id)
+
+        # self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
+
+        return "Success"  
+
+    def transform_page(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Flatten raw inventory items to one row per branch with the staging table columns
+        """
         df = df.drop(columns=['BranchId', 'Picture', 'ListPictureUrl'])
 
         df = df.rename(columns={'SellingPrice': 'SellingPriceBK'})
 
-        df = df.explode("Inventories")
+        df = df.explode("Inventories").reset_index(drop=True)
 
         df = df.join(pd.json_normalize(df['Inventories']))
 
@@ -203,12 +236,7 @@ class InventoryItemsETL:
             'ModifiedDate',
         ]]
 
-        self.logger.debug(f"The DataFrame has {len(df)} rows.")
-        self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id)
-
-        # self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
-
-        return "Success"  
+        return df
 
     def load(self):
         """
@@ -227,46 +255,12 @@ class InventoryItemsETL:
             self.logger.debug("There is no new data. Skip transform job !")
             return "Success"  
 
-        merge_query = f'''
-        merge `{self.project_id}.{self.dataset_id}.{self.table_name}` t
-        using (
-            select *
-            from `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            where 1=1
-            qualify row_number() over(partition by Id, BranchId order by ModifiedDate desc) = 1
-        ) s
-        on t.Id = s.Id and t.BranchId = s.BranchId
-        when matched then
-        update set 
-            t.Code = s.Code,
-            t.Name = s.Name,
-            t.ItemType = s.ItemType,
-            t.ItemCategoryId = s.ItemCategoryId,
-            t.ItemCategoryName = s.ItemCategoryName,
-            t.Barcode = s.Barcode,
-            t.CostPrice = s.CostPrice,
-            t.Color = s.Color,
-            t.Size = s.Size,
-            t.Description = s.Description,
-            t.IsItem = s.IsItem,
-            t.Inactive = s.Inactive,
-            t.UnitId = s.UnitId,
-            t.UnitName = s.UnitName,
-            t.AvgUnitPrice = s.AvgUnitPrice,
-            t.ProductId = s.ProductId,
-            t.ProductCode = s.ProductCode,
-            t.ProductName = s.ProductName,
-            t.BranchName = s.BranchName,
-            t.SellingPrice = s.SellingPrice,
-            t.OnHand = s.OnHand,
-            t.Ordered = s.Ordered,
-            t.PreOrdered = s.PreOrdered,
-            t.ModifiedDate = s.ModifiedDate
-        when not matched then
-        insert row
-        '''
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['Id', 'BranchId'],
+            order_by="ModifiedDate DESC",
+        )
 
         return "Success"  
\ No newline at end of file
@@ -74,31 +74,32 @@ class InvoiceDetailsETL:
             self.logger.debug("There is no new data. Skip extract job !")
             return "Success"
 
-        for invoice in list_invoices:
-            invoice_id = invoice.get("InvoiceId")
-            data = self.eshop.get_invoice_details(invoice_id)
-            result = {
-                "InvoiceId": invoice_id,
-                "CustomerId": data.get("CustomerId"),
-                "InvoiceDetails": data.get("InvocieDetails")
-            }
-            self.mongodb.update_one(
-                            database=config.MONGODB_CACHING, 
-                            collection=self.invoices_temp_table,
-                            contition={"_id": invoice_id},
-                            update_query={"$set": {"GetDetailStatus": True}}
-                            )
-            # self.mongodb.insert_one(database=config.MONGODB_STAGING, collection=self.table_name, document={"_id": invoice_id, **result})
-            self.mongodb.update_one(database=config.MONGODB_STAGING, collection=self.table_name, 
-                                    contition={"_id": invoice_id}, 
-                                    update_query={"$set": result},
-                                    upsert=True
-                                    )
-
-        # with concurrent.futures.ThreadPoolExecutor(10) as executor:
-        #     with tqdm(total=len(list_invoices), desc="Processing Tasks") as pbar:
-        #         for future in executor.map(invoice_details, list_invoices):
-        #             pbar.update(1)
+        max_workers = self.run_config.get("max_workers") or config.ESHOP_DETAIL_MAX_WORKERS
+        batch_size = self.run_config.get("batch_size") or config.ESHOP_DETAIL_BATCH_SIZE
+
+        batch_results = []
+        error = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.get_invoice_detail, invoice.get("InvoiceId")) for invoice in list_invoices]
+
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="Get invoice details"):
+                try:
+                    batch_results.append(future.result())
+                except Exception as e:
+                    # Keep saving finished invoices, the failed ones stay GetDetailStatus False for the retry
+                    self.logger.error(f"Error when getting invoice detail: {e}")
+                    error = error or e
+
+                if len(batch_results) >= batch_size:
+                    self.save_invoice_details(batch_results)
+                    batch_results = []
+
+        if batch_results:
+            self.save_invoice_details(batch_results)
+
+        if error:
+            raise error
 
         # list_invoice_details = self.mongodb.find(config.MONGODB_STAGING, self.table_name, {}, {"_id": 0})
         
@@ -111,6 +112,30 @@ class InvoiceDetailsETL:
 
         return "Success"  
 
+    def get_invoice_detail(self, invoice_id):
+        data = self.eshop.get_invoice_details(invoice_id)
+        return {
+            "InvoiceId": invoice_id,
+            "CustomerId": data.get("CustomerId"),
+            "InvoiceDetails": data.get("InvocieDetails")
+        }
+
+    def save_invoice_details(self, results):
+        """
+        Upsert a batch of invoice details to staging then flag the invoices as done, one round trip per collection
+        """
+        self.mongodb.bulk_upsert(
+            database=config.MONGODB_STAGING,
+            collection=self.table_name,
+            operations=[({"_id": result["InvoiceId"]}, {"$set": result}) for result in results]
+            )
+        self.mongodb.bulk_upsert(
+            database=config.MONGODB_CACHING,
+            collection=self.invoices_temp_table,
+            operations=[({"_id": result["InvoiceId"]}, {"$set": {"GetDetailStatus": True}}) for result in results],
+            upsert=False
+            )
+
     def transform(self):
         """
         Pull data from GCS, transform data and upload to staging table
@@ -186,35 +211,12 @@ class InvoiceDetailsETL:
             self.logger.debug("There is no new data. Skip transform job !")
             return "Success"   
 
-        merge_query = f'''
-        merge `{self.project_id}.{self.dataset_id}.{self.table_name}` t
-        using (
-            select *
-            from `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            where 1=1
-            qualify row_number() over(partition by InvoiceId, SKU order by SortOrder desc) = 1
-        ) s
-        on t.InvoiceId = s.InvoiceId and t.SKU = s.SKU
-        when matched then
-        update set 
-            t.InvoiceDetailType = s.InvoiceDetailType,
-            t.ParentId = s.ParentId,
-            t.Name = s.Name,
-            t.Quantity = s.Quantity,
-            t.ItemType = s.ItemType,
-            t.UnitId = s.UnitId,
-            t.UnitName = s.UnitName,
-            t.UnitPrice = s.UnitPrice,
-            t.Amount = s.Amount,
-            t.TotalAmount = s.TotalAmount,
-            t.DiscountAmount = s.DiscountAmount,
-            t.SortOrder = s.SortOrder,
-            t.CustomerId = s.CustomerId
-        when not matched then
-        insert row
-        '''
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['InvoiceId', 'SKU'],
+            order_by="SortOrder DESC",
+        )
 
         return "Success"  
\ No newline at end of file
@@ -9,6 +9,8 @@ from helper.gcp_helper import GCSHelper, BQHelper
 import helper.time_helper as TimeHelper  
 from helper.mongodb_helper import MongoDBHeler
 from helper.redis_helper import RedisHelper
+from helper.spill_helper import ParquetSpillBuffer
+from helper.checkpoint_helper import CheckpointStore
 from config import config
 
 class InvoicesETL:
@@ -57,82 +59,104 @@ class InvoicesETL:
 
         self.logger.debug(f"start - {self.start_datetime} | end - {self.end_datetime}")
 
-        self.logger.debug(f"Get last page")
-        page =  self.redis.get_cached_value_for_key(config.ESHOP_INVOICE_LATEST_PAGE_REDIS)
-        page = int(page) if page else 1
+        if self.run_config.get("spill"):
+            return self.extract_spill()
 
-        self.logger.debug(f"Get data {self.table_name} from Eshop | page {page}")
+        with CheckpointStore(logger=self.logger, redis=self.redis, context=self.context) as checkpoint:
+            cursor = checkpoint.load()
+            page = cursor.get("page", 0) + 1
+            new_data = cursor.get("new_data", False)
 
-        results = self.eshop.get_invoices(page=page, from_datetime=self.start_datetime, to_datetime=self.end_datetime)
-    
-        if results:
-            self.context['ti'].xcom_push(key=config.NEW_DATA, value=True)
-        else:
-            self.context['ti'].xcom_push(key=config.NEW_DATA, value=False)
+            if not cursor:
+                # Staging only carries the invoices of this run, so load prunes the target to their days
+                self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
+
+            while True:
+                self.logger.debug(f"Get data {self.table_name} from Eshop | page {page}")
+                results = self.eshop.get_invoices(page=page, from_datetime=self.start_datetime, to_datetime=self.end_datetime)
+
+                if results:
+                    self.save_invoices(results)
+                    new_data = True
+                    checkpoint.save(page=page, new_data=new_data)
+
+                if not results or len(results) < config.ESHOP_PAGE_LIMIT:
+                    break
+                page += 1
+
+            checkpoint.clear()
+
+        self.context['ti'].xcom_push(key=config.NEW_DATA, value=new_data)
+        if not new_data:
             self.logger.debug("There is no new data. Skip extract job !")
-            return "Success"
-        
-        # data_invoices = []
-        # list_invoices = []
-        for invoice in results:
-            # data_invoices.append({**invoice})
-            # list_invoices.append({"_id": invoice.get("InvoiceId"), "InvoiceId": invoice.get("InvoiceId"), "GetDetailStatus": False})
-            self.mongodb.update_one(database=config.MONGODB_CACHING, collection=self.table_name, 
-                                    contition={"_id": invoice.get("InvoiceId")}, 
-                                    update_query={"$set": {"InvoiceId": invoice.get("InvoiceId"), "GetDetailStatus": False}},
-                                    upsert=True
-                                    )
-
-            self.mongodb.update_one(database=config.MONGODB_STAGING, collection=self.table_name, 
-                                    contition={"_id": invoice.get("InvoiceId")}, 
-                                    update_query={"$set": invoice},
-                                    upsert=True
-                                    )
-        # self.mongodb.insert_many(database=config.MONGODB_CACHING, collection=self.table_name, list_document=list_invoices)
-
-        # json_data = '\n'.join(json.dumps(data_dict, ensure_ascii=False) for data_dict in results)
-        # file_name = f"{config.PREFIX_ESHOP_BUCKET}/{self.table_name}/{self.start_date}/{self.end_date}/{config.PREFIX_JSON_FILE}_{page}.json"
-        # self.logger.debug(f"Upload json data {self.table_name} to GCS: {file_name}")
-        # self.gcs.upload_json(json_string=json_data, file_name=file_name)
-
-        self.redis.put_cached_value_for_key(config.ESHOP_INVOICE_LATEST_PAGE_REDIS, page, 300)
-
-        while len(results) == config.ESHOP_PAGE_LIMIT:
-            page += 1
-            self.logger.debug(f"Get data {self.table_name} from Eshop | page {page}")
-
-            results = self.eshop.get_invoices(page=page, from_datetime=self.start_datetime, to_datetime=self.end_datetime)
-
-            if results:
-                # data_invoices = []
-                # list_invoices = []
-                for invoice in results:
-                    # data_invoices.append({**invoice})
-                    # list_invoices.append({"_id": invoice.get("InvoiceId"), "InvoiceId": invoice.get("InvoiceId"), "GetDetailStatus": False})
-                    self.mongodb.update_one(database=config.MONGODB_CACHING, collection=self.table_name, 
-                                            contition={"_id": invoice.get("InvoiceId")}, 
-                                            update_query={"$set": {"InvoiceId": invoice.get("InvoiceId"), "GetDetailStatus": False}},
-                                            upsert=True
-                                            )
-
-                    self.mongodb.update_one(database=config.MONGODB_STAGING, collection=self.table_name, 
-                                            contition={"_id": invoice.get("InvoiceId")}, 
-                                            update_query={"$set": invoice},
-                                            upsert=True
-                                            )
-                # self.mongodb.insert_many(database=config.MONGODB_CACHING, collection=self.table_name, list_document=list_invoices)
-
-                # json_data = '\n'.join(json.dumps(data_dict, ensure_ascii=False) for data_dict in results)
-                # file_name = f"{config.PREFIX_ESHOP_BUCKET}/{self.table_name}/{self.start_date}/{self.end_date}/{config.PREFIX_JSON_FILE}_{page}.json"
-                # self.logger.debug(f"Upload json data {self.table_name} to GCS: {file_name}")
-                # self.gcs.upload_json(json_string=json_data, file_name=file_name)
-
-                self.redis.put_cached_value_for_key(config.ESHOP_INVOICE_LATEST_PAGE_REDIS, page, 300)
-
-        self.redis.remove_cached_value_for_key(config.ESHOP_INVOICE_LATEST_PAGE_REDIS)
 
         return "Success"  
 
+    def extract_spill(self):
+        """
+        Transform every page as it arrives, spill it to local Parquet and load the staging table from the spill,
+        the staging collection in MongoDB is skipped and transform has nothing left to do.
+
+        The spill is flushed to the staging table every ESHOP_SPILL_FLUSH_PAGES pages and only then the page is
+        checkpointed, so a retry resumes after the last loaded page.
+        """
+        with CheckpointStore(logger=self.logger, redis=self.redis, context=self.context) as checkpoint:
+            cursor = checkpoint.load()
+            page = cursor.get("page", 0) + 1
+            total_rows = cursor.get("rows", 0)
+
+            if not cursor:
+                self.logger.debug("Truncate staging table...")
+                self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
+
+            spill_name = f"{self.context['dag'].dag_id}.{self.table_name}.{self.context['run_id']}"
+            with ParquetSpillBuffer(logger=self.logger, name=spill_name) as spill:
+                while True:
+                    self.logger.debug(f"Get data {self.table_name} from Eshop | page {page}")
+                    results = self.eshop.get_invoices(page=page, from_datetime=self.start_datetime, to_datetime=self.end_datetime)
+
+                    if results:
+                        self.queue_invoice_details(results)
+                        spill.append(self.transform_page(pd.DataFrame(results), fill_missing=True))
+
+                    last_page = not results or len(results) < config.ESHOP_PAGE_LIMIT
+                    if spill.parts and (last_page or len(spill.parts) >= config.ESHOP_SPILL_FLUSH_PAGES):
+                        total_rows += self.bq.bq_append_chunks(chunks=spill.read_chunks(), table_name=self.table_name, dataset_id=self.dataset_staging_id, load_method="load_arrow")
+                        spill.clear()
+                        checkpoint.save(page=page, rows=total_rows)
+
+                    if last_page:
+                        break
+                    page += 1
+
+            checkpoint.clear()
+
+        self.context['ti'].xcom_push(key=config.NEW_DATA, value=bool(total_rows))
+        self.logger.debug(f"Loaded {total_rows} rows to staging table" if total_rows else "There is no new data. Skip extract job !")
+
+        return "Success"
+
+    def queue_invoice_details(self, invoices):
+        """
+        Queue the invoices for InvoiceDetailsETL
+        """
+        self.mongodb.bulk_upsert(
+            database=config.MONGODB_CACHING,
+            collection=self.table_name,
+            operations=[({"_id": invoice.get("InvoiceId")}, {"$set": {"InvoiceId": invoice.get("InvoiceId"), "GetDetailStatus": False}}) for invoice in invoices]
+            )
+
+    def save_invoices(self, invoices):
+        """
+        Queue the invoices for InvoiceDetailsETL and upsert them to staging, one bulk write per collection
+        """
+        self.queue_invoice_details(invoices)
+        self.mongodb.bulk_upsert(
+            database=config.MONGODB_STAGING,
+            collection=self.table_name,
+            operations=[({"_id": invoice.get("InvoiceId")}, {"$set": invoice}) for invoice in invoices]
+            )
+
     def transform(self):
         """
         Pull data from GCS, transform data and upload to staging table
@@ -140,6 +164,10 @@ class InvoicesETL:
         if not self.run_config.get("transform"):
             self.logger.debug("Skip tranform job !")
             return "Success"
+
+        if self.run_config.get("spill"):
+            self.logger.debug("Staging table was loaded by extract. Skip transform job !")
+            return "Success"
         
         if self.context['ti'].xcom_pull(task_ids=f"{self.namespace}.{self.table_name}.extract_{self.table_name}", key=config.NEW_DATA):
             self.logger.debug(f"start - {self.start_datetime} | end - {self.end_datetime}")
@@ -167,10 +195,25 @@ class InvoicesETL:
 
         df = pd.DataFrame(documents)
 
+        df = self.transform_page(df)
+
+        self.logger.debug(f"The DataFrame has {len(df)} rows.")
+        self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id)
+
+        # self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
+
+        return "Success"  
+
+    def transform_page(self, df: pd.DataFrame, fill_missing: bool = False) -> pd.DataFrame:
+        """
+        Shape raw invoices to the staging table columns
+
+        :param fill_missing: load the columns missing from df as NULL instead of failing, for the spill pages
+            which only carry the fields Eshop returned for them
+        """
         df["InvoiceDate"] = df["InvoiceDate"].map(lambda i: i.split("+")[0])
-        df = df.drop(columns=['InvoiceTime', 'Point'])
 
-        df = df[[
+        columns = [
             'InvoiceId',
             'InvoiceNumber',
             'InvoiceType',
@@ -196,14 +239,15 @@ class InvoicesETL:
             'SaleChannelName',
             'HasConnectedShippingPartner',
             'PartnerStatus',
-        ]]
+        ]
 
-        self.logger.debug(f"The DataFrame has {len(df)} rows.")
-        self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id)
+        if not fill_missing:
+            return df[columns]
 
-        # self.mongodb.truncate_collection(database=config.MONGODB_STAGING, collection=self.table_name)
-
-        return "Success"  
+        missing = [column for column in columns if column not in df.columns]
+        if missing:
+            self.logger.warning(f"Columns {missing} missing from the {self.table_name} page, load them as NULL")
+        return df.reindex(columns=columns)
 
     def load(self):
         """
@@ -219,56 +263,15 @@ class InvoicesETL:
             self.logger.debug("There is no new data. Skip transform job !")
             return "Success"   
 
-        merge_query = f'''
-        merge `{self.project_id}.{self.dataset_id}.{self.table_name}` t
-        using (
-            select *
-            from `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            where 1=1
-            qualify row_number() over(partition by InvoiceId order by InvoiceDate desc) = 1
-        ) s
-        on t.InvoiceId = s.InvoiceId
-        when matched then
-        update set 
-            t.InvoiceNumber = s.InvoiceNumber,
-            t.InvoiceType = s.InvoiceType,
-            t.InvoiceDate = s.InvoiceDate,
-            t.BranchId = s.BranchId,
-            t.BranchName = s.BranchName,
-            t.Barcode = s.Barcode,
-            t.TotalAmount = s.TotalAmount,
-            t.CostAmount = s.CostAmount,
-            t.TaxAmount = s.TaxAmount,
-            t.TotalItemAmount = s.TotalItemAmount,
-            t.VATAmount = s.VATAmount,
-            t.DiscountAmount = s.DiscountAmount,
-            t.CashAmount = s.CashAmount,
-            t.CardAmount = s.CardAmount,
-            t.VoucherAmount = s.VoucherAmount,
-            t.DebitAmount = s.DebitAmount,
-            t.ActualAmount = s.ActualAmount,
-            t.CustomerName = s.CustomerName,
-            t.Cashier = s.Cashier,
-            t.SaleStaff = s.SaleStaff,
-            t.Note = s.Note,
-            t.PaymentStatus = s.PaymentStatus,
-            t.Tel = s.Tel,
-            t.Address = s.Address,
-            t.MemberLevelName = s.MemberLevelName,
-            t.DeliveryDate = s.DeliveryDate,
-            t.IsCOD = s.IsCOD,
-            t.AdditionBillType = s.AdditionBillType,
-            t.SaleChannelName = s.SaleChannelName,
-            t.ReturnExchangeRefNo = s.ReturnExchangeRefNo,
-            t.HasConnectedShippingPartner = s.HasConnectedShippingPartner,
-            t.DeliveryCode = s.DeliveryCode,
-            t.ShippingPartnerName = s.ShippingPartnerName,
-            t.PartnerStatus = s.PartnerStatus
-        when not matched then
-        insert row
-        '''
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['InvoiceId'],
+            order_by="InvoiceDate DESC",
+            # Only scan the target days touched by this run
+            partition_column="InvoiceDate",
+            create_partitioned=self.run_config.get("create_partitioned", False),
+        )
 
         return "Success"  
\ No newline at end of file
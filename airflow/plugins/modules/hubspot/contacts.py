@@ -7,6 +7,7 @@ from google.api_core.exceptions import NotFound
 from helper.hubspot_helper import HubspotHelper
 from logging import Logger
 from helper.gcp_helper import BQHelper
+from helper.watermark_helper import WatermarkStore
 from helper import time_helper
 from config import config
 
@@ -43,7 +44,11 @@ class HubspotContactsETL:
         self.start_date = conf.get('start_date')
         self.end_date = conf.get('end_date')
 
-        if self.start_date and self.end_date:
+        # Scheduled runs fetch from the watermark, yesterday is only the window of the first run
+        self.explicit_window = bool(self.start_date and self.end_date)
+        self.watermarks = WatermarkStore(logger=self.logger, redis=self.hub_spot.redis, source=self.namespace, table=self.table_name)
+
+        if self.explicit_window:
             # Manual backfill over an explicit date range:
             # start of start_date -> end of end_date (UTC+7, epoch ms)
             self.start_timestamp = time_helper.get_start_end_current_date_epoch(self.start_date)[0]
@@ -82,37 +87,34 @@ class HubspotContactsETL:
 
         # Which date property to filter on:
         #   - scheduled runs   -> "lastmodifieddate" (incremental by last update)
-        #   - manual backfill  -> "createdate" (fewer records per window, avoids the
-        #     10k/search limit; trigger with conf {"date_property": "createdate", ...})
+        #   - manual backfill  -> "createdate" is still accepted via conf {"date_property": "createdate", ...}
+        # Windows over the 10k/search limit are split automatically, so any range is extracted completely.
         date_property = (
             self.kwargs['dag_run'].conf.get('date_property')
             or self.kwargs['params'].get('date_property')
             or 'lastmodifieddate'
         )
 
+        if not self.explicit_window:
+            self.start_timestamp, self.end_timestamp = self.watermarks.window(
+                scope=date_property,
+                default_start=self.start_timestamp,
+                end=time_helper.get_now_epoch(),
+                overlap=config.HUBSPOT_WATERMARK_OVERLAP
+            )
+            self.logger.debug(f"Run - search contacts: start - {self.start_timestamp} | end - {self.end_timestamp}")
+
         # HubSpot search: filters within a group are AND-ed, groups are OR-ed.
         # We want: (start <= date_property <= end) AND (email HAS_PROPERTY OR phone HAS_PROPERTY)
-        # so the date range is distributed into one group per HAS_PROPERTY condition.
-        date_filters = [
-            {
-                "propertyName": date_property,
-                "operator": "GTE",
-                "value": self.start_timestamp
-            },
-            {
-                "propertyName": date_property,
-                "operator": "LTE",
-                "value": self.end_timestamp
-            }
-        ]
+        # so the date range is AND-ed into one group per HAS_PROPERTY condition by the helper.
         filterGroups = [
             {
-                "filters": date_filters + [
+                "filters": [
                     {"propertyName": "email", "operator": "HAS_PROPERTY"}
                 ]
             },
             {
-                "filters": date_filters + [
+                "filters": [
                     {"propertyName": "phone", "operator": "HAS_PROPERTY"}
                 ]
             }
@@ -127,46 +129,47 @@ class HubspotContactsETL:
 
         self.logger.debug(f"Get data {self.table_name} from HubSpot")
 
-        results, after = self.hub_spot.search_contacts(properties=properties, filterGroups=filterGroups, sortGroups=sortGroups)
-
-        records = list(results)
-
-        page_index = 1
-        while after:
-
-            if page_index >= config.HUBSPOT_MAX_PAGES:
-                self.logger.debug(f"Reached max page limit {config.HUBSPOT_MAX_PAGES}. Stop extract !")
-                break
-
-            page_index += 1
-            self.logger.debug(f"Get data {self.table_name} from HubSpot, page {page_index}, after {after}")
-
-            results, after = self.hub_spot.search_contacts(after=after, properties=properties, filterGroups=filterGroups, sortGroups=sortGroups)
-
-            records.extend(results)
+        records = list(self.hub_spot.search_by_time_window(
+            object_type="contacts",
+            date_property=date_property,
+            start_timestamp=self.start_timestamp,
+            end_timestamp=self.end_timestamp,
+            properties=properties,
+            filterGroups=filterGroups,
+            sortGroups=sortGroups,
+            max_workers=self.kwargs['dag_run'].conf.get('max_workers')
+        ))
 
         if not records:
+            self.stage_watermark(date_property)
             self.logger.debug("There is no new data. Skip extract job !")
             return "Success"
 
         self.logger.debug(f"Transform {len(records)} rows of {self.table_name}")
 
-        df = pd.DataFrame.from_records(records)
-        df["hubspot_link"] = [f'https://app.hubspot.com/contacts/{config.HUBSPOT_ACCOUNT_ID}/contact/{i}' for i in df["id"]]
-        df["full_name"] = df["properties"].map(lambda x: x.get("firstname"))
-        df["email"] = df["properties"].map(lambda x: x.get("email"))
-        df["phone"] = df["properties"].map(lambda x: x.get("phone"))
-        df["date_of_birth"] = df["properties"].map(lambda x: x.get("d_o_b"))
-        df["school"] = df["properties"].map(lambda x: x.get("truongdaihoc"))
-        df["major"] = df["properties"].map(lambda x: x.get("chuyen_nganh_hoc"))
-        df["company_type"] = df["properties"].map(lambda x: x.get("loai_hinh_cong_ty"))
-        df["position"] = df["properties"].map(lambda x: x.get("vi_tri_cong_tac"))
-        df["level"] = df["properties"].map(lambda x: x.get("cap_bac"))
-        df["study_area"] = df["properties"].map(lambda x: x.get("chuong_trinh_hoc"))
-        df["area"] = df["properties"].map(lambda x: x.get("b_n_thu_c_truong_nao"))
-        df["lifecycle_stage"] = df["properties"].map(lambda x: x.get("lifecyclestage"))
-        df["created_datetime"] = df["createdAt"].map(lambda x: time_helper.convert_to_local_datetime_string(x))
-        df["updated_datetime"] = df["properties"].map(lambda x: time_helper.convert_to_local_datetime_string(x.get("lastmodifieddate")))
+        # Flatten every record in a single pass, then pick and rename the properties we keep
+        property_columns = {
+            "firstname": "full_name",
+            "email": "email",
+            "phone": "phone",
+            "d_o_b": "date_of_birth",
+            "truongdaihoc": "school",
+            "chuyen_nganh_hoc": "major",
+            "loai_hinh_cong_ty": "company_type",
+            "vi_tri_cong_tac": "position",
+            "cap_bac": "level",
+            "chuong_trinh_hoc": "study_area",
+            "b_n_thu_c_truong_nao": "area",
+            "lifecyclestage": "lifecycle_stage",
+            "lastmodifieddate": "updated_datetime",
+        }
+        df = pd.json_normalize(records, max_level=1)
+        df = df.reindex(columns=["id", "createdAt"] + [f"properties.{property}" for property in property_columns])
+        df = df.rename(columns={f"properties.{property}": column for property, column in property_columns.items()})
+
+        df["hubspot_link"] = f'https://app.hubspot.com/contacts/{config.HUBSPOT_ACCOUNT_ID}/contact/' + df["id"].astype(str)
+        df["created_datetime"] = time_helper.convert_to_local_datetime_series(df["createdAt"])
+        df["updated_datetime"] = time_helper.convert_to_local_datetime_series(df["updated_datetime"])
         df["ingested_at"] = time_helper.get_datetime_local()
 
         df = df[["id", "hubspot_link", "full_name", "email", "phone", "date_of_birth", "school", "major", "company_type", "position", "level", "study_area", "area", "lifecycle_stage", "created_datetime", "updated_datetime", "ingested_at"]]
@@ -178,6 +181,7 @@ class HubspotContactsETL:
             table_name=self.temp_table_name,
             dataset_id=self.dataset_staging_id,
             if_exists='replace',
+            load_method="load_arrow",
         )
         # Safety net: auto-expire the temp table so it is cleaned up even if the load task never runs
         self.bq.execute(
@@ -185,8 +189,17 @@ class HubspotContactsETL:
             "SET OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 1 DAY))"
         )
 
+        self.stage_watermark(date_property)
+
         return "Success"
 
+    def stage_watermark(self, date_property):
+        """
+        Stage the end of the fetched window, committed by load
+        """
+        if not self.explicit_window:
+            self.watermarks.stage(date_property, self.end_timestamp)
+
     def load(self, run=True):
         """
         Execute MERGE statement to upsert from staging table to curated table and then clear staging table
@@ -200,36 +213,20 @@ class HubspotContactsETL:
             self.bq.client.get_table(self.temp_table_id)
         except NotFound:
             self.logger.debug(f"Temp table {self.temp_table_id} not found (no data extracted). Skip load !")
+            self.watermarks.commit()
             return "Success"
 
-        # Build the MERGE dynamically from the temp table columns (same approach as ConversationsETL),
-        # keeping the latest row per id via QUALIFY on ingested_at.
-        identifier_cols = ['id']
-        table_cols = self.bq.get_columns(dataset_id=self.dataset_staging_id, table_id=self.temp_table_name)
-
-        partition_cols = ", ".join(identifier_cols)
-        on_clause = " and ".join([f"target.{col} = source.{col}" for col in identifier_cols])
-        update_set_clause = ", ".join([f"target.{col} = source.{col}" for col in table_cols if col not in identifier_cols])
-        insert_cols_clause = ", ".join(table_cols)
-        insert_values_clause = ", ".join([f"source.{col}" for col in table_cols])
-
-        merge_query = f"""
-        MERGE `{self.project_id}.{self.dataset_id}.{self.table_name}` AS target
-        USING (
-            SELECT *
-            FROM `{self.temp_table_id}`
-            QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition_cols} ORDER BY ingested_at DESC) = 1
-        ) AS source
-        ON {on_clause}
-        WHEN MATCHED THEN
-            UPDATE SET {update_set_clause}
-        WHEN NOT MATCHED THEN
-            INSERT ({insert_cols_clause})
-            VALUES ({insert_values_clause})
-        """
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
+        # Keep the latest row per key via QUALIFY on ingested_at
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            source_table_id=self.temp_table_id,
+            key_columns=['id'],
+            order_by="ingested_at DESC",
+        )
+
+        self.watermarks.commit()
 
         # Temp table is left to auto-expire (expiration set during extract); no explicit DROP.
         return "Success"
@@ -102,8 +102,9 @@ class HubspotDealsETL:
                 self.kwargs['ti'].xcom_push(key=config.NEW_DATA, value=False)
                 self.logger.debug("There is no new data. Skip extract job !")
                 return "Success"
-            # Get associations contacts
-            results = self.hub_spot.merge_association_to_search_result(from_object="deals", to_object="contacts", association_type_id=3, results=results)
+
+        # Search results come without associations, they are resolved in batches once all pages are fetched
+        object_ids = [result.get("id") for result in results]
 
         json_data = '\n'.join(json.dumps(data_dict, ensure_ascii=False) for data_dict in results)
 
@@ -120,8 +121,7 @@ class HubspotDealsETL:
                 results, after = self.hub_spot.list_deals(after=after, properties=properties, associations=["contacts"])
             else:
                 results, after = self.hub_spot.search_deals(after=after, properties=properties, filterGroups=filterGroups)
-                # Get associations contacts
-                results = self.hub_spot.merge_association_to_search_result(from_object="deals", to_object="contacts", association_type_id=3, results=results)
+                object_ids.extend(result.get("id") for result in results)
 
             json_data = '\n'.join(json.dumps(data_dict, ensure_ascii=False) for data_dict in results)
 
@@ -129,8 +129,27 @@ class HubspotDealsETL:
             self.logger.debug(f"Upload json data {self.table_name} to GCS: {file_name}")
             self.gcs.upload_json(json_string=json_data, file_name=file_name)
 
+        # Full loads resolve nothing, this still removes the association file of an earlier run of the day
+        self.upload_associations(object_ids)
+
         return "Success"  
 
+    def upload_associations(self, object_ids):
+        """
+        Resolve the contacts of every extracted record and upload them next to the data files.
+        Without any, the file of an earlier run of the day is deleted so transform never joins stale contacts
+        """
+        associations = self.hub_spot.resolve_associations(from_object="deals", to_object="contacts", ids=object_ids, association_type_id=3)
+        file_name = f"{config.PREFIX_HUBSPOT_BUCKET}/{self.table_name}/{self.path_date}/{config.PREFIX_ASSOCIATION_NAME}_contacts.json"
+        if not associations:
+            self.gcs.delete_blob(file_name)
+            return
+
+        json_data = '\n'.join(json.dumps({"id": from_id, "to_ids": to_ids}) for from_id, to_ids in associations.items())
+
+        self.logger.debug(f"Upload associations {self.table_name} to GCS: {file_name}")
+        self.gcs.upload_json(json_string=json_data, file_name=file_name)
+
     def transform(self, run=True):
         """
         Pull data from GCS, transform data and upload to staging table
@@ -151,6 +170,8 @@ class HubspotDealsETL:
 
         blobs  = self.gcs.bucket.list_blobs(prefix=f"{config.PREFIX_HUBSPOT_BUCKET}/{self.table_name}/{self.path_date}/")
         blobs = [blob for blob in blobs]
+        association_blobs = [blob for blob in blobs if blob.name.split("/")[-1].startswith(config.PREFIX_ASSOCIATION_NAME)]
+        blobs = [blob for blob in blobs if blob not in association_blobs]
         
         df = []
         for blob in blobs:
@@ -174,7 +195,16 @@ class HubspotDealsETL:
         df["end_date"] = df["properties"].map(lambda x: x.get("ngay_ket_thuc_hop_dong"))
         df["main_registration_class"] = df["properties"].map(lambda x: x.get("lop_dang_ky_cloned_"))
         df["free_registration_class"] = df["properties"].map(lambda x: x.get("lop_dang_ky_tang_kem"))
-        df["contact_id"] = df["associations"].map(lambda x: get_association(x))
+        if association_blobs:
+            # Join the resolved associations on id, the first associated contact is kept
+            df_association = pd.concat([pd.read_json(io.StringIO(blob.download_as_text()), lines=True, dtype={"id": str}) for blob in association_blobs], ignore_index=True)
+            contact_ids = df_association.set_index("id")["to_ids"].str[0]
+            df["contact_id"] = df["id"].astype(str).map(contact_ids)
+        elif "associations" in df.columns:
+            # List endpoints (full load) embed the associations in each record
+            df["contact_id"] = df["associations"].map(lambda x: get_association(x))
+        else:
+            df["contact_id"] = None
         df["created_datetime"] = df["createdAt"].map(lambda x: time_helper.convert_to_local_datetime_string(x))
         df["updated_datetime"] = df["properties"].map(lambda x: time_helper.convert_to_local_datetime_string(x.get("hs_lastmodifieddate")))
 
@@ -199,48 +229,14 @@ class HubspotDealsETL:
             self.logger.debug("There is no new data. Skip load job !")
             return "Success"              
 
-        merge_query = f'''
-        merge `{self.project_id}.{self.dataset_id}.{self.table_name}` t
-        using `{self.project_id}.{self.dataset_staging_id}.{self.table_name}` s
-        on t.id = s.id
-        when matched then
-        update set 
-            t.deal_name = s.deal_name,
-            t.amount = s.amount,
-            t.contract_code = s.contract_code,
-            t.start_date = s.start_date,
-            t.main_registration_class = s.main_registration_class,
-            t.free_registration_class = s.free_registration_class,
-            t.contact_id = s.contact_id,
-            t.updated_datetime = s.updated_datetime
-        when not matched then
-        insert (
-            id,
-            deal_name, 
-            amount, 
-            contract_code, 
-            start_date, 
-            main_registration_class, 
-            free_registration_class,
-            contact_id,
-            created_datetime,
-            updated_datetime
-            )
-        values (
-            id,
-            deal_name, 
-            amount, 
-            contract_code, 
-            start_date, 
-            main_registration_class, 
-            free_registration_class,
-            contact_id,
-            created_datetime,
-            updated_datetime
+        # end_date is not part of the curated table
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['id'],
+            columns=["id", "deal_name", "amount", "contract_code", "start_date", "main_registration_class", "free_registration_class", "contact_id", "created_datetime", "updated_datetime"],
+            immutable_columns=["created_datetime"],
         )
-        '''
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(results)
 
         return "Success"  
\ No newline at end of file
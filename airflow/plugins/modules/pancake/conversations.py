@@ -6,6 +6,8 @@ from airflow.utils.context import Context
 from logging import Logger
 from helper.gcp_helper import BQHelper
 from helper.redis_helper import RedisHelper
+from helper.watermark_helper import WatermarkStore
+from helper.checkpoint_helper import CheckpointStore
 import helper.time_helper as TimeHelper  
 from config import config
 from helper.pancake_helper import PancakeHelper
@@ -42,6 +44,10 @@ class ConversationsETL:
         self.start_datetime = TimeHelper.get_unix_timestamp(TimeHelper.get_start_datetime_of_date(self.start_date))
         self.end_datetime = TimeHelper.get_unix_timestamp(TimeHelper.get_end_datetime_of_date(self.end_date))
 
+        # Scheduled runs fetch from the watermark of each page, a start_date in the run conf forces that window
+        self.explicit_window = bool(self.context['dag_run'].conf.get('start_date'))
+        self.watermarks = WatermarkStore(logger=self.logger, redis=self.redis, source=self.namespace, table=self.table_name)
+
         self.table_cols = None
 
     def extract(self):
@@ -61,37 +67,63 @@ class ConversationsETL:
         self.pancake_url = self.vars.get("page").get("pancake_url")
         self.conversation_redis_key = f"{self.page_id}_conversations"
 
-        page = 1
+        if not self.explicit_window:
+            self.start_datetime, self.end_datetime = self.watermarks.window(
+                scope=self.page_id,
+                default_start=self.start_datetime,
+                end=TimeHelper.get_unix_timestamp(TimeHelper.get_now_local_time()),
+                overlap=config.PANCAKE_WATERMARK_OVERLAP
+            )
+            self.logger.debug(f"start - {self.start_datetime} | end - {self.end_datetime}")
 
-        conv_rows = [] 
+        # A retry resumes after the last page loaded to staging, with the window of the first attempt
+        with CheckpointStore(logger=self.logger, redis=self.redis, context=self.context) as checkpoint:
+            cursor = checkpoint.load()
+            if cursor:
+                self.start_datetime, self.end_datetime = cursor["since"], cursor["until"]
+            else:
+                self.redis.remove_cached_value_for_key(self.conversation_redis_key)
 
-        last_conversation_id = None
+            page = cursor.get("page", 0) + 1
+            last_conversation_id = cursor.get("last_conversation_id")
 
-        while True:
-            self.logger.debug(f"Get data {self.table_name} from Pancake | page {page}")
-            
-            results = self.pancake.get_conversations(
-                page_access_token=self.page_access_token,
-                page_id=self.page_id,
-                last_conversation_id=last_conversation_id,
-                since=self.start_datetime,
-                until=self.end_datetime
-            )
+            conv_rows = [] 
 
-            if not results:
-                self.logger.debug(f"Emtry Result: {results}")
-                break
-        
-            conv_rows.extend(results)
-            last_conversation_id = results[-1].get("id")
-            page += 1
+            while True:
+                self.logger.debug(f"Get data {self.table_name} from Pancake | page {page}")
+            
+                results = self.pancake.get_conversations(
+                    page_access_token=self.page_access_token,
+                    page_id=self.page_id,
+                    last_conversation_id=last_conversation_id,
+                    since=self.start_datetime,
+                    until=self.end_datetime
+                )
+
+                if results:
+                    conv_rows.extend(results)
+                    last_conversation_id = results[-1].get("id")
+                else:
+                    self.logger.debug(f"Emtry Result: {results}")
+
+                if conv_rows and (not results or page % config.PANCAKE_CONVERSATIONS_FLUSH_PAGES == 0):
+                    self.save_conversations(conv_rows)
+                    conv_rows = []
+                    checkpoint.save(page=page, last_conversation_id=last_conversation_id, since=self.start_datetime, until=self.end_datetime)
+
+                if not results:
+                    break
+                page += 1
+
+            checkpoint.clear()
+        self.stage_watermark(self.page_id)
 
-            time.sleep(0.5)
+        return "Success"  
 
-        if not conv_rows:
-            self.logger.debug(f"The DataFrame has no data rows. Skip")
-            return "Success"
-        
+    def save_conversations(self, conv_rows):
+        """
+        Transform a batch of conversations, load it to staging and cache its ids for MessagesETL
+        """
         df = pd.DataFrame.from_records(conv_rows)
         self.logger.debug(f"The DataFrame has {len(df)} rows.")
 
@@ -153,11 +185,14 @@ class ConversationsETL:
         self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id, load_method="load_parquet")
 
         # Cache list conversation
-        conversation_list = df['id'].tolist()
-        self.redis.remove_cached_value_for_key(self.conversation_redis_key)
-        self.redis.put_cached_value_for_as_list(self.conversation_redis_key, conversation_list)
+        self.redis.put_cached_value_for_as_list(self.conversation_redis_key, df['id'].tolist())
 
-        return "Success"  
+    def stage_watermark(self, page_id):
+        """
+        Stage the end of the fetched window of page_id, committed by load
+        """
+        if not self.explicit_window:
+            self.watermarks.stage(page_id, self.end_datetime)
 
     def load(self):
         """
@@ -167,40 +202,20 @@ class ConversationsETL:
             self.logger.debug("Skip load job !")
             return "Success"
         
-        identifier_cols = ['id']
-
-        group_identifier_cols = ", ".join(identifier_cols)
-        
-        table_cols = self.table_cols if self.table_cols else self.bq.get_columns(dataset_id=self.dataset_staging_id, table_id=self.table_name)
-        
-        on_clause = " and ".join([f"target.{col}=source.{col}" for col in identifier_cols])
-
-        update_set_clause = ", ".join([f"target.{col} = source.{col}" for col in table_cols if col not in identifier_cols])
-        insert_values_clause = ", ".join([f"source.{col}" for col in table_cols])
-
-        merge_query = f"""
-        MERGE `{self.project_id}.{self.dataset_id}.{self.table_name}` AS target
-        USING (
-            SELECT *
-            FROM `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            WHERE 1=1
-            QUALIFY ROW_NUMBER() OVER (PARTITION BY {group_identifier_cols} ORDER BY ingested_at DESC) = 1
-        ) AS source
-        ON {on_clause}
-        WHEN MATCHED THEN
-            UPDATE SET {update_set_clause}
-        WHEN NOT MATCHED THEN 
-            INSERT ({", ".join(table_cols)}) 
-            VALUES ({insert_values_clause}) 
-        """
-
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(f"Job ID: {results.job_id}")
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['id'],
+            order_by="ingested_at DESC",
+            columns=self.table_cols,
+        )
  
         self.logger.debug("Truncate staging table...")
         self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
 
+        self.watermarks.commit()
+
         return "Success"  
     
     def extract_tag_texts(self, tag_list):
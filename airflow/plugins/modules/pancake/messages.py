@@ -1,12 +1,15 @@
 import io
 from typing import Dict, List, Optional, Type
 import json, time
+import concurrent.futures
 import pandas as pd
 from datetime import datetime, timedelta
 from airflow.utils.context import Context
 from logging import Logger
 from helper.gcp_helper import BQHelper
 from helper.redis_helper import RedisHelper
+from helper.watermark_helper import WatermarkStore
+from helper.checkpoint_helper import CheckpointStore
 import helper.time_helper as TimeHelper  
 from helper.etl_helper import id128_hex
 from config import config
@@ -44,6 +47,10 @@ class MessagesETL:
         self.start_datetime = TimeHelper.get_unix_timestamp(TimeHelper.get_start_datetime_of_date(self.start_date))
         self.end_datetime = TimeHelper.get_unix_timestamp(TimeHelper.get_end_datetime_of_date(self.end_date))
 
+        # Scheduled runs fetch from the watermark of each page, a start_date in the run conf forces that window
+        self.explicit_window = bool(self.context['dag_run'].conf.get('start_date'))
+        self.watermarks = WatermarkStore(logger=self.logger, redis=self.redis, source=self.namespace, table=self.table_name)
+
         self.table_cols = None
 
     def extract(self):
@@ -62,67 +69,92 @@ class MessagesETL:
         self.page_name = self.vars.get("page").get("name")
         self.conversation_redis_key = f"{self.page_id}_conversations"
 
-        conversation_list = self.redis.get_cached_value_for_key_as_list(self.conversation_redis_key)
-
-        if not conversation_list:
-            self.logger.debug("No input conversation. Skip extract job !")
-            return "Success"    
-
-        all_conversations_rows = []
-
-        for conversation_id in conversation_list:
-
-            conv_rows = []
-            page = 1
-            current_count = None
-
-            while True:
-                self.logger.debug(f"Get data {self.table_name} from Pancake | page {page} | conversation {conversation_id} | current_count {(current_count or 0)}")
-                
-                messages = self.pancake.get_messages(
-                    page_access_token=self.page_access_token,
-                    page_id=self.page_id,
-                    conversation_id=conversation_id,
-                    current_count=current_count
-                )
-
-                if not messages:
-                    break
-
-                filtered_messages = []
-
-                for message in messages:
-                    unix_timestamp_message = TimeHelper.utc7_str_to_unix(message.get("inserted_at"))
-                    if unix_timestamp_message >= self.start_datetime:
-                        filtered_messages.append(message)
-
-                if not filtered_messages:
-                    break
-
-                conv_rows.extend(filtered_messages)   
+        if not self.explicit_window:
+            self.start_datetime, self.end_datetime = self.watermarks.window(
+                scope=self.page_id,
+                default_start=self.start_datetime,
+                end=TimeHelper.get_unix_timestamp(TimeHelper.get_now_local_time()),
+                overlap=config.PANCAKE_WATERMARK_OVERLAP
+            )
+            self.logger.debug(f"start - {self.start_datetime} | end - {self.end_datetime}")
+
+        # A retry resumes after the last chunk of conversations loaded to staging, with the window of the first attempt
+        with CheckpointStore(logger=self.logger, redis=self.redis, context=self.context) as checkpoint:
+            cursor = checkpoint.load()
+            if cursor:
+                self.start_datetime, self.end_datetime = cursor["since"], cursor["until"]
+
+            conversation_list = self.redis.get_cached_value_for_key_as_list(self.conversation_redis_key)
+
+            if not conversation_list:
+                self.stage_watermark(self.page_id)
+                self.logger.debug("No input conversation. Skip extract job !")
+                return "Success"    
+
+            max_workers = self.run_config.get("max_workers") or config.PANCAKE_MESSAGES_MAX_WORKERS
+            chunk_size = config.PANCAKE_MESSAGES_CHECKPOINT_SIZE
+            start_offset = cursor.get("offset", 0)
+
+            self.logger.debug(f"Get data {self.table_name} from Pancake | {len(conversation_list) - start_offset} of {len(conversation_list)} conversations | {max_workers} workers")
+
+            # Conversations are fetched in parallel, PancakeHelper keeps all workers within the per-page rate budget.
+            # Each chunk of conversations is loaded to staging before its offset is checkpointed.
+            number_of_rows = 0
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for offset in range(start_offset, len(conversation_list), chunk_size):
+                    chunk = conversation_list[offset:offset + chunk_size]
+                    number_of_rows += self.save_messages(executor, chunk)
+                    checkpoint.save(offset=offset + len(chunk), since=self.start_datetime, until=self.end_datetime)
+
+            self.logger.debug(f"Loaded {number_of_rows} rows to staging table.")
+
+            checkpoint.clear()
+        self.redis.remove_cached_value_for_key(self.conversation_redis_key)
+        self.stage_watermark(self.page_id)
 
-                current_count = (current_count or 0) + len(messages)
-                page += 1
+        return "Success"  
 
-                time.sleep(0.5)
+    def save_messages(self, executor, conversation_ids):
+        """
+        Extract the messages of a chunk of conversations and load them to staging
 
-            # Filter message
-            if conv_rows:
-                df_conversation = pd.DataFrame.from_records(conv_rows)
-                df_conversation = df_conversation[df_conversation['from'].apply(lambda x: not bool(x.get("admin_id")))]
-                all_conversations_rows.append(df_conversation)
+        :return: number of loaded rows
+        """
+        if self.run_config.get("storage_write"):
+            # Stream every conversation to staging as it arrives, committed at once when the chunk is written
+            number_of_rows = 0
+            with self.bq.open_storage_writer(table_name=self.table_name, dataset_id=self.dataset_staging_id) as storage_writer:
+                for df_conversation in executor.map(self.extract_conversation_messages, conversation_ids):
+                    if df_conversation is None or df_conversation.empty:
+                        continue
+                    number_of_rows += storage_writer.append(self.transform_messages(df_conversation))
+            return number_of_rows
+
+        all_conversations_rows = [df_conversation for df_conversation in executor.map(self.extract_conversation_messages, conversation_ids) if df_conversation is not None]
 
         df = pd.concat(all_conversations_rows, ignore_index=True) if all_conversations_rows else pd.DataFrame()
 
         if df.empty:
             self.logger.debug(f"The DataFrame has no data rows. Skip")
-            return "Success"
+            return 0
         
         self.logger.debug(f"The df DataFrame has {len(df)} rows.")
-        # self.logger.debug(f"The df_conversation_report DataFrame has {len(df_conversation_report)} rows.")
 
-        # Transform
+        df = self.transform_messages(df)
 
+        # Config for load process
+        self.table_cols = list(df.columns)
+
+        # Load staging table
+        self.logger.debug(f"The DataFrame has {len(df)} rows.")
+        self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id, load_method="load_parquet")
+
+        return len(df)
+
+    def transform_messages(self, df):
+        """
+        Keep the staging columns and normalize messages before loading
+        """
         # print(df["from"])
 
         expected_columns = [
@@ -153,16 +185,59 @@ class MessagesETL:
 
         df = df.rename(columns={'from': 'sender'})
 
-        # Config for load process
-        self.table_cols = list(df.columns)
+        return df
 
-        # Load staging table
-        self.logger.debug(f"The DataFrame has {len(df)} rows.")
-        self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id, load_method="load_parquet")
+    def extract_conversation_messages(self, conversation_id):
+        """
+        Page through the messages of one conversation (newest first) until a page has no message
+        inserted after start_datetime, return customer messages as a DataFrame or None
+        """
+        conv_rows = []
+        page = 1
+        current_count = None
 
-        self.redis.remove_cached_value_for_key(self.conversation_redis_key)
+        while True:
+            self.logger.debug(f"Get data {self.table_name} from Pancake | page {page} | conversation {conversation_id} | current_count {(current_count or 0)}")
 
-        return "Success"  
+            messages = self.pancake.get_messages(
+                page_access_token=self.page_access_token,
+                page_id=self.page_id,
+                conversation_id=conversation_id,
+                current_count=current_count
+            )
+
+            if not messages:
+                break
+
+            filtered_messages = []
+
+            for message in messages:
+                unix_timestamp_message = TimeHelper.utc7_str_to_unix(message.get("inserted_at"))
+                if unix_timestamp_message >= self.start_datetime:
+                    filtered_messages.append(message)
+
+            if not filtered_messages:
+                break
+
+            conv_rows.extend(filtered_messages)   
+
+            current_count = (current_count or 0) + len(messages)
+            page += 1
+
+        if not conv_rows:
+            return None
+
+        # Filter message
+        df_conversation = pd.DataFrame.from_records(conv_rows)
+        df_conversation = df_conversation[df_conversation['from'].apply(lambda x: not bool(x.get("admin_id")))]
+        return df_conversation
+
+    def stage_watermark(self, page_id):
+        """
+        Stage the end of the fetched window of page_id, committed by load
+        """
+        if not self.explicit_window:
+            self.watermarks.stage(page_id, self.end_datetime)
 
     def load(self):
         """
@@ -172,44 +247,25 @@ class MessagesETL:
             self.logger.debug("Skip load job !")
             return "Success"
         
-        identifier_cols = ['id']
-
-        group_identifier_cols = ", ".join(identifier_cols)
-        
-        table_cols = self.table_cols if self.table_cols else self.bq.get_columns(dataset_id=self.dataset_staging_id, table_id=self.table_name)
-        
-        on_clause = " and ".join([f"target.{col}=source.{col}" for col in identifier_cols])
-
-        update_set_clause = ", ".join([f"target.{col} = source.{col}" for col in table_cols if col not in identifier_cols])
-        insert_values_clause = ", ".join([f"source.{col}" for col in table_cols])
-
-        merge_query = f"""
-        MERGE `{self.project_id}.{self.dataset_id}.{self.table_name}` AS target
-        USING (
-            SELECT *
-            FROM `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            WHERE 1=1
-            AND sender.id NOT IN (
-                SELECT exclude_id
-                FROM `data-analytics-service.pancake.vw_exclude_admin`
-                )
-            QUALIFY ROW_NUMBER() OVER (PARTITION BY {group_identifier_cols} ORDER BY ingested_at DESC) = 1
-        ) AS source
-        ON {on_clause}
-        WHEN MATCHED THEN
-            UPDATE SET {update_set_clause}
-        WHEN NOT MATCHED THEN 
-            INSERT ({", ".join(table_cols)}) 
-            VALUES ({insert_values_clause}) 
-        """
-
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(f"Job ID: {results.job_id}")
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['id'],
+            order_by="ingested_at DESC",
+            # Drop messages sent by our own staff
+            source_filter="sender.id NOT IN (SELECT exclude_id FROM `data-analytics-service.pancake.vw_exclude_admin`)",
+            columns=self.table_cols,
+            # Only scan the target days touched by this run
+            partition_column="inserted_at",
+            create_partitioned=self.run_config.get("create_partitioned", False),
+        )
  
         self.logger.debug("Truncate staging table...")
         self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
 
+        self.watermarks.commit()
+
         return "Success"  
     
     # def extract_tag_texts(self, tag_list):
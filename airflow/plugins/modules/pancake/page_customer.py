@@ -6,6 +6,7 @@ from airflow.utils.context import Context
 from logging import Logger
 from helper.gcp_helper import BQHelper
 from helper.redis_helper import RedisHelper
+from helper.watermark_helper import WatermarkStore
 import helper.time_helper as TimeHelper  
 from config import config
 from helper.pancake_helper import PancakeHelper
@@ -42,6 +43,10 @@ class PageCustomerETL:
         self.start_datetime = TimeHelper.get_unix_timestamp(TimeHelper.get_start_datetime_of_date(self.start_date))
         self.end_datetime = TimeHelper.get_unix_timestamp(TimeHelper.get_end_datetime_of_date(self.end_date))
 
+        # Scheduled runs fetch from the watermark of each page, a start_date in the run conf forces that window
+        self.explicit_window = bool(self.context['dag_run'].conf.get('start_date'))
+        self.watermarks = WatermarkStore(logger=self.logger, redis=self.redis, source=self.namespace, table=self.table_name)
+
         self.table_cols = None
 
     def extract(self):
@@ -60,6 +65,15 @@ class PageCustomerETL:
         platform = self.vars.get("page").get("platform")
         page_name = self.vars.get("page").get("name")
 
+        if not self.explicit_window:
+            self.start_datetime, self.end_datetime = self.watermarks.window(
+                scope=page_id,
+                default_start=self.start_datetime,
+                end=TimeHelper.get_unix_timestamp(TimeHelper.get_now_local_time()),
+                overlap=config.PANCAKE_WATERMARK_OVERLAP
+            )
+            self.logger.debug(f"start - {self.start_datetime} | end - {self.end_datetime}")
+
         df = pd.DataFrame()
 
         customer_rows = [] 
@@ -80,10 +94,9 @@ class PageCustomerETL:
 
             customer_rows.extend(results)
             page += 1
-            
-            time.sleep(0.5)
 
         if not customer_rows:
+            self.stage_watermark(page_id)
             self.logger.debug(f"The DataFrame has no data rows. Skip")
             return "Success"
         
@@ -120,8 +133,17 @@ class PageCustomerETL:
         self.logger.debug(f"The DataFrame has {len(df)} rows.")
         self.bq.bq_append(update_data=df, table_name=self.table_name, dataset_id=self.dataset_staging_id, load_method="load_parquet")
 
+        self.stage_watermark(page_id)
+
         return "Success"  
 
+    def stage_watermark(self, page_id):
+        """
+        Stage the end of the fetched window of page_id, committed by load
+        """
+        if not self.explicit_window:
+            self.watermarks.stage(page_id, self.end_datetime)
+
     def load(self):
         """
         Execute MERGE statement to upsert (use SCD Type 2) from staging table to curated table and then clear staging table
@@ -130,38 +152,18 @@ class PageCustomerETL:
             self.logger.debug("Skip load job !")
             return "Success"
         
-        identifier_cols = ['id']
-
-        group_identifier_cols = ", ".join(identifier_cols)
-        
-        table_cols = self.table_cols if self.table_cols else self.bq.get_columns(dataset_id=self.dataset_staging_id, table_id=self.table_name)
-        
-        on_clause = " and ".join([f"target.{col}=source.{col}" for col in identifier_cols])
-
-        update_set_clause = ", ".join([f"target.{col} = source.{col}" for col in table_cols if col not in identifier_cols])
-        insert_values_clause = ", ".join([f"source.{col}" for col in table_cols])
-
-        merge_query = f"""
-        MERGE `{self.project_id}.{self.dataset_id}.{self.table_name}` AS target
-        USING (
-            SELECT *
-            FROM `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            WHERE 1=1
-            QUALIFY ROW_NUMBER() OVER (PARTITION BY {group_identifier_cols} ORDER BY ingested_at DESC) = 1
-        ) AS source
-        ON {on_clause}
-        WHEN MATCHED THEN
-            UPDATE SET {update_set_clause}
-        WHEN NOT MATCHED THEN 
-            INSERT ({", ".join(table_cols)}) 
-            VALUES ({insert_values_clause}) 
-        """
-
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(f"Job ID: {results.job_id}")
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['id'],
+            order_by="ingested_at DESC",
+            columns=self.table_cols,
+        )
  
         self.logger.debug("Truncate staging table...")
         self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
 
+        self.watermarks.commit()
+
         return "Success"  
\ No newline at end of file
@@ -129,36 +129,14 @@ class UsersETL:
             self.logger.debug("Skip load job !")
             return "Success"
         
-        identifier_cols = ['id', 'page_id']
-
-        group_identifier_cols = ", ".join(identifier_cols)
-        
-        table_cols = self.table_cols if self.table_cols else self.bq.get_columns(dataset_id=self.dataset_staging_id, table_id=self.table_name)
-        
-        on_clause = " and ".join([f"target.{col}=source.{col}" for col in identifier_cols])
-
-        update_set_clause = ", ".join([f"target.{col} = source.{col}" for col in table_cols if col not in identifier_cols])
-        insert_values_clause = ", ".join([f"source.{col}" for col in table_cols])
-
-        merge_query = f"""
-        MERGE `{self.project_id}.{self.dataset_id}.{self.table_name}` AS target
-        USING (
-            SELECT *
-            FROM `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`
-            WHERE 1=1
-            QUALIFY ROW_NUMBER() OVER (PARTITION BY {group_identifier_cols} ORDER BY ingested_at DESC) = 1
-        ) AS source
-        ON {on_clause}
-        WHEN MATCHED THEN
-            UPDATE SET {update_set_clause}
-        WHEN NOT MATCHED THEN 
-            INSERT ({", ".join(table_cols)}) 
-            VALUES ({insert_values_clause}) 
-        """
-
-        self.logger.debug(merge_query)
-        results = self.bq.execute(query=merge_query)
-        self.logger.debug(f"Job ID: {results.job_id}")
+        self.bq.merge_table(
+            table_name=self.table_name,
+            dataset_id=self.dataset_id,
+            project_id=self.project_id,
+            key_columns=['id', 'page_id'],
+            order_by="ingested_at DESC",
+            columns=self.table_cols,
+        )
  
         self.logger.debug("Truncate staging table...")
         self.bq.execute(f"truncate table `{self.project_id}.{self.dataset_staging_id}.{self.table_name}`")
@@ -0,0 +1,79 @@
+"""
+This module reads and writes the recorded API responses replayed by the mock server
+"""
+import os
+import re
+import json
+import hashlib
+
+FIXTURES_DIR = os.getenv("MOCK_API_FIXTURES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+
+# Values of these keys are replaced by a stable hash, matched case-insensitively anywhere in the key
+SENSITIVE_KEYS = (
+    "name", "phone", "email", "address", "avatar", "picture", "birthday", "token", "secret",
+    "password", "cookie", "identity", "tax", "bank", "message", "snippet", "content", "link", "url",
+    "fb_id", "psid", "note",
+)
+# Keys kept as they are even if they contain a sensitive word, the ETL needs them
+KEPT_KEYS = ("page_name", "original_message_type", "message_type", "type")
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+PHONE_PATTERN = re.compile(r"(?<!\d)(\+?84|0)\d{9,10}(?!\d)")
+# Timestamps are kept verbatim, the ETL parses them with a fixed format (e.g. Pancake's %Y-%m-%dT%H:%M:%S.%f)
+TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?")
+
+
+def fixture_path(source: str, name: str, fixtures_dir: str = FIXTURES_DIR) -> str:
+    return os.path.join(fixtures_dir, source, f"{name}.json")
+
+
+def load_fixture(source: str, name: str, fixtures_dir: str = FIXTURES_DIR):
+    """
+    Return the records recorded for the endpoint name of source
+    """
+    with open(fixture_path(source, name, fixtures_dir), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_fixture(source: str, name: str, data, fixtures_dir: str = FIXTURES_DIR) -> str:
+    """
+    Sanitize data and write it as the fixture of the endpoint name of source
+
+    :return: path of the fixture
+    """
+    path = fixture_path(source, name, fixtures_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(sanitize(data), f, ensure_ascii=False, indent=2)
+    return path
+
+
+def mask(value: str) -> str:
+    """
+    Replace value by a hash of it, the same value always gives the same mask so joins still match
+    """
+    return f"masked-{hashlib.sha256(value.encode('utf-8')).hexdigest()[:12]}"
+
+
+def is_sensitive(key: str) -> bool:
+    key = key.lower()
+    return key not in KEPT_KEYS and any(word in key for word in SENSITIVE_KEYS)
+
+
+def sanitize(data, sensitive: bool = False):
+    """
+    Return a copy of data with personal data and secrets masked: every string under a sensitive key,
+    and emails or phone numbers found in any other string. Numbers, booleans, timestamps and structure are kept.
+    """
+    if isinstance(data, dict):
+        return {key: sanitize(value, sensitive or is_sensitive(str(key))) for key, value in data.items()}
+    if isinstance(data, list):
+        return [sanitize(value, sensitive) for value in data]
+    if isinstance(data, str):
+        if sensitive and data:
+            return mask(data)
+        if TIMESTAMP_PATTERN.fullmatch(data):
+            return data
+        data = EMAIL_PATTERN.sub(lambda match: mask(match.group(0)) + "@example.com", data)
+        return PHONE_PATTERN.sub(lambda match: "0" + "9" * (len(match.group(0)) - 1), data)
+    return data
@@ -0,0 +1,119 @@
+"""
+Record sanitized responses of the live APIs as fixtures of the mock server.
+
+Run it where the helpers can reach the APIs and their credentials (the Airflow container), e.g.
+
+    python tests/mock_api/recorder.py pancake --page-id <page_id> --page-access-token <token>
+    python tests/mock_api/recorder.py eshop hubspot dahahi amis_web --limit 20
+
+Only the first --limit records of each endpoint are kept, personal data and secrets are masked by fixtures.sanitize.
+"""
+import os
+import sys
+import logging
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, "plugins"))
+
+from fixtures import save_fixture, FIXTURES_DIR
+
+
+def redis_helper(logger):
+    from helper.redis_helper import RedisHelper
+    from config import config
+    return RedisHelper(logger=logger, redis_host=config.REDIS_HOST, redis_port=config.REDIS_PORT)
+
+
+def record_pancake(logger, args):
+    from helper.pancake_helper import PancakeHelper
+    from helper import time_helper
+    pancake = PancakeHelper(logger=logger)
+    until = time_helper.get_unix_timestamp(time_helper.get_now_local_time())
+    since = until - args.days * 86400
+
+    customers = pancake.get_page_customer(args.page_access_token, args.page_id, since, until, page_size=args.limit)
+    conversations = pancake.get_conversations(args.page_access_token, args.page_id, since=since, until=until)
+    yield "page_customers", customers
+    yield "conversations", conversations
+    if conversations:
+        yield "messages", pancake.get_messages(args.page_access_token, args.page_id, conversations[0].get("id"))
+    yield "users", pancake.get_users(args.page_access_token, args.page_id)
+
+
+def record_eshop(logger, args):
+    from helper.eshop_helper import EshopHelper
+    eshop = EshopHelper(logger=logger, redis=redis_helper(logger))
+
+    invoices = eshop.get_invoices(limit=args.limit)
+    yield "invoices", invoices
+    if invoices:
+        yield "invoice_details", eshop.get_invoice_details(invoices[0].get("InvoiceId"))
+    yield "inventory_items", eshop.get_inventory_items(limit=args.limit)
+
+
+def record_amis_web(logger, args):
+    from helper.amis_web_helper import AmisWebHelper
+    from helper.mongodb_helper import MongoDBHeler
+    amis = AmisWebHelper(logger=logger, redis=redis_helper(logger), mongodb=MongoDBHeler(logger=logger))
+
+    yield "inventory_items", amis.get_inventory_items(limit=args.limit, load_mode=2).get("PageData")
+    yield "stocks", amis.get_stocks(limit=args.limit, load_mode=2).get("PageData")
+
+
+def record_hubspot(logger, args):
+    from helper.hubspot_helper import HubspotHelper
+    hub_spot = HubspotHelper(logger=logger, redis=redis_helper(logger))
+
+    for object_type in args.hubspot_objects:
+        results, _, _ = hub_spot.search_objects(object_type, limit=args.limit)
+        yield object_type, results
+
+
+def record_dahahi(logger, args):
+    from helper.dahahi_helper import DahahiHelper
+    dahahi = DahahiHelper(logger=logger)
+
+    yield "checkin_history", dahahi.get_checkin_history(page_size=args.limit, page_index=1)
+    yield "employees", dahahi.get_employee_list(page_size=args.limit, page_index=1)
+
+
+RECORDERS = {
+    "pancake": record_pancake,
+    "eshop": record_eshop,
+    "amis_web": record_amis_web,
+    "hubspot": record_hubspot,
+    "dahahi": record_dahahi,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", choices=sorted(RECORDERS))
+    parser.add_argument("--limit", type=int, default=20, help="records kept per endpoint")
+    parser.add_argument("--fixtures-dir", default=FIXTURES_DIR)
+    parser.add_argument("--page-id", help="Pancake page to record")
+    parser.add_argument("--page-access-token", help="Pancake page access token, never written to the fixtures")
+    parser.add_argument("--days", type=int, default=1, help="Pancake window to record, in days back from now")
+    parser.add_argument("--hubspot-objects", nargs="+", default=["contacts"])
+    args = parser.parse_args(argv)
+
+    if "pancake" in args.sources and not (args.page_id and args.page_access_token):
+        parser.error("pancake needs --page-id and --page-access-token")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logger = logging.getLogger("mock_api.recorder")
+
+    for source in args.sources:
+        for name, data in RECORDERS[source](logger, args):
+            if isinstance(data, list):
+                data = data[:args.limit]
+            if not data:
+                logger.warning(f"No data for {source}/{name}, keep its current fixture")
+                continue
+            path = save_fixture(source, name, data, args.fixtures_dir)
+            logger.info(f"Recorded {len(data) if isinstance(data, list) else 1} {source}/{name} to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Local stand-in for the Pancake, Eshop, AMIS, HubSpot, Dahahi and Lark APIs, to benchmark the extractors offline.
+
+The records recorded by recorder.py (fixtures/<source>/<endpoint>.json) are replayed with unique ids over as many
+pages as asked, with configurable latency, error rate and rate limit. Filters and time windows are ignored.
+
+    python tests/mock_api/server.py --port 8765 --pages 20 --latency-ms 80 --error-rate 0.01 --rate-limit 10
+
+then point the helpers at it with the base URLs printed on startup (PANCAKE_BASE_URL, ESHOP_URL, ...).
+Request counts per endpoint are served on /__stats and reset on /__reset.
+"""
+import re
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from fixtures import load_fixture, FIXTURES_DIR
+
+PANCAKE_CONVERSATIONS_PAGE_SIZE = 60 # fixed by Pancake
+DEFAULT_PAGE_SIZE = 100
+
+
+class MockSettings:
+    """
+    Behaviour of the server, shared by every request handler
+    """
+
+    def __init__(self, pages=10, messages=None, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limit=0, fixtures_dir=FIXTURES_DIR, seed=None):
+        """
+        :param pages: full pages served by every paginated endpoint before an empty/short page
+        :param messages: messages in every Pancake conversation, None for one page of the recorded messages
+        :param latency_ms: delay added to every response
+        :param jitter_ms: up to this much is added at random to latency_ms
+        :param error_rate: share of requests answered with a 503
+        :param rate_limit: requests per second allowed per source before a 429 with Retry-After, 0 for none
+        """
+        self.pages = pages
+        self.messages = messages
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.fixtures_dir = fixtures_dir
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.fixtures = {}
+        self.buckets = {}
+        self.stats = Counter()
+
+    def fixture(self, source, name):
+        with self.lock:
+            if (source, name) not in self.fixtures:
+                self.fixtures[(source, name)] = load_fixture(source, name, self.fixtures_dir)
+            return self.fixtures[(source, name)]
+
+    def delay(self) -> float:
+        with self.lock:
+            return (self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000
+
+    def fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def throttle(self, source) -> bool:
+        """
+        Token bucket of rate_limit requests per second per source
+
+        :return: True if the request is over the limit
+        """
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated_at = self.buckets.get(source, (self.rate_limit, now))
+            tokens = min(self.rate_limit, tokens + (now - updated_at) * self.rate_limit)
+            if tokens < 1:
+                self.buckets[source] = (tokens, now)
+                return True
+            self.buckets[source] = (tokens - 1, now)
+            return False
+
+
+def make_records(records, start, count, id_field, **fields):
+    """
+    Return count records cycled from the fixture, the one at index i gets id str(i) so every record is unique
+    """
+    if not records:
+        return []
+    page = []
+    for index in range(start, start + count):
+        record = copy.deepcopy(records[index % len(records)])
+        record[id_field] = str(index)
+        record.update(fields)
+        page.append(record)
+    return page
+
+
+def number_page(settings, records, page, page_size, id_field, **fields):
+    """
+    Page page (from 1) of settings.pages full pages
+    """
+    start = (int(page) - 1) * int(page_size)
+    count = max(0, min(int(page_size), settings.pages * int(page_size) - start))
+    return make_records(records, start, count, id_field, **fields)
+
+
+# Handlers receive (settings, match, query, body) and return (status, payload)
+
+def pancake_page_customers(settings, match, query, body):
+    records = settings.fixture("pancake", "page_customers")
+    page = number_page(settings, records, query.get("page_number", 1), query.get("page_size", DEFAULT_PAGE_SIZE), "id")
+    return 200, {"success": True, "customers": page}
+
+
+def pancake_conversations(settings, match, query, body):
+    # the cursor is the id of the last conversation of the previous page, ids are their index
+    last_conversation_id = query.get("last_conversation_id")
+    start = int(last_conversation_id) + 1 if last_conversation_id else 0
+    total = settings.pages * PANCAKE_CONVERSATIONS_PAGE_SIZE
+    records = settings.fixture("pancake", "conversations")
+    page = make_records(records, start, max(0, min(PANCAKE_CONVERSATIONS_PAGE_SIZE, total - start)), "id", page_id=match.group("page_id"))
+    return 200, {"success": True, "conversations": page}
+
+
+def pancake_messages(settings, match, query, body):
+    records = settings.fixture("pancake", "messages")
+    conversation_id = match.group("conversation_id")
+    # each call returns the page after the current_count messages already read, then an empty page
+    depth = len(records) if settings.messages is None else settings.messages
+    start = int(query.get("current_count") or 0)
+    count = max(0, min(len(records), depth - start))
+    messages = make_records(records, start, count, "id", conversation_id=conversation_id)
+    for message in messages:
+        message["id"] = f"{conversation_id}_{message['id']}"
+    return 200, {"success": True, "messages": messages}
+
+
+def pancake_users(settings, match, query, body):
+    return 200, settings.fixture("pancake", "users")
+
+
+def eshop_login(settings, match, query, body):
+    return 200, {"ErrorType": 0, "Data": {"AccessToken": "mock-eshop-token", "CompanyCode": "mock", "Environment": "mock"}}
+
+
+def eshop_invoices(settings, match, query, body):
+    records = settings.fixture("eshop", "invoices")
+    return 200, {"ErrorType": 0, "Data": number_page(settings, records, body.get("Page", 1), body.get("Limit", DEFAULT_PAGE_SIZE), "InvoiceId")}
+
+
+def eshop_invoice_details(settings, match, query, body):
+    detail = copy.deepcopy(settings.fixture("eshop", "invoice_details"))
+    detail["RefID"] = body.get("RefID")
+    return 200, {"ErrorType": 0, "Data": detail}
+
+
+def eshop_inventory_items(settings, match, query, body):
+    records = settings.fixture("eshop", "inventory_items")
+    return 200, {"ErrorType": 0, "Data": number_page(settings, records, body.get("Page", 1), body.get("Limit", DEFAULT_PAGE_SIZE), "Id")}
+
+
+def amis_connect(settings, match, query, body):
+    return 200, {"Success": True, "Data": json.dumps({"access_token": "mock-amis-token"})}
+
+
+def amis_dictionary(settings, match, query, body):
+    records = settings.fixture("amis", "dictionary")
+    page = make_records(records, int(body.get("skip", 0)), int(body.get("take", DEFAULT_PAGE_SIZE)), "dictionary_id")
+    return 200, {"Success": True, "Data": json.dumps(page)}
+
+
+def amis_web_login(settings, match, query, body):
+    context = {"TenantId": "mock", "DatabaseId": "mock", "BranchId": "mock"}
+    return 200, {"Data": {"AccessToken": {"Token": "mock-amis-web-token", "TokenExpired": 3600}, "Context": context}}
+
+
+def amis_web_list(name, id_field):
+    def handler(settings, match, query, body):
+        page_size = body.get("pageSize", DEFAULT_PAGE_SIZE)
+        if body.get("loadMode") == 3:
+            # count only
+            return 200, {"Success": True, "Data": {"Total": settings.pages * int(page_size)}}
+        records = settings.fixture("amis_web", name)
+        return 200, {"Success": True, "Data": {"PageData": number_page(settings, records, body.get("pageIndex", 1), page_size, id_field)}}
+    return handler
+
+
+def hubspot_page(settings, name, limit, after):
+    limit = int(limit or DEFAULT_PAGE_SIZE)
+    start = int(after or 0)
+    total = settings.pages * limit
+    results = make_records(settings.fixture("hubspot", name), start, max(0, min(limit, total - start)), "id")
+    payload = {"total": total, "results": results}
+    if start + limit < total:
+        payload["paging"] = {"next": {"after": str(start + limit)}}
+    return payload
+
+
+def hubspot_list(settings, match, query, body):
+    payload = hubspot_page(settings, match.group("object_type"), query.get("limit"), query.get("after"))
+    payload.pop("total")
+    return 200, payload
+
+
+def hubspot_search(settings, match, query, body):
+    return 200, hubspot_page(settings, match.group("object_type"), body.get("limit"), body.get("after"))
+
+
+def hubspot_associations(settings, match, query, body):
+    results = [
+        {"from": {"id": item.get("id")}, "to": [{"toObjectId": item.get("id"), "associationTypes": [{"category": "HUBSPOT_DEFINED", "typeId": 1}]}]}
+        for item in body.get("inputs", [])
+    ]
+    return 200, {"status": "COMPLETE", "results": results}
+
+
+def dahahi_list(name, id_field):
+    def handler(settings, match, query, body):
+        records = settings.fixture("dahahi", name)
+        return 200, {"Data": number_page(settings, records, body.get("pageIndex", 1), body.get("pagesize", DEFAULT_PAGE_SIZE), id_field)}
+    return handler
+
+
+def lark_token(settings, match, query, body):
+    return 200, {"code": 0, "tenant_access_token": "mock-lark-token", "expire": 7200}
+
+
+def lark_ok(settings, match, query, body):
+    return 200, {"code": 0, "data": {}}
+
+
+ROUTES = [
+    ("GET", r"/pancake/v1/pages/(?P<page_id>[^/]+)/page_customers", "pancake", pancake_page_customers),
+    ("GET", r"/pancake/v2/pages/(?P<page_id>[^/]+)/conversations", "pancake", pancake_conversations),
+    ("GET", r"/pancake/v1/pages/(?P<page_id>[^/]+)/conversations/(?P<conversation_id>[^/]+)/messages", "pancake", pancake_messages),
+    ("GET", r"/pancake/v1/pages/(?P<page_id>[^/]+)/users", "pancake", pancake_users),
+    ("POST", r"/eshop/auth/api/account/login", "eshop", eshop_login),
+    ("POST", r"/eshop/[^/]+/api/v1/invoices/pagingbycustomer", "eshop", eshop_invoices),
+    ("POST", r"/eshop/[^/]+/api/v1/invoices/detailbyrefid", "eshop", eshop_invoice_details),
+    ("POST", r"/eshop/[^/]+/api/v1/inventoryitems/pagingwithdetail", "eshop", eshop_inventory_items),
+    ("POST", r"/amis/api/oauth/actopen/connect", "amis", amis_connect),
+    ("POST", r"/amis/apir/sync/actopen/get_dictionary", "amis", amis_dictionary),
+    ("POST", r"/amis_web/g2/api/auth/v1/account/login/misa_id", "amis_web", amis_web_login),
+    ("POST", r"/amis_web/g2/api/db/v1/list/get_data", "amis_web", amis_web_list("inventory_items", "inventory_item_id")),
+    ("POST", r"/amis_web/g2/api/di/v1/stock/paging_filter", "amis_web", amis_web_list("stocks", "stock_id")),
+    ("GET", r"/hubspot/crm/v3/objects/(?P<object_type>[^/]+)", "hubspot", hubspot_list),
+    ("POST", r"/hubspot/crm/v3/objects/(?P<object_type>[^/]+)/search", "hubspot", hubspot_search),
+    ("POST", r"/hubspot/crm/v4/associations/[^/]+/[^/]+/batch/read", "hubspot", hubspot_associations),
+    ("POST", r"/dahahi/api/facereg/checkinhis", "dahahi", dahahi_list("checkin_history", "FaceId")),
+    ("POST", r"/dahahi/api/facereg/GetEmployeeList", "dahahi", dahahi_list("employees", "EmployeeCode")),
+    ("POST", r"/lark/open-apis/auth/v3/tenant_access_token/internal", "lark", lark_token),
+    ("POST", r"/lark/open-apis/.*", "lark", lark_ok),
+]
+
+# config variables pointing a helper at the server, relative to its address
+BASE_URLS = {
+    "PANCAKE_BASE_URL": "/pancake",
+    "ESHOP_URL": "/eshop",
+    "AMIS_URL": "/amis",
+    "AMIS_WEB_URL": "/amis_web",
+    "HUBSPOT_BASE_URL": "/hubspot",
+    "DAHAHI_BASE_URL": "/dahahi",
+    "LARK_OPEN_URL": "/lark",
+}
+
+
+def route_label(method, pattern) -> str:
+    """
+    Readable name of a route for the stats, e.g. GET /pancake/v2/pages/{page_id}/conversations
+    """
+    path = re.sub(r"\(\?P<(\w+)>[^)]*\)", r"{\1}", pattern)
+    return f"{method} {path.replace('[^/]+', '*').replace('.*', '*')}"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real APIs
+
+    @property
+    def settings(self) -> MockSettings:
+        return self.server.settings
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+
+        if url.path == "/__stats":
+            with self.settings.lock:
+                return self.reply(200, dict(self.settings.stats))
+        if url.path == "/__reset":
+            with self.settings.lock:
+                self.settings.stats.clear()
+            return self.reply(200, {})
+
+        for route_method, pattern, source, handler in ROUTES:
+            match = re.fullmatch(pattern, url.path)
+            if route_method != method or not match:
+                continue
+
+            with self.settings.lock:
+                self.settings.stats[route_label(method, pattern)] += 1
+
+            time.sleep(self.settings.delay())
+            if self.settings.throttle(source):
+                with self.settings.lock:
+                    self.settings.stats["429"] += 1
+                return self.reply(429, {"message": "Too many requests"}, {"Retry-After": "1"})
+            if self.settings.fail():
+                with self.settings.lock:
+                    self.settings.stats["503"] += 1
+                return self.reply(503, {"message": "Service unavailable"})
+
+            try:
+                status, payload = handler(self.settings, match, query, self.parse_body(raw_body))
+            except FileNotFoundError as e:
+                return self.reply(500, {"message": f"No fixture, record it first: {e.filename}"})
+            except Exception as e:
+                return self.reply(500, {"message": f"Mock error: {e}"})
+            return self.reply(status, payload)
+
+        self.reply(404, {"message": f"No mock for {method} {url.path}"})
+
+    @staticmethod
+    def parse_body(raw_body) -> dict:
+        # login payloads may be form encoded, only JSON bodies drive the mock
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def reply(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(host="127.0.0.1", port=8765, verbose=False, **settings) -> ThreadingHTTPServer:
+    """
+    Return the mock server listening on host:port, settings are passed to MockSettings
+    """
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.settings = MockSettings(**settings)
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=10, help="full pages per paginated endpoint")
+    parser.add_argument("--messages", type=int, default=None, help="messages per Pancake conversation, one recorded page by default")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--rate-limit", type=float, default=0, help="requests per second per source, 0 for none")
+    parser.add_argument("--fixtures-dir", default=FIXTURES_DIR)
+    parser.add_argument("--seed", type=int, default=None, help="seed of latency jitter and errors, for reproducible runs")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    server = create_server(
+        host=args.host, port=args.port, verbose=args.verbose, pages=args.pages, messages=args.messages, latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms, error_rate=args.error_rate, rate_limit=args.rate_limit,
+        fixtures_dir=args.fixtures_dir, seed=args.seed,
+    )
+    address = f"http://{args.host}:{server.server_address[1]}"
+    print(f"Mock API listening on {address}, point the helpers at it with:")
+    for name, path in BASE_URLS.items():
+        print(f"export {name}={address}{path}")
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(dict(server.settings.stats), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+from helper.gcp_helper import BQHelper
+
+
+def bq_helper():
+    # any client skips the credentials, the SQL builders never call it
+    return BQHelper(logger=logging.getLogger(__name__), client=object())
+
+
+def normalize(query):
+    return " ".join(query.split())
+
+
+def test_merge_query_keeps_one_source_row_per_key():
+    query = normalize(bq_helper().build_merge_query(
+        target_table_id="project.dataset.deals",
+        source_table_id="project.staging.deals",
+        key_columns=["id", "portal_id"],
+        order_by="updated_at DESC",
+        columns=["id", "portal_id", "amount", "updated_at"],
+    ))
+
+    assert "QUALIFY ROW_NUMBER() OVER (PARTITION BY id, portal_id ORDER BY updated_at DESC) = 1" in query
+    assert "ON target.id = source.id AND target.portal_id = source.portal_id WHEN MATCHED" in query
+
+
+def test_merge_query_without_order_by_has_no_dedup():
+    query = normalize(bq_helper().build_merge_query(
+        target_table_id="project.dataset.deals",
+        source_table_id="project.staging.deals",
+        key_columns=["id"],
+        columns=["id", "amount"],
+    ))
+
+    assert "QUALIFY" not in query
+    assert "WHERE 1=1" in query
+
+
+def test_merge_query_update_and_insert_lists():
+    query = normalize(bq_helper().build_merge_query(
+        target_table_id="project.dataset.deals",
+        source_table_id="project.staging.deals",
+        key_columns=["id"],
+        columns=["id", "amount", "created_datetime", "updated_datetime"],
+        immutable_columns=["created_datetime"],
+        insert_values={"inserted_datetime": "CURRENT_DATETIME()"},
+    ))
+
+    # neither the key nor the immutable columns are updated
+    assert "UPDATE SET target.amount = source.amount, target.updated_datetime = source.updated_datetime WHEN NOT MATCHED" in query
+    # every column is inserted, plus the extra ones with their expression
+    assert (
+        "INSERT (id, amount, created_datetime, updated_datetime, inserted_datetime) "
+        "VALUES (source.id, source.amount, source.created_datetime, source.updated_datetime, CURRENT_DATETIME())"
+    ) in query
+
+
+def test_merge_query_insert_values_override_source_columns():
+    query = normalize(bq_helper().build_merge_query(
+        target_table_id="project.dataset.deals",
+        source_table_id="project.staging.deals",
+        key_columns=["id"],
+        columns=["id", "ingested_at"],
+        update_columns=["ingested_at"],
+        insert_values={"ingested_at": "CURRENT_TIMESTAMP()"},
+    ))
+
+    assert "UPDATE SET target.ingested_at = source.ingested_at" in query
+    assert "INSERT (id, ingested_at) VALUES (source.id, CURRENT_TIMESTAMP())" in query
+
+
+def test_merge_query_partition_filter_joins_the_on_clause():
+    query = normalize(bq_helper().build_merge_query(
+        target_table_id="project.dataset.invoices",
+        source_table_id="project.staging.invoices",
+        key_columns=["InvoiceId"],
+        columns=["InvoiceId", "InvoiceDate"],
+        source_filter="InvoiceId IS NOT NULL",
+        partition_filter="target.InvoiceDate BETWEEN DATETIME '2026-01-05T00:00:00' AND DATETIME '2026-01-06T00:00:00'",
+    ))
+
+    assert "WHERE InvoiceId IS NOT NULL" in query
+    assert (
+        "ON target.InvoiceId = source.InvoiceId AND "
+        "target.InvoiceDate BETWEEN DATETIME '2026-01-05T00:00:00' AND DATETIME '2026-01-06T00:00:00' WHEN MATCHED"
+    ) in query
+
+
+def test_sql_literal_escapes_quotes_and_backslashes():
+    assert BQHelper.sql_literal("O'Brien", "STRING") == "'O\\'Brien'"
+    assert BQHelper.sql_literal("C:\\temp", "STRING") == "'C:\\\\temp'"
+    # the backslash is escaped first, so an escaped quote can't close the literal
+    assert BQHelper.sql_literal("\\'", "STRING") == "'\\\\\\''"
+
+
+def test_sql_literal_numbers_and_dates():
+    assert BQHelper.sql_literal(42, "INTEGER") == "42"
+    assert BQHelper.sql_literal(1.5, "FLOAT64") == "1.5"
+    assert BQHelper.sql_literal(date(2026, 1, 5), "DATE") == "DATE '2026-01-05'"
+    assert BQHelper.sql_literal(datetime(2026, 1, 5, 2, 13, 40), "DATETIME") == "DATETIME '2026-01-05T02:13:40'"
+
+
+def test_sql_literal_tz_aware_datetime_keeps_the_wall_clock():
+    value = datetime(2026, 1, 5, 2, 13, 40, tzinfo=timezone(timedelta(hours=7)))
+
+    assert BQHelper.sql_literal(value, "DATETIME") == "DATETIME '2026-01-05T02:13:40'"
+    assert BQHelper.sql_literal(value, "TIMESTAMP") == "TIMESTAMP '2026-01-05T02:13:40+07:00'"
+
+
+def partition_bq_helper(min_value, max_value, queries):
+    bq = bq_helper()
+    bq.get_schema = lambda table_id: [("InvoiceId", "STRING"), ("InvoiceDate", "DATETIME")]
+    bq.execute = lambda query: queries.append(query) or [{"min_value": min_value, "max_value": max_value}]
+    return bq
+
+
+def test_partition_filter_covers_the_staged_range():
+    queries = []
+    bq = partition_bq_helper(datetime(2026, 1, 5, 10, 12), datetime(2026, 1, 6, 11, 40), queries)
+
+    condition = bq.build_partition_filter("project.dataset.invoices", "project.staging.invoices", "InvoiceDate")
+
+    assert condition == "target.InvoiceDate BETWEEN DATETIME '2026-01-05T10:12:00' AND DATETIME '2026-01-06T11:40:00'"
+    assert "FROM `project.staging.invoices`" in queries[0]
+
+
+def test_partition_filter_none_on_empty_source():
+    bq = partition_bq_helper(None, None, [])
+
+    assert bq.build_partition_filter("project.dataset.invoices", "project.staging.invoices", "InvoiceDate") is None
+
+
+def test_partition_filter_none_on_unknown_column():
+    queries = []
+    bq = partition_bq_helper(None, None, queries)
+
+    assert bq.build_partition_filter("project.dataset.invoices", "project.staging.invoices", "CreatedDate") is None
+    assert queries == []
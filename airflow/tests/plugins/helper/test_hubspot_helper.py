@@ -0,0 +1,68 @@
+import logging
+
+from config import config
+from helper.hubspot_helper import HubspotHelper
+
+
+def hubspot_helper(timestamps, searches):
+    """
+    HubspotHelper whose search only returns the number of timestamps in the window of the filter groups
+    """
+    hub_spot = HubspotHelper(logger=logging.getLogger(__name__))
+
+    def search_objects(object_type, limit=None, after=None, properties=None, filterGroups=None, sortGroups=None):
+        searches.append(filterGroups)
+        filters = {f["operator"]: f["value"] for f in filterGroups[0]["filters"] if f["propertyName"] == "lastmodifieddate"}
+        total = sum(1 for timestamp in timestamps if filters["GTE"] <= timestamp <= filters["LTE"])
+        return [], None, total
+
+    hub_spot.search_objects = search_objects
+    return hub_spot
+
+
+def test_window_under_the_cap_is_not_split(monkeypatch):
+    monkeypatch.setattr(config, "HUBSPOT_SEARCH_RESULT_CAP", 3)
+    searches = []
+    hub_spot = hubspot_helper([1, 5, 9], searches)
+
+    assert hub_spot.split_time_window("deals", "lastmodifieddate", 0, 9) == [(0, 9)]
+    assert len(searches) == 1
+
+
+def test_empty_window_is_dropped(monkeypatch):
+    monkeypatch.setattr(config, "HUBSPOT_SEARCH_RESULT_CAP", 3)
+    hub_spot = hubspot_helper([], [])
+
+    assert hub_spot.split_time_window("deals", "lastmodifieddate", 0, 9) == []
+
+
+def test_window_over_the_cap_is_bisected(monkeypatch):
+    monkeypatch.setattr(config, "HUBSPOT_SEARCH_RESULT_CAP", 3)
+    timestamps = list(range(10))
+    hub_spot = hubspot_helper(timestamps, [])
+
+    windows = hub_spot.split_time_window("deals", "lastmodifieddate", 0, 9)
+
+    assert windows == [(0, 2), (3, 4), (5, 7), (8, 9)]
+    # ordered, non-overlapping and every record is in exactly one window
+    assert all(previous[1] < current[0] for previous, current in zip(windows, windows[1:]))
+    assert sum(1 for timestamp in timestamps for start, end in windows if start <= timestamp <= end) == len(timestamps)
+
+
+def test_millisecond_over_the_cap_is_kept(monkeypatch):
+    monkeypatch.setattr(config, "HUBSPOT_SEARCH_RESULT_CAP", 3)
+    hub_spot = hubspot_helper([7] * 5, [])
+
+    assert hub_spot.split_time_window("deals", "lastmodifieddate", 0, 9) == [(7, 7)]
+
+
+def test_filter_groups_are_kept_in_every_search(monkeypatch):
+    monkeypatch.setattr(config, "HUBSPOT_SEARCH_RESULT_CAP", 3)
+    searches = []
+    hub_spot = hubspot_helper(list(range(10)), searches)
+    pipeline_filter = {"propertyName": "pipeline", "operator": "EQ", "value": "default"}
+
+    hub_spot.split_time_window("deals", "lastmodifieddate", 0, 9, filterGroups=[{"filters": [pipeline_filter]}])
+
+    assert len(searches) == 7
+    assert all(pipeline_filter in filter_groups[0]["filters"] for filter_groups in searches)
@@ -0,0 +1,78 @@
+import time
+import logging
+
+from helper.rate_limit_helper import RateLimiter
+
+
+def rate_limiter():
+    return RateLimiter(
+        logger=logging.getLogger(__name__),
+        max_requests_per_second=2,
+        min_requests_per_second=0.25,
+        backoff_factor=0.5,
+        recovery_step=0.5,
+    )
+
+
+def test_throttle_backs_off_down_to_the_minimum():
+    limiter = rate_limiter()
+
+    limiter.on_throttle("page")
+    assert limiter.get_bucket("page").rate == 1
+    assert limiter.get_bucket("page").tokens == 0
+
+    for _ in range(5):
+        limiter.on_throttle("page")
+    assert limiter.get_bucket("page").rate == 0.25
+
+
+def test_success_recovers_up_to_the_maximum():
+    limiter = rate_limiter()
+    for _ in range(3):
+        limiter.on_throttle("page")
+    assert limiter.get_bucket("page").rate == 0.25
+
+    limiter.on_success("page")
+    assert limiter.get_bucket("page").rate == 0.75
+
+    for _ in range(5):
+        limiter.on_success("page")
+    assert limiter.get_bucket("page").rate == 2
+
+
+def test_keys_are_throttled_independently():
+    limiter = rate_limiter()
+
+    limiter.on_throttle("page_a")
+
+    assert limiter.get_bucket("page_a").rate == 1
+    assert limiter.get_bucket("page_b").rate == 2
+
+
+def test_retry_after_pauses_the_key():
+    limiter = rate_limiter()
+
+    before = time.monotonic()
+    limiter.on_throttle("page", retry_after="3")
+
+    assert limiter.get_bucket("page").blocked_until >= before + 3
+    assert limiter.get_bucket("page").blocked_until <= time.monotonic() + 3
+
+
+def test_a_shorter_retry_after_does_not_shorten_the_pause():
+    limiter = rate_limiter()
+
+    limiter.on_throttle("page", retry_after=10)
+    blocked_until = limiter.get_bucket("page").blocked_until
+    limiter.on_throttle("page", retry_after=1)
+
+    assert limiter.get_bucket("page").blocked_until == blocked_until
+
+
+def test_parse_retry_after():
+    assert RateLimiter.parse_retry_after("2.5") == 2.5
+    assert RateLimiter.parse_retry_after(5) == 5.0
+    assert RateLimiter.parse_retry_after("-1") == 0.0
+    assert RateLimiter.parse_retry_after(None) is None
+    # the HTTP-date form is not supported, the backoff alone applies
+    assert RateLimiter.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None